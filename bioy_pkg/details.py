@@ -0,0 +1,243 @@
+# This file is part of Bioy
+#
+#    Bioy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Bioy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Bioy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Writer for the details output of the classifier
+
+Details are written a partition (a DataFrame of whole specimens) at a
+time, either as csv or in a columnar npz file.  A csv file ending in .gz
+or .bz2 is compressed by a pool of threads while the next partition is
+classified: gzip files are written as one gzip member per block of
+rows compressed in parallel, bz2 files as a single stream compressed in
+order in the background (so the file is the same as one written by
+bz2.BZ2File).
+
+An npz file is a zip archive of arrays readable with numpy.load (no
+pickled objects) laid out as:
+
+    - columns -- the column names in order
+    - NNNNN/column -- the values of a column of partition NNNNN
+    - NNNNN/column.nulls -- a mask of null values of a column holding
+      strings or other objects, if any are null
+
+read_details returns the partitions of an npz file as a single
+DataFrame.
+"""
+
+import bz2
+import collections
+import io
+import logging
+import sys
+import zipfile
+import zlib
+
+from multiprocessing.pool import ThreadPool
+
+import numpy
+import pandas
+
+from bioy_pkg import utils
+
+log = logging.getLogger(__name__)
+
+# rows of csv compressed at a time
+BLOCK_ROWS = 20000
+
+
+def _gzip(data, level=9):
+    """Return `data' compressed as a complete gzip member"""
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _column(values):
+    """Return an array of the values of Series `values' and a mask of
+    nulls (None if there are none) from which _values restores it.
+    """
+
+    if values.dtype != object:
+        return values.values, None
+
+    nulls = values.isnull().values
+    present = values[~nulls].tolist()
+    if all(isinstance(v, basestring) for v in present):
+        array = values.fillna('').values.astype(str)
+    else:
+        array = numpy.zeros(len(values), dtype=numpy.array(present).dtype)
+        array[~nulls] = present
+
+    return array, (nulls if nulls.any() else None)
+
+
+def _values(array, nulls=None):
+    """Inverse of _column"""
+
+    if nulls is None and array.dtype.kind not in 'SU':
+        return array
+
+    values = array.astype(object)
+    if nulls is not None:
+        values[nulls] = numpy.nan
+    return values
+
+
+def _npy(array):
+    f = io.BytesIO()
+    numpy.lib.format.write_array(f, array)
+    return f.getvalue()
+
+
+class DetailsWriter(object):
+
+    """Write partitions of details to `pth' in order
+
+    Keyword Arguments:
+        - pth -- file name, or '-' for stdout (csv only)
+        - fmt -- one of `formats'
+        - threads -- number of threads compressing gzip csv blocks
+        - float_format -- format of floats in csv
+    """
+
+    formats = ['csv', 'npz']
+
+    def __init__(self, pth, fmt='csv', threads=1, float_format='%.2f'):
+        if fmt not in self.formats:
+            raise ValueError('unknown details format {}'.format(fmt))
+
+        self.pth = pth
+        self.fmt = fmt
+        self.float_format = float_format
+        self.partitions = 0
+        self.columns = None
+
+        self.pool = self.compressor = None
+        self.pending = collections.deque()
+
+        if fmt == 'npz':
+            self.out = zipfile.ZipFile(pth, 'w', allowZip64=True)
+        elif pth.endswith('.gz'):
+            self.out = open(pth, 'wb')
+            self.pool = ThreadPool(processes=max(threads, 1))
+            self.compress = _gzip
+        elif pth.endswith('.bz2'):
+            # a bz2 stream is compressed in order by a single thread
+            self.out = open(pth, 'wb')
+            self.pool = ThreadPool(processes=1)
+            self.compressor = bz2.BZ2Compressor(9)
+            self.compress = self.compressor.compress
+        else:
+            self.out = utils.opener(pth, 'w')
+
+    def write(self, details):
+        """Write a partition of details"""
+
+        if self.columns is None:
+            self.columns = details.columns.tolist()
+            if self.fmt == 'npz':
+                self.out.writestr('columns.npy', _npy(
+                    numpy.array(self.columns, dtype=str)))
+
+        if self.fmt == 'npz':
+            self._write_npz(details)
+        else:
+            self._write_csv(details)
+        self.partitions += 1
+
+    def _write_npz(self, details):
+        prefix = '{:05d}/'.format(self.partitions)
+        for name in self.columns:
+            array, nulls = _column(details[name])
+            self.out.writestr(prefix + name + '.npy', _npy(array))
+            if nulls is not None:
+                self.out.writestr(prefix + name + '.nulls.npy', _npy(nulls))
+
+    def _write_csv(self, details):
+        for start in xrange(0, max(len(details), 1), BLOCK_ROWS):
+            self.write_text(details.iloc[start:start + BLOCK_ROWS].to_csv(
+                None,
+                header=not self.partitions and not start,
+                index=False,
+                float_format=self.float_format))
+
+    def write_text(self, block):
+        """Write (and compress) a block of csv text"""
+
+        if self.fmt != 'csv':
+            raise ValueError('text can only be written as csv')
+
+        if self.pool is None:
+            self.out.write(block)
+            return
+
+        self.pending.append(self.pool.apply_async(self.compress, (block,)))
+        # write compressed blocks that are ready, in order
+        while self.pending and self.pending[0].ready():
+            self.out.write(self.pending.popleft().get())
+
+    def close(self):
+        """Write any pending blocks and close the output"""
+
+        while self.pending:
+            self.out.write(self.pending.popleft().get())
+
+        if self.compressor is not None:
+            self.out.write(self.compressor.flush())
+            self.compressor = None
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+        if self.out is not sys.stdout:
+            self.out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_details(pth):
+    """Return the details in npz file `pth' written by DetailsWriter as a
+    DataFrame.
+    """
+
+    npz = numpy.load(pth)
+    try:
+        names = set(npz.files)
+        if 'columns' not in names:
+            return pandas.DataFrame()
+        columns = [str(c) for c in npz['columns']]
+
+        partitions = []
+        while True:
+            prefix = '{:05d}/'.format(len(partitions))
+            if prefix + columns[0] not in names:
+                break
+            partition = collections.OrderedDict()
+            for name in columns:
+                nulls = prefix + name + '.nulls'
+                partition[name] = _values(
+                    npz[prefix + name], npz[nulls] if nulls in names else None)
+            partitions.append(pandas.DataFrame(partition))
+    finally:
+        npz.close()
+
+    if not partitions:
+        return pandas.DataFrame(columns=columns)
+    return pandas.concat(partitions, ignore_index=True)
@@ -0,0 +1,465 @@
+# This file is part of Bioy
+#
+#    Bioy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Bioy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Bioy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reference data used by the classifier and its compiled bundle format
+
+The seq_info, taxonomy, rank thresholds and copy numbers inputs of
+``bioy classifier`` are loaded into a References object holding integer
+coded arrays.  A References object can be saved to a single bundle file
+and memory mapped back, skipping the csv parsing and threshold
+resolution on every run.
+
+A bundle is laid out as:
+
+    - MAGIC
+    - the length of the header as a little endian uint64
+    - a json header with the bundle version, ranks, sha1 digests of the
+      input files and an offset, dtype and shape for each array
+    - the raw arrays, each aligned to ALIGN bytes
+
+Strings are stored as fixed width arrays and stay memory mapped on load;
+reference sequences are stored sorted by name and the sort order of the
+taxonomy tax_ids is stored so both are looked up by binary search.
+Only the rows reaching the output are converted to Python strings (see
+References.seq_rows and References.seq_info_frame).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+
+from collections import OrderedDict
+
+import numpy
+import pandas
+
+from bioy_pkg import _data as datadir
+from bioy_pkg.taxtable import Taxonomy
+
+log = logging.getLogger(__name__)
+
+MAGIC = 'BIOYREFS'
+VERSION = 2
+ALIGN = 64
+
+DEFAULT_RANK_THRESHOLDS = os.path.join(datadir, 'rank_thresholds.csv')
+
+# input files described by the digests of a bundle
+INPUTS = ['seq_info', 'taxonomy', 'rank_thresholds', 'copy_numbers']
+
+
+def file_hash(pth, blocksize=1 << 20):
+    """Return the sha1 hex digest of the contents of `pth' or None if
+    `pth' is None.
+    """
+
+    if pth is None:
+        return None
+
+    checksum = hashlib.sha1()
+    with open(pth, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), ''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def input_hashes(seq_info, taxonomy, rank_thresholds=None, copy_numbers=None):
+    """Return a dict of sha1 digests of the input files, including the
+    packaged default rank thresholds.
+    """
+
+    hashes = {k: file_hash(v) for k, v in zip(
+        INPUTS, [seq_info, taxonomy, rank_thresholds, copy_numbers])}
+    hashes['default_rank_thresholds'] = file_hash(DEFAULT_RANK_THRESHOLDS)
+    return hashes
+
+
+def load_rank_thresholds(path=DEFAULT_RANK_THRESHOLDS, usecols=None):
+    """Load a rank-thresholds file.  If no argument is specified the default
+    rank_threshold_defaults.csv file will be loaded.
+    """
+
+    return pandas.read_csv(
+        path,
+        comment='#',
+        usecols=['tax_id'] + usecols,
+        dtype=dict(tax_id=str)).set_index('tax_id')
+
+
+def load_copy_numbers(path):
+    """Load a copy numbers file with columns tax_id and median"""
+
+    return pandas.read_csv(
+        path,
+        dtype=dict(tax_id=str, median=float),
+        usecols=['tax_id', 'median']).set_index('tax_id')
+
+
+def resolve_thresholds(taxonomy, thresholds):
+    """Return arrays indexed by taxonomy code giving the rank (a position
+    in taxonomy.ranks) and the row of `thresholds' of the most specific
+    ancestor of each node (or the node itself) with a threshold, -1 for
+    both where no ancestor has one.
+    """
+
+    codes = taxonomy.codes(thresholds.index)
+    found = codes != -1
+
+    # an extra trailing -1 is indexed by missing (-1) lineage codes
+    by_code = numpy.full(len(taxonomy) + 1, -1, dtype=numpy.int32)
+    by_code[codes[found]] = numpy.flatnonzero(found)
+    rows = by_code[taxonomy.lineages]
+
+    present = rows != -1
+    ranks = rows.shape[1] - 1 - present[:, ::-1].argmax(axis=1)
+    rows = rows[numpy.arange(len(taxonomy)), ranks]
+    ranks[rows == -1] = -1
+
+    return ranks.astype(numpy.int32), rows
+
+
+def _strings(values):
+    """Return a fixed width string array of `values' and a mask of null
+    values (stored as '').
+    """
+
+    values = pandas.Series(values)
+    nulls = values.isnull().values
+    return values.fillna('').values.astype(str), nulls
+
+
+def _objects(strings, nulls=None):
+    """Inverse of _strings"""
+
+    values = numpy.asarray(strings).astype(object)
+    if nulls is not None:
+        values[nulls] = numpy.nan
+    return values
+
+
+class References(object):
+
+    """Classifier reference data coded against a Taxonomy
+
+    Attributes:
+        - taxonomy -- a taxtable.Taxonomy
+        - seqnames -- reference sequence names in sorted order
+        - seq_codes -- taxonomy code of each reference sequence, -1 if its
+          tax_id is not in the taxonomy
+        - accessions -- accession of each reference sequence
+        - accession_nulls -- mask of missing accessions (stored as '') or
+          None if missing accessions are nan in `accessions'
+        - thresholds -- (rows x taxonomy.ranks) matrix of rank thresholds
+        - threshold_ranks, threshold_rows -- see resolve_thresholds
+        - copy_numbers -- median copy number by taxonomy code (nan if
+          missing) or None if no copy numbers were provided
+        - hashes -- sha1 digests of the input files (see input_hashes)
+    """
+
+    def __init__(self, taxonomy, seqnames, seq_codes, accessions,
+                 thresholds, threshold_ranks, threshold_rows,
+                 copy_numbers=None, hashes=None, accession_nulls=None):
+        self.taxonomy = taxonomy
+        self.seqnames = seqnames
+        self.seq_codes = seq_codes
+        self.accessions = accessions
+        self.accession_nulls = accession_nulls
+        self.thresholds = thresholds
+        self.threshold_ranks = threshold_ranks
+        self.threshold_rows = threshold_rows
+        self.copy_numbers = copy_numbers
+        self.hashes = hashes or {}
+
+    @classmethod
+    def from_csv(cls, seq_info, taxonomy, rank_thresholds=None,
+                 copy_numbers=None):
+        """Load and code the classifier reference files"""
+
+        hashes = input_hashes(seq_info, taxonomy, rank_thresholds, copy_numbers)
+
+        # Rank specificity as ordered from left (less specific) to
+        # right (more specific)
+        log.info('loading taxonomy file')
+        taxonomy = Taxonomy(pandas.read_csv(taxonomy, dtype=str)
+                            .set_index('tax_id'))
+        ranks = taxonomy.ranks
+
+        log.info('loading seq_info file')
+        seq_info = pandas.read_csv(
+            seq_info,
+            usecols=['seqname', 'tax_id', 'accession'],
+            dtype=dict(seqname=str, tax_id=str, accession=str))
+        seq_info['seqname'] = seq_info['seqname'].fillna('')
+        seq_info = seq_info.sort_values('seqname', kind='mergesort')
+
+        # load the default rank thresholds and any additional
+        # thresholds specified by the user
+        log.info('loading rank thresholds')
+        thresholds = load_rank_thresholds(usecols=ranks)
+        if rank_thresholds:
+            thresholds = thresholds.append(
+                load_rank_thresholds(path=rank_thresholds, usecols=ranks))
+            # overwrite with user defined tax_id threshold
+            thresholds = thresholds.groupby(level=0, sort=False).last()
+        thresholds = thresholds[taxonomy.codes(thresholds.index) != -1]
+        threshold_ranks, threshold_rows = resolve_thresholds(
+            taxonomy, thresholds)
+
+        if copy_numbers:
+            log.info('loading copy numbers file')
+            copy_numbers = load_copy_numbers(copy_numbers)
+            codes = taxonomy.codes(copy_numbers.index)
+            found = codes != -1
+            by_code = numpy.full(len(taxonomy), numpy.nan)
+            by_code[codes[found]] = copy_numbers['median'].values[found]
+            copy_numbers = by_code
+
+        return cls(taxonomy,
+                   seqnames=seq_info['seqname'].values,
+                   seq_codes=taxonomy.codes(seq_info['tax_id']),
+                   accessions=seq_info['accession'].values,
+                   thresholds=thresholds[ranks].values.astype(float),
+                   threshold_ranks=threshold_ranks,
+                   threshold_rows=threshold_rows,
+                   copy_numbers=copy_numbers,
+                   hashes=hashes)
+
+    @classmethod
+    def load(cls, pth):
+        """Memory map a bundle written by References.save"""
+
+        with open(pth, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(
+                    '{} is not a classifier reference bundle'.format(pth))
+            length, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(length))
+
+        if header['version'] != VERSION:
+            raise ValueError('{} has bundle version {}, expected {}'.format(
+                pth, header['version'], VERSION))
+
+        start = _aligned(len(MAGIC) + 8 + length)
+        arrays = {}
+        for name, dtype, shape, offset in header['arrays']:
+            shape = tuple(shape)
+            if numpy.prod(shape) == 0:
+                # mmap cannot map an empty region
+                arrays[name] = numpy.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = numpy.memmap(
+                    pth, dtype=dtype, mode='r', offset=start + offset,
+                    shape=shape)
+
+        taxonomy = Taxonomy.from_arrays(
+            [str(r) for r in header['ranks']],
+            arrays['tax_ids'],
+            arrays['names'],
+            arrays['node_ranks'],
+            arrays['lineages'],
+            arrays['parents'],
+            order=arrays['tax_id_order'])
+
+        return cls(taxonomy,
+                   seqnames=arrays['seqnames'],
+                   seq_codes=arrays['seq_codes'],
+                   accessions=arrays['accessions'],
+                   accession_nulls=arrays['accession_nulls'],
+                   thresholds=arrays['thresholds'],
+                   threshold_ranks=arrays['threshold_ranks'],
+                   threshold_rows=arrays['threshold_rows'],
+                   copy_numbers=arrays.get('copy_numbers'),
+                   hashes=header['hashes'])
+
+    def save(self, pth):
+        """Write a bundle to `pth' (replaced atomically)"""
+
+        taxonomy = self.taxonomy
+        tax_ids = _strings(taxonomy.tax_ids)[0]
+        seqnames = _strings(self.seqnames)[0]
+        seq_order = numpy.argsort(seqnames, kind='mergesort')
+        accessions, accession_nulls = _strings(
+            _objects(self.accessions, self.accession_nulls))
+        arrays = OrderedDict([
+            ('tax_ids', tax_ids),
+            ('tax_id_order', numpy.argsort(
+                tax_ids, kind='mergesort').astype(numpy.int32)),
+            ('names', _strings(taxonomy.names)[0]),
+            ('node_ranks', _strings(taxonomy.node_ranks)[0]),
+            ('lineages', taxonomy.lineages),
+            ('parents', taxonomy.parents.astype(numpy.int32)),
+            ('seqnames', seqnames[seq_order]),
+            ('seq_codes', self.seq_codes.astype(numpy.int32)[seq_order]),
+            ('accessions', accessions[seq_order]),
+            ('accession_nulls', accession_nulls[seq_order]),
+            ('thresholds', self.thresholds),
+            ('threshold_ranks', self.threshold_ranks),
+            ('threshold_rows', self.threshold_rows.astype(numpy.int32)),
+        ])
+        if self.copy_numbers is not None:
+            arrays['copy_numbers'] = self.copy_numbers
+
+        table, offset = [], 0
+        for name, a in arrays.items():
+            a = numpy.ascontiguousarray(a)
+            arrays[name] = a
+            table.append([name, a.dtype.str, a.shape, offset])
+            offset = _aligned(offset + a.nbytes)
+
+        header = json.dumps(dict(version=VERSION,
+                                 ranks=taxonomy.ranks,
+                                 hashes=self.hashes,
+                                 arrays=table))
+
+        dirname = os.path.dirname(os.path.abspath(pth))
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(MAGIC)
+                f.write(struct.pack('<Q', len(header)))
+                f.write(header)
+                start = _aligned(f.tell())
+                for (name, dtype, shape, offset), a in zip(
+                        table, arrays.values()):
+                    f.write('\0' * (start + offset - f.tell()))
+                    f.write(a.tobytes())
+            # mkstemp creates files readable only by the owner
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp, 0o666 & ~umask)
+            os.rename(tmp, pth)
+        except:
+            os.remove(tmp)
+            raise
+
+    def changed(self, hashes):
+        """Return a list of inputs in `hashes' (as from input_hashes)
+        differing from the digests the bundle was built from.
+        """
+
+        return [k for k in sorted(hashes) if hashes[k] != self.hashes.get(k)]
+
+    def seq_rows(self, sseqids):
+        """Return an array of the rows of the reference sequences named in
+        `sseqids' (every row of a name appearing more than once) found by
+        binary search of the sorted seqnames.
+        """
+
+        names = pandas.Series(sseqids).dropna().unique().astype(str)
+        if self.seqnames.dtype.kind == 'S':
+            # names longer than the fixed width cannot match
+            width = self.seqnames.dtype.itemsize
+            names = names[numpy.vectorize(len, otypes=[int])(names) <= width]
+        else:
+            names = names.astype(object)
+
+        starts = numpy.searchsorted(self.seqnames, names, side='left')
+        counts = numpy.searchsorted(self.seqnames, names, side='right') - starts
+        offsets = numpy.arange(counts.sum()) - numpy.repeat(
+            numpy.cumsum(counts) - counts, counts)
+        return numpy.sort(numpy.repeat(starts, counts) + offsets)
+
+    def seq_info_frame(self, rows=None, codes=False):
+        """DataFrame indexed by sseqid with columns tax_id and accession of
+        reference sequences `rows' (all by default).  With `codes' tax_id
+        holds float taxonomy codes (see Taxonomy.to_frame).
+        """
+
+        if rows is None:
+            rows = numpy.arange(len(self.seqnames))
+        seq_codes = self.seq_codes[rows]
+        if codes:
+            tax_ids = numpy.where(seq_codes != -1, seq_codes, numpy.nan)
+        else:
+            tax_ids = numpy.where(
+                seq_codes != -1,
+                _objects(self.taxonomy.tax_ids[seq_codes]),
+                numpy.nan)
+        nulls = self.accession_nulls
+        accessions = _objects(
+            self.accessions[rows], None if nulls is None else nulls[rows])
+        return pandas.DataFrame(
+            OrderedDict([('tax_id', tax_ids), ('accession', accessions)]),
+            index=pandas.Index(
+                _objects(self.seqnames[rows]), name='sseqid'))
+
+    @property
+    def seq_info(self):
+        """DataFrame indexed by sseqid with columns tax_id and accession"""
+
+        return self.seq_info_frame()
+
+    def frames(self, sseqids, codes=False):
+        """Return the seq_info DataFrame of the reference sequences named
+        in `sseqids' and the taxonomy DataFrame (see Taxonomy.to_frame) of
+        their tax_ids and all of their ancestors.
+        """
+
+        rows = self.seq_rows(sseqids)
+        seq_codes = self.seq_codes[rows]
+        seq_codes = seq_codes[seq_codes != -1]
+        taxa = numpy.union1d(seq_codes, self.taxonomy.lineages[seq_codes])
+        taxa = taxa[taxa != -1]
+        return (self.seq_info_frame(rows, codes=codes),
+                self.taxonomy.to_frame(codes=codes, rows=taxa))
+
+    def copy_number_frame(self, codes=False):
+        """DataFrame of copy numbers indexed by tax_id (or with `codes' by
+        the float taxonomy code, see Taxonomy.to_frame) with column median
+        """
+
+        found = ~numpy.isnan(self.copy_numbers)
+        if codes:
+            index = numpy.flatnonzero(found).astype(float)
+        else:
+            index = _objects(self.taxonomy.tax_ids[found])
+        return pandas.DataFrame(
+            {'median': self.copy_numbers[found]},
+            index=pandas.Index(index, name='tax_id'))
+
+
+def build(pth, seq_info, taxonomy, rank_thresholds=None, copy_numbers=None,
+          force=False):
+    """Return References from the bundle `pth' if it was built from the
+    current contents of the input files, otherwise load the input files
+    and (re)write the bundle.
+    """
+
+    if os.path.exists(pth) and not force:
+        hashes = input_hashes(seq_info, taxonomy, rank_thresholds, copy_numbers)
+        try:
+            references = References.load(pth)
+        except ValueError as err:
+            log.warn('rebuilding {}: {}'.format(pth, err))
+        else:
+            changed = references.changed(hashes)
+            if not changed:
+                log.info('{} is up to date'.format(pth))
+                return references
+            log.warn('rebuilding {}, changed inputs: {}'.format(
+                pth, ', '.join(changed)))
+
+    references = References.from_csv(
+        seq_info, taxonomy, rank_thresholds, copy_numbers)
+    log.info('writing {}'.format(pth))
+    references.save(pth)
+    return references
+
+
+def _aligned(n):
+    return n + -n % ALIGN
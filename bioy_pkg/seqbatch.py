@@ -0,0 +1,172 @@
+# This file is part of Bioy
+#
+#    Bioy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Bioy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Bioy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compact in-memory collections of sequence records
+
+A SeqBatch holds the ids, descriptions and sequences of its records each
+concatenated in a single string (an arena) with an array of the offset
+of each record in the arena, in place of a list of sequtils.SeqLite
+tuples of three strings each.  Records are returned as SeqLite when
+indexed or iterated.
+
+Slicing, sorting and grouping a SeqBatch return views sharing the arenas
+of the batch, holding only an array of the rows of their records.
+"""
+
+import logging
+
+from itertools import islice, izip, repeat
+
+import numpy
+
+from bioy_pkg.sequtils import SeqLite, fastalite
+
+log = logging.getLogger(__name__)
+
+# records joined into the arenas at a time
+CHUNK_RECORDS = 10000
+
+# arenas in order of the SeqLite fields
+FIELDS = SeqLite._fields
+
+
+def _offsets(lengths):
+    """Return an array of the start of each of `lengths' and the total"""
+
+    offsets = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+class SeqBatch(object):
+
+    """An immutable collection of SeqLite records
+
+    Attributes:
+        - arenas -- dict of field name (id, description and seq) to the
+          field of every record of the batch concatenated
+        - offsets -- dict of field name to an array of the offset of each
+          record in the arena and its total length
+        - rows -- array of the records in this view of the batch
+    """
+
+    def __init__(self, arenas, offsets, rows=None):
+        self.arenas = arenas
+        self.offsets = offsets
+        if rows is None:
+            rows = numpy.arange(len(offsets['seq']) - 1)
+        self.rows = rows
+
+    @classmethod
+    def from_records(cls, records, chunksize=CHUNK_RECORDS):
+        """Return a SeqBatch of an iterable of SeqLite records"""
+
+        records = iter(records)
+        pieces = {field: [] for field in FIELDS}
+        lengths = {field: [] for field in FIELDS}
+        for chunk in iter(lambda: list(islice(records, chunksize)), []):
+            for field, strings in zip(FIELDS, izip(*chunk)):
+                pieces[field].append(''.join(strings))
+                lengths[field].append(numpy.fromiter(
+                    (len(s) for s in strings), numpy.int64, len(chunk)))
+
+        arenas = {f: ''.join(pieces[f]) for f in FIELDS}
+        offsets = {f: _offsets(numpy.concatenate(lengths[f])
+                               if lengths[f] else []) for f in FIELDS}
+        return cls(arenas, offsets)
+
+    @classmethod
+    def from_fasta(cls, handle, limit=None):
+        """Return a SeqBatch of the records of fasta file-like object
+        `handle' (see sequtils.fastalite)
+        """
+
+        return cls.from_records(fastalite(handle, limit))
+
+    def _view(self, rows):
+        return SeqBatch(self.arenas, self.offsets, rows)
+
+    def _field(self, field, rows):
+        arena, offsets = self.arenas[field], self.offsets[field]
+        starts, stops = offsets[rows].tolist(), offsets[rows + 1].tolist()
+        return (arena[start:stop] for start, stop in izip(starts, stops))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        fields = [self._field(f, self.rows) for f in FIELDS]
+        # construct the namedtuples without calling SeqLite.__new__
+        return (tuple.__new__(cls, r)
+                for cls, r in izip(repeat(SeqLite), izip(*fields)))
+
+    def __getitem__(self, i):
+        """Return the SeqLite of record `i' or a view of a slice, index
+        array or boolean mask of the records
+        """
+
+        if isinstance(i, (int, long, numpy.integer)):
+            rows = self.rows[[i]]
+            return SeqLite(*[next(self._field(f, rows)) for f in FIELDS])
+        return self._view(self.rows[i])
+
+    def id_list(self):
+        """Return a list of the ids of the records"""
+
+        return list(self._field('id', self.rows))
+
+    def seq_list(self):
+        """Return a list of the sequences of the records"""
+
+        return list(self._field('seq', self.rows))
+
+    @property
+    def lengths(self):
+        """Array of the sequence length of each record"""
+
+        offsets = self.offsets['seq']
+        return offsets[self.rows + 1] - offsets[self.rows]
+
+    @property
+    def nbytes(self):
+        """Bytes held by the arenas and arrays of the batch"""
+
+        return (sum(len(a) for a in self.arenas.values()) +
+                sum(a.nbytes for a in self.offsets.values()) +
+                self.rows.nbytes)
+
+    def sort(self, keys):
+        """Return a view of the records in order of `keys', an array-like
+        of a key of each record; records with equal keys stay in order
+        (as with sorted)
+        """
+
+        order = numpy.argsort(numpy.asarray(keys), kind='mergesort')
+        return self._view(self.rows[order])
+
+    def groupby(self, keys):
+        """Return an iterator of (key, view) of the records of each
+        distinct value of `keys' in sorted order (as with sorted then
+        itertools.groupby)
+        """
+
+        keys = numpy.asarray(keys)
+        order = numpy.argsort(keys, kind='mergesort')
+        keys, rows = keys[order], self.rows[order]
+        bounds = numpy.flatnonzero(keys[1:] != keys[:-1]) + 1
+        bounds = [0] + bounds.tolist() + [len(keys)]
+        for start, stop in izip(bounds[:-1], bounds[1:]):
+            if start < stop:
+                yield keys[start], self._view(rows[start:stop])
@@ -0,0 +1,233 @@
+# This file is part of Bioy
+#
+#    Bioy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Bioy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Bioy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Read fasta and fastq files in parallel
+
+An uncompressed fasta or fastq file is split into byte ranges of about
+RANGE_BYTES, each starting at a record, and each range is read and
+parsed (with sequtils.fastalite or sequtils.fastqlite) in a pool of
+worker processes.  Batches of records are returned in the order of the
+file or as they are parsed, optionally passed through a function in the
+worker first so that per-record work is spread over the pool too.
+
+Compressed files and streams (stdin, pipes) can not be split; they are
+parsed in the calling process in batches of BATCH_RECORDS, and only the
+function is applied in the pool.
+
+Fastq ranges assume four line records, as does fastqlite.
+"""
+
+import collections
+import logging
+import os
+
+from itertools import islice
+from multiprocessing import Pool
+
+from bioy_pkg import utils
+from bioy_pkg.sequtils import fastalite, fastqlite
+
+log = logging.getLogger(__name__)
+
+# approximate bytes of a range of records parsed by a worker
+RANGE_BYTES = 1 << 24
+
+# records per batch of a file that can not be split
+BATCH_RECORDS = 10000
+
+# bytes read at a time looking for the start of a record
+SCAN_BYTES = 1 << 16
+
+# seconds to wait for a batch before checking the others (unordered)
+POLL_SECONDS = 0.01
+
+parsers = {'fasta': fastalite, 'fastq': fastqlite}
+
+
+def _fastq_start(lines):
+    """Return the index of the first line of `lines' (after the first,
+    which may be partial) starting a four line fastq record, or None.
+    A quality line may start with '@' but is never followed two lines on
+    by a line starting with '+'.
+    """
+
+    for i in xrange(1, len(lines) - 2):
+        if lines[i].startswith('@') and lines[i + 2].startswith('+'):
+            return i
+    return None
+
+
+def record_start(f, offset, fmt='fasta'):
+    """Return the offset of the first record starting at or after
+    `offset' in open file `f' (or the end of the file).
+    """
+
+    if offset <= 0:
+        return 0
+
+    f.seek(offset - 1)
+    text = ''
+    while True:
+        block = f.read(SCAN_BYTES)
+        text += block
+
+        if fmt == 'fasta':
+            i = text.find('\n>')
+            if i >= 0:
+                return offset + i
+        else:
+            lines = text.split('\n')
+            i = _fastq_start(lines)
+            if i is not None:
+                return offset - 1 + sum(len(line) + 1 for line in lines[:i])
+
+        if not block:
+            return offset - 1 + len(text)
+
+
+def byte_ranges(pth, fmt='fasta', size=RANGE_BYTES):
+    """Return a list of (start, stop) byte offsets of ranges of whole
+    records of about `size' bytes of fasta or fastq file `pth'.
+    """
+
+    total = os.path.getsize(pth)
+    with open(pth, 'rb') as f:
+        starts = [record_start(f, offset, fmt)
+                  for offset in xrange(0, total, max(size, 1))]
+
+    starts = sorted(set(starts)) + [total]
+    return [(start, stop) for start, stop in zip(starts, starts[1:])
+            if start < stop]
+
+
+def _read_range(job):
+    """Return the records (passed through func) in a range of a file"""
+
+    pth, fmt, start, stop, func = job
+    with open(pth, 'rb') as f:
+        f.seek(start)
+        blocks = [f.read(stop - start)]
+        # fastalite drops the last record of a file if it has no
+        # sequence, so a range ending before the end of the file is
+        # followed by a record without a description (which is skipped)
+        if fmt == 'fasta' and stop < os.fstat(f.fileno()).st_size:
+            blocks.append('>\n')
+
+    records = list(parsers[fmt](blocks))
+    return func(records) if func else records
+
+
+def _apply(job):
+    func, records = job
+    return func(records)
+
+
+def _pool_map(pool, func, jobs, ordered=True, queued=2):
+    """Return func(job) for each of `jobs' run in `pool' in order of
+    `jobs' or as they are completed, with at most `queued' jobs
+    submitted at a time (bounding the results held in memory).
+    """
+
+    jobs = iter(jobs)
+    pending = collections.deque()
+    while True:
+        for job in islice(jobs, queued - len(pending)):
+            pending.append(pool.apply_async(func, (job,)))
+        if not pending:
+            return
+
+        if ordered:
+            result = pending.popleft()
+        else:
+            result = next((r for r in pending if r.ready()), None)
+            while result is None:
+                pending[0].wait(POLL_SECONDS)
+                result = next((r for r in pending if r.ready()), None)
+            pending.remove(result)
+
+        yield result.get()
+
+
+def _splittable(handle):
+    """Return the name of the file of `handle' (a file name or an open
+    file) if it can be read in byte ranges, otherwise None.
+    """
+
+    pth = handle if isinstance(handle, basestring) else getattr(
+        handle, 'name', None)
+    if (isinstance(handle, (basestring, file)) and
+            isinstance(pth, basestring) and
+            not pth.endswith(('.bz2', '.gz')) and os.path.isfile(pth)):
+        return pth
+    return None
+
+
+def read_batches(handle, fmt='fasta', threads=1, ordered=True, func=None,
+                 size=RANGE_BYTES):
+    """Return an iterator of lists of records of fasta or fastq file
+    `handle' (a file name or an open file) parsed by `threads' worker
+    processes, in order of the file unless not `ordered'.
+
+    Keyword Arguments:
+        - fmt -- 'fasta' or 'fastq'
+        - threads -- number of worker processes
+        - ordered -- return batches in order of the file
+        - func -- function (importable by the workers) applied to each
+          list of records before it is returned
+        - size -- approximate bytes of a range of records
+    """
+
+    if fmt not in parsers:
+        raise ValueError('unknown sequence format {}'.format(fmt))
+
+    pth = _splittable(handle)
+    if threads <= 1:
+        handle = utils.opener(handle) if isinstance(
+            handle, basestring) else handle
+        records = parsers[fmt](handle)
+        for batch in iter(lambda: list(islice(records, BATCH_RECORDS)), []):
+            yield func(batch) if func else batch
+        return
+
+    pool = Pool(processes=threads)
+    try:
+        if pth:
+            jobs = ((pth, fmt, start, stop, func)
+                    for start, stop in byte_ranges(pth, fmt, size))
+            batches = _pool_map(pool, _read_range, jobs, ordered, 2 * threads)
+        else:
+            if isinstance(handle, basestring):
+                handle = utils.opener(handle)
+            records = parsers[fmt](handle)
+            batches = iter(lambda: list(islice(records, BATCH_RECORDS)), [])
+            if func:
+                batches = _pool_map(pool, _apply, ((func, b) for b in batches),
+                                    ordered, 2 * threads)
+
+        for batch in batches:
+            yield batch
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def read_records(handle, fmt='fasta', threads=1, func=None):
+    """Return an iterator of the records of `handle' in order (see
+    read_batches)
+    """
+
+    for batch in read_batches(handle, fmt, threads, func=func):
+        for record in batch:
+            yield record
@@ -0,0 +1,377 @@
+# This file is part of Bioy
+#
+#    Bioy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Bioy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Bioy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Random access to the records of a fasta file by id
+
+Like ``samtools faidx``, an uncompressed fasta file is indexed once and
+the index is reused until the size or modification time of the fasta
+file changes.  The index is a numpy array of (id, offset, length) of
+each record sorted by id saved after a header giving the size and
+modification time of the fasta file it was built from and the number of
+records dropped for a repeated id (two arrays in .npy format), next to
+the fasta file as FASTA + INDEX_SUFFIX or, where that can not be
+written, in a user cache directory (see cache_index).  It is memory
+mapped, as is the fasta file, so looking up records does not read
+either into memory.
+
+Records are parsed as by sequtils.fastalite: records without a
+description are skipped, the last record is dropped if it has no
+sequence and the last of records with the same id is kept.
+
+Compressed files and streams can not be indexed; load reads them into
+a RecordDict (holding a seqbatch.SeqBatch) with the same interface, as
+it does fasta files for which no index can be written.
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import re
+import tempfile
+
+import numpy
+
+from numpy.lib import format as npformat
+
+from bioy_pkg import utils
+from bioy_pkg.seqbatch import SeqBatch
+from bioy_pkg.sequtils import SeqLite, fastalite, _fasta_parse
+
+log = logging.getLogger(__name__)
+
+INDEX_SUFFIX = '.idx'
+
+# size and modification time of the indexed fasta file and the number
+# of its records dropped for a repeated id
+HEADER_DTYPE = numpy.dtype([('size', numpy.int64),
+                            ('mtime', numpy.float64),
+                            ('duplicates', numpy.int64)])
+
+_header = re.compile(r'^>([^\n]*)', re.MULTILINE)
+
+
+def indexable(pth):
+    """Return True if `pth' names an uncompressed regular file"""
+
+    return (isinstance(pth, basestring) and
+            not pth.endswith(('.bz2', '.gz')) and os.path.isfile(pth))
+
+
+def _record(text):
+    """Return a SeqLite of the text of a single fasta record"""
+
+    names, seqs = _fasta_parse(text)
+    name = names[0]
+    return SeqLite(name.split(None, 1)[0], name, seqs[0])
+
+
+def cache_index(pth):
+    """Return the path of the index of fasta file `pth' in the user
+    cache directory ($XDG_CACHE_HOME/bioy, by default ~/.cache/bioy)
+    """
+
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    digest = hashlib.sha1(os.path.abspath(pth)).hexdigest()
+    return os.path.join(cache, 'bioy', digest + INDEX_SUFFIX)
+
+
+def _header_of(pth, duplicates=0):
+    st = os.stat(pth)
+    return numpy.array([(st.st_size, st.st_mtime, duplicates)],
+                       dtype=HEADER_DTYPE)
+
+
+def read_index(pth, index):
+    """Return the header (see HEADER_DTYPE) and the index array (memory
+    mapped) in file `index' if it was built from the current fasta file
+    `pth', otherwise None.
+    """
+
+    current = _header_of(pth)[0]
+    try:
+        with open(index, 'rb') as f:
+            header = npformat.read_array(f)
+            if (header.dtype != HEADER_DTYPE or
+                    header['size'][0] != current['size'] or
+                    header['mtime'][0] != current['mtime']):
+                return None
+            if npformat.read_magic(f) == (1, 0):
+                shape, _, dtype = npformat.read_array_header_1_0(f)
+            else:
+                shape, _, dtype = npformat.read_array_header_2_0(f)
+            offset = f.tell()
+    except (IOError, ValueError):
+        return None
+
+    if not shape[0]:
+        # mmap cannot map an empty region
+        records = numpy.empty(shape, dtype=dtype)
+    else:
+        records = numpy.memmap(index, dtype=dtype, mode='r', offset=offset,
+                               shape=shape)
+    return header[0], records
+
+
+def build_index(pth, index=None):
+    """Index fasta file `pth', writing the index to `index' (default
+    `pth' + INDEX_SUFFIX).  Return the index array.  Raises OSError or
+    IOError if the index can not be written.
+    """
+
+    index = index or pth + INDEX_SUFFIX
+    header = _header_of(pth)
+    size = header['size'][0]
+
+    names, offsets = [], []
+    if size:
+        with open(pth, 'rb') as f:
+            text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for match in _header.finditer(text):
+                    names.append(match.group(1).strip())
+                    offsets.append(match.start())
+                # the last record is dropped without a sequence
+                if offsets and not _fasta_parse(text[offsets[-1]:])[1][0]:
+                    names.pop()
+                    offsets.pop()
+            finally:
+                text.close()
+
+    offsets = numpy.array(offsets, dtype=numpy.int64)
+    lengths = numpy.diff(numpy.append(offsets, size))
+
+    # records without a description are skipped
+    keep = numpy.array([bool(name) for name in names], dtype=bool)
+    ids = [name.split(None, 1)[0] for name in names if name]
+
+    records = numpy.empty(len(ids), dtype=[
+        ('id', numpy.array(ids or [''], dtype=str).dtype),
+        ('offset', numpy.int64),
+        ('length', numpy.int64)])
+    records['id'] = ids
+    records['offset'] = offsets[keep]
+    records['length'] = lengths[keep]
+
+    # the last of records with the same id is kept
+    records = records[::-1]
+    _, first = numpy.unique(records['id'], return_index=True)
+    header['duplicates'] = len(records) - len(first)
+    records = records[first]
+
+    dirname = os.path.dirname(os.path.abspath(index))
+    fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            numpy.save(f, header)
+            numpy.save(f, records)
+        os.rename(tmp, index)
+    except:
+        os.remove(tmp)
+        raise
+
+    log.info('indexed {} records of {} in {}'.format(
+        len(records), pth, index))
+    return records
+
+
+class SeqStore(object):
+
+    """Records of an indexed fasta file looked up by id
+
+    The index is built if it is missing or was built from a fasta file
+    of a different size or modification time.  Without an explicit
+    `index' an index that can not be written next to the fasta file is
+    written to the user cache (see cache_index); OSError or IOError is
+    raised if neither can be written.  Records are returned as
+    sequtils.SeqLite.  `duplicates' is the number of records dropped for
+    a repeated id.
+    """
+
+    def __init__(self, pth, index=None):
+        self.pth = pth
+        if index:
+            found = read_index(pth, index)
+            if found is None:
+                build_index(pth, index)
+                found = read_index(pth, index)
+        else:
+            found = self._default_index(pth)
+        if found is None:
+            raise IOError('{} changed while it was indexed'.format(pth))
+        header, self.index = found
+        self.duplicates = int(header['duplicates'])
+        self._text = None
+        if len(self.index):
+            with open(pth, 'rb') as f:
+                self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def _default_index(pth):
+        local, cached = pth + INDEX_SUFFIX, cache_index(pth)
+        for index in [local, cached]:
+            found = read_index(pth, index)
+            if found is not None:
+                return found
+
+        try:
+            build_index(pth, local)
+            return read_index(pth, local)
+        except (IOError, OSError) as err:
+            log.warning('can not write {} ({}), using {}'.format(
+                local, err, cached))
+
+        if not os.path.isdir(os.path.dirname(cached)):
+            os.makedirs(os.path.dirname(cached))
+        build_index(pth, cached)
+        return read_index(pth, cached)
+
+    def close(self):
+        if self._text is not None:
+            self._text.close()
+            self._text = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, seq_id):
+        return self.rows([seq_id])[0] != -1
+
+    def __getitem__(self, seq_id):
+        return self.fetch([seq_id])[0]
+
+    def get(self, seq_id, default=None):
+        row = self.rows([seq_id])[0]
+        return default if row == -1 else self._read(row)
+
+    @property
+    def ids(self):
+        """Record ids in sorted order"""
+
+        return self.index['id']
+
+    def rows(self, ids):
+        """Return an array of the rows of the index of each of `ids', -1
+        where an id is not in the index
+        """
+
+        ids = numpy.asarray(ids, dtype=str)
+        rows = numpy.searchsorted(self.index['id'], ids)
+        rows[rows == len(self.index)] = 0
+        found = len(self.index) and self.index['id'][rows] == ids
+        return numpy.where(found, rows, -1)
+
+    def _read(self, row):
+        offset, length = self.index['offset'][row], self.index['length'][row]
+        return _record(self._text[offset:offset + length])
+
+    def fetch(self, ids):
+        """Return a list of the records of `ids' in order, raising
+        KeyError for an id not in the index
+        """
+
+        rows = self.rows(ids)
+        if (rows == -1).any():
+            raise KeyError(numpy.asarray(ids)[rows == -1][0])
+        return [self._read(row) for row in rows]
+
+    def select(self, ids):
+        """Return an iterator of the records of `ids' in the index in
+        order of the fasta file
+        """
+
+        rows = self.rows(ids)
+        rows = numpy.unique(rows[rows != -1])
+        rows = rows[numpy.argsort(self.index['offset'][rows], kind='mergesort')]
+        return (self._read(row) for row in rows)
+
+
+class RecordDict(SeqStore):
+
+    """Records of a fasta file held in memory in a SeqBatch with the
+    interface of a SeqStore
+    """
+
+    def __init__(self, records):
+        self.pth = None
+        self._text = None
+
+        batch = SeqBatch.from_records(records)
+        ids = numpy.array(batch.id_list() or [''], dtype=str)[:len(batch)]
+
+        # the last of records with the same id is kept
+        _, first = numpy.unique(ids[::-1], return_index=True)
+        rows = len(ids) - 1 - first
+
+        # offsets are positions of records in the file
+        self.index = numpy.empty(len(rows), dtype=[
+            ('id', ids.dtype), ('offset', numpy.int64)])
+        self.index['id'] = ids[rows]
+        self.index['offset'] = rows
+        self.batch = batch[rows]
+        self.duplicates = len(batch) - len(rows)
+
+    def _read(self, row):
+        return self.batch[row]
+
+
+def load(handle, index=None):
+    """Return a SeqStore of fasta file `handle' (a file name or an open
+    file) if it can be indexed, otherwise a RecordDict of its records.
+    """
+
+    pth = handle if isinstance(handle, basestring) else getattr(
+        handle, 'name', None)
+    if indexable(pth):
+        try:
+            return SeqStore(pth, index)
+        except (IOError, OSError) as err:
+            log.warning('{} can not be indexed ({}), reading records '
+                        'into memory'.format(pth, err))
+    else:
+        log.info('{} can not be indexed, reading records into memory'.format(
+            pth or handle))
+
+    if isinstance(handle, basestring):
+        handle = utils.opener(handle)
+    return RecordDict(fastalite(handle))
+
+
+def select(handle, ids, index=None):
+    """Return an iterator of the records of `ids' in fasta file `handle'
+    in order of the file, using an index if the file can be indexed and
+    otherwise reading the whole file.
+    """
+
+    pth = handle if isinstance(handle, basestring) else getattr(
+        handle, 'name', None)
+    if indexable(pth):
+        try:
+            return SeqStore(pth, index).select(ids)
+        except (IOError, OSError) as err:
+            log.warning('{} can not be indexed ({}), reading the whole '
+                        'file'.format(pth, err))
+
+    if isinstance(handle, basestring):
+        handle = utils.opener(handle)
+    ids = set(ids)
+    return (r for r in fastalite(handle) if r.id in ids)
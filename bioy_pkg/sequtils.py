@@ -23,7 +23,8 @@ import subprocess
 import utils
 
 from cStringIO import StringIO
-from itertools import tee, izip_longest, groupby, takewhile, izip
+from itertools import (chain, tee, izip_longest, groupby, takewhile, izip,
+                       imap, islice, repeat)
 from collections import Counter, defaultdict, namedtuple
 from operator import itemgetter
 from subprocess import Popen, PIPE
@@ -74,6 +75,11 @@ IUPAC = {('A',): 'A',
 
 CAPUI = {v: set(k) for k, v in IUPAC.items()}
 
+# complement of each IUPAC code, gaps are their own complement
+COMPLEMENT = {v: IUPAC[tuple(sorted(
+    {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}.get(b, b) for b in k))]
+    for k, v in IUPAC.items()}
+
 # provides criteria for defining matching tax_ids as "unclassified"
 UNCLASSIFIED_REGEX = re.compile(
     r'' + r'|'.join(frozenset(['-like',
@@ -156,31 +162,132 @@ def homodecodealignment(seq1, counts1, seq2, counts2, insertion=homogap):
     assert len(seq1.replace(gap, '').replace(insertion, '')) == len(counts1)
     assert len(seq2.replace(gap, '').replace(insertion, '')) == len(counts2)
 
-    if not seq1:
-        return seq1, homodecode(seq2, counts2)
-    if not seq2:
-        return homodecode(seq1, counts1), seq2
-
-    assert not seq1[0] == seq2[0] == gap
-
-    if seq1[0] == gap:
-        suff1, suff2 = homodecodealignment(
-            seq1[1:], counts1, seq2[1:], counts2[1:])
-        deseq1 = gap * counts2[0] + suff1
-        deseq2 = seq2[0] * counts2[0] + suff2
-    elif seq2[0] == gap:
-        suff1, suff2 = homodecodealignment(
-            seq1[1:], counts1[1:], seq2[1:], counts2)
-        deseq1 = seq1[0] * counts1[0] + suff1
-        deseq2 = gap * counts1[0] + suff2
-    else:
-        m = max(counts1[0], counts2[0])
-        suff1, suff2 = homodecodealignment(
-            seq1[1:], counts1[1:], seq2[1:], counts2[1:])
-        deseq1 = seq1[0] * counts1[0] + insertion * (m - counts1[0]) + suff1
-        deseq2 = seq2[0] * counts2[0] + insertion * (m - counts2[0]) + suff2
+    pieces1, pieces2 = [], []
+    n1 = n2 = 0
+    for c1, c2 in izip(seq1, seq2):
+        assert not c1 == c2 == gap
+
+        if c1 == gap:
+            count = counts2[n2]
+            pieces1.append(gap * count)
+            pieces2.append(c2 * count)
+            n2 += 1
+        elif c2 == gap:
+            count = counts1[n1]
+            pieces1.append(c1 * count)
+            pieces2.append(gap * count)
+            n1 += 1
+        else:
+            count1, count2 = counts1[n1], counts2[n2]
+            m = max(count1, count2)
+            pieces1.append(c1 * count1 + insertion * (m - count1))
+            pieces2.append(c2 * count2 + insertion * (m - count2))
+            n1 += 1
+            n2 += 1
+
+    # the rest of the longer sequence
+    columns = min(len(seq1), len(seq2))
+    pieces1.append(homodecode(seq1[columns:], counts1[n1:], insertion))
+    pieces2.append(homodecode(seq2[columns:], counts2[n2:], insertion))
+
+    return ''.join(pieces1), ''.join(pieces2)
+
+
+def homodecodealignment_many(seqs1, counts1, offsets1,
+                             seqs2, counts2, offsets2, insertion=homogap):
+    """Decode lists of pairs of aligned, run length encoded sequences
+
+    *counts1* is a flat array of the counts of all of *seqs1* with
+    counts1[offsets1[i]:offsets1[i + 1]] the counts of seqs1[i], as
+    returned by homoencode_many or from_ascii_many, and likewise for
+    *seqs2*.  Returns a 2-tuple of lists of the decoded sequences,
+    each pair as by homodecodealignment.
+    """
+
+    seqs1, seqs2 = list(seqs1), list(seqs2)
+    counts1 = numpy.asarray(counts1, dtype=numpy.int64)
+    counts2 = numpy.asarray(counts2, dtype=numpy.int64)
+    offsets1 = numpy.asarray(offsets1, dtype=numpy.int64)
+    offsets2 = numpy.asarray(offsets2, dtype=numpy.int64)
+
+    lengths = numpy.fromiter((len(s) for s in seqs1), numpy.int64, len(seqs1))
+    aligned = lengths == numpy.fromiter(
+        (len(s) for s in seqs2), numpy.int64, len(seqs2))
+    decoded1, decoded2 = [None] * len(seqs1), [None] * len(seqs2)
+
+    # pairs of unequal length are decoded one at a time
+    for i in numpy.flatnonzero(~aligned):
+        decoded1[i], decoded2[i] = homodecodealignment(
+            seqs1[i], counts1[offsets1[i]:offsets1[i + 1]].tolist(),
+            seqs2[i], counts2[offsets2[i]:offsets2[i + 1]].tolist(),
+            insertion)
+
+    rows = numpy.flatnonzero(aligned)
+    lengths = lengths[rows]
+    chars1 = numpy.frombuffer(
+        ''.join(seqs1[i] for i in rows), dtype=numpy.uint8)
+    chars2 = numpy.frombuffer(
+        ''.join(seqs2[i] for i in rows), dtype=numpy.uint8)
+    local = numpy.repeat(numpy.arange(len(rows)), lengths)
+    owner = rows[local]
+    starts = numpy.cumsum(lengths) - lengths
+
+    gaps1, gaps2 = chars1 == ord(gap), chars2 == ord(gap)
+    assert not (gaps1 & gaps2).any()
+
+    def column_counts(gaps, counts, offsets):
+        # count of the base of each column, 0 in gaps
+        bases = numpy.append(0, numpy.cumsum(~gaps))
+        assert (bases[starts + lengths] - bases[starts] ==
+                numpy.diff(offsets)[rows]).all()
+        used = bases[:-1] - bases[starts][local]
+        column = numpy.zeros(len(gaps), dtype=numpy.int64)
+        column[~gaps] = counts[offsets[owner[~gaps]] + used[~gaps]]
+        return column
+
+    column1 = column_counts(gaps1, counts1, offsets1)
+    column2 = column_counts(gaps2, counts2, offsets2)
+    widths = numpy.maximum(column1, column2)
+
+    def expand(chars, gaps, column):
+        # each column is its character then insertions to the width
+        # of the column, or a gap the width of the column
+        column = numpy.where(gaps, widths, column)
+        pairs = numpy.empty(2 * len(chars), dtype=numpy.uint8)
+        pairs[::2], pairs[1::2] = chars, ord(insertion)
+        repeats = numpy.empty(2 * len(chars), dtype=numpy.int64)
+        repeats[::2], repeats[1::2] = column, widths - column
+        return numpy.repeat(pairs, repeats).tobytes()
+
+    text1 = expand(chars1, gaps1, column1)
+    text2 = expand(chars2, gaps2, column2)
+    bounds = numpy.append(0, numpy.cumsum(widths))[
+        numpy.append(starts, len(chars1))].tolist()
+    for i, start, stop in izip(rows.tolist(), bounds, bounds[1:]):
+        decoded1[i], decoded2[i] = text1[start:stop], text2[start:stop]
+
+    return decoded1, decoded2
+
+
+def decode_alignments(aligns, decoding, chunksize=1000):
+    """Return an iterator of the dicts of ssearch alignments `aligns'
+    (see parse_ssearch36) with t_seq and q_seq decoded with the ascii
+    encoded run length counts of t_name and q_name in dict `decoding',
+    `chunksize' alignments at a time.
+    """
 
-    return deseq1, deseq2
+    aligns = iter(aligns)
+    for chunk in iter(lambda: list(islice(aligns, chunksize)), []):
+        counts1, offsets1 = from_ascii_many(
+            [decoding[a['t_name']] for a in chunk])
+        counts2, offsets2 = from_ascii_many(
+            [decoding[a['q_name']] for a in chunk])
+        seqs1, seqs2 = homodecodealignment_many(
+            [a['t_seq'] for a in chunk], counts1, offsets1,
+            [a['q_seq'] for a in chunk], counts2, offsets2)
+        for a, seq1, seq2 in izip(chunk, seqs1, seqs2):
+            a['t_seq'], a['q_seq'] = seq1, seq2
+            yield a
 
 
 def homodecode(seq, counts, insertion=homogap):
@@ -196,12 +303,96 @@ def homodecode(seq, counts, insertion=homogap):
     *seq* that are not - or = (both representations for gaps.
     """
 
-    if not seq or not counts:
-        return seq
-    elif seq[0] == gap or seq[0] == insertion:
-        return gap + homodecode(seq[1:], counts)
-    else:
-        return seq[0] * counts[0] + homodecode(seq[1:], counts[1:])
+    counts = list(counts)
+    pieces, n = [], 0
+    for i, c in enumerate(seq):
+        if n == len(counts):
+            # the rest of seq is returned as is once counts run out
+            pieces.append(seq[i:])
+            break
+        elif c == gap or c == insertion:
+            pieces.append(gap)
+        else:
+            pieces.append(c * counts[n])
+            n += 1
+
+    return ''.join(pieces)
+
+
+def homoencode_many(seqs):
+    """Run length encode a list of strings at once
+
+    Returns a 3-tuple (rle_seqs, counts, offsets) where rle_seqs is a
+    list of the run length encoded sequences, counts is a flat array of
+    the lengths of the homopolymers of all of the sequences and
+    counts[offsets[i]:offsets[i + 1]] are the counts of rle_seqs[i].
+    Sequences are upper cased as by homoencode.
+    """
+
+    seqs = [seq.upper() for seq in seqs]
+    text = ''.join(seqs)
+    assert gap not in text
+
+    lengths = numpy.fromiter((len(s) for s in seqs), numpy.int64, len(seqs))
+    starts = numpy.cumsum(lengths) - lengths
+    chars = numpy.frombuffer(text, dtype=numpy.uint8)
+
+    # a run starts at each change of character or start of a sequence
+    boundaries = numpy.ones(len(chars), dtype=bool)
+    boundaries[1:] = chars[1:] != chars[:-1]
+    boundaries[starts[lengths > 0]] = True
+    runs = numpy.flatnonzero(boundaries)
+
+    counts = numpy.diff(numpy.append(runs, len(chars)))
+    offsets = numpy.append(numpy.searchsorted(runs, starts), len(runs))
+    encoded = chars[runs].tobytes()
+    bounds = offsets.tolist()
+    rle_seqs = [encoded[start:stop]
+                for start, stop in izip(bounds, bounds[1:])]
+    return rle_seqs, counts, offsets
+
+
+def homodecode_many(seqs, counts, offsets, insertion=homogap):
+    """Expand a list of run length encoded strings at once
+
+    *counts* is a flat array of the homopolymer lengths of all of the
+    sequences with counts[offsets[i]:offsets[i + 1]] the counts of
+    seqs[i], as returned by homoencode_many.  Returns a list of the
+    decoded sequences, each as by homodecode.
+    """
+
+    lengths = numpy.fromiter((len(s) for s in seqs), numpy.int64, len(seqs))
+    ends = numpy.cumsum(lengths)
+    chars = numpy.frombuffer(''.join(seqs), dtype=numpy.uint8).copy()
+    counts = numpy.asarray(counts, dtype=numpy.int64)
+    offsets = numpy.asarray(offsets, dtype=numpy.int64)
+
+    gaps = (chars == ord(gap)) | (chars == ord(insertion))
+    bases = numpy.cumsum(~gaps)
+
+    # bases of all of the sequences before each sequence
+    before = numpy.zeros(len(seqs), dtype=numpy.int64)
+    nonempty = ends > 0
+    before[1:] = numpy.where(nonempty[:-1], bases[ends[:-1] - 1], 0) \
+        if len(chars) else 0
+
+    # counts of each position's sequence used before the position
+    owner = numpy.repeat(numpy.arange(len(seqs)), lengths)
+    used = bases - before[owner] - ~gaps
+    available = numpy.diff(offsets)[owner]
+
+    # as in homodecode the rest of a sequence is left as is once its
+    # counts run out
+    raw = used >= available
+    coded = ~gaps & ~raw
+    repeats = numpy.ones(len(chars), dtype=numpy.int64)
+    repeats[coded] = counts[offsets[owner[coded]] + used[coded]]
+    chars[gaps & ~raw] = ord(gap)
+
+    decoded = numpy.repeat(chars, repeats).tobytes()
+    bounds = numpy.append(0, numpy.cumsum(repeats))[
+        numpy.append(0, ends)].tolist()
+    return [decoded[start:stop] for start, stop in izip(bounds, bounds[1:])]
 
 
 def to_ascii(nums):
@@ -225,87 +416,330 @@ def from_ascii(chars):
     return [ord(c) - 48 for c in chars]
 
 
-def cons_rle(c, ceiling=False):
+def to_ascii_many(counts, offsets):
+    """
+    Return a list of the ascii encoding (see to_ascii) of each
+    counts[offsets[i]:offsets[i + 1]] of a flat array of counts.
+    """
+
+    counts = numpy.asarray(counts)
+    if len(counts) and counts.max() > 78:
+        raise ValueError('values over 78 are not allowed')
+
+    chars = (counts + 48).astype(numpy.uint8).tobytes()
+    bounds = numpy.asarray(offsets).tolist()
+    return [chars[start:stop] for start, stop in izip(bounds, bounds[1:])]
+
+
+def from_ascii_many(chars):
     """
-    Choose a consensus run length given counts of run lengths in
-    Counter object `c`. Choose the most common run length count. In
-    the case of ties, choose the smaller value.
+    Decode a list of ascii-encoded lists of integers into a flat
+    array of integers and the offsets of each list (see to_ascii_many).
     """
 
-    # TODO: return counts for only chosen cons base
-    most_common = c.most_common()
-    _, top_freq = most_common[0]
-    most_common = [cnt for cnt, freq in most_common if freq == top_freq]
-    most_common = sorted(most_common, reverse=ceiling)
+    lengths = numpy.fromiter((len(c) for c in chars), numpy.int64, len(chars))
+    counts = numpy.frombuffer(''.join(chars), dtype=numpy.uint8)
+    return (counts.astype(numpy.int64) - 48,
+            numpy.append(0, numpy.cumsum(lengths)))
 
-    return most_common[0]
 
+# 2 bit codes of packed bases (either case), 255 for characters stored
+# as exceptions
+PACKED_BASES = 'ACGT'
+_pack_codes = numpy.full(256, 255, dtype=numpy.uint8)
+for _code, _base in enumerate(PACKED_BASES):
+    _pack_codes[[ord(_base), ord(_base.lower())]] = _code
+_pack_table = _pack_codes.tobytes()
+_unpack_chars = numpy.frombuffer(PACKED_BASES, dtype=numpy.uint8)
 
-def cons_char(c, gap_ratio=0.5):
+
+def _pack_codes_of(codes):
     """
-    Choose a consensus character given counts of characters in Counter
-    object `c`.
+    Return a string of 2 bit `codes` (a uint8 array with a multiple
+    of 4 elements) packed 4 to a byte, first code in the high bits.
     """
 
-    # if gap char freq more than half then return gaps, else remove gap char
-    if float(c[gap]) / sum(c.values()) > gap_ratio:
-        return gap
+    codes = codes.reshape(-1, 4)
+    return ((codes[:, 0] << 6) | (codes[:, 1] << 4) |
+            (codes[:, 2] << 2) | codes[:, 3]).astype(numpy.uint8).tobytes()
+
 
-    del c[gap]
+class PackedSeq(namedtuple('PackedSeq', 'packed, length, exceptions')):
+    """
+    A nucleotide sequence stored at 2 bits per base.
 
-    most_common = c.most_common()
-    _, top_freq = most_common[0]
-    most_common = [ch.upper() for ch, freq in most_common if freq == top_freq]
-    most_common = sorted(most_common)
+    `packed` holds the bases 4 to a byte, `length` is the number of
+    bases and bases other than ACGT (IUPAC codes, gaps) are kept in a
+    tuple of (position, character) `exceptions` and packed as A.
+    Sequences are upper cased.  As tuples, PackedSeqs compare and hash
+    by value so they can be used in place of a checksum of the sequence.
 
-    return IUPAC[tuple(most_common)]
+    PackedSeq(seq) packs a string; use pack_seqs to pack many at once.
+    """
 
+    __slots__ = ()
+
+    def __new__(cls, seq=''):
+        return pack_seqs([seq])[0]
+
+    def __reduce__(self):
+        return (_packed_seq, tuple(self))
+
+    def __str__(self):
+        chars = _unpack_chars[self.codes()]
+        for i, c in self.exceptions:
+            chars[i] = ord(c)
+        return chars.tobytes()
+
+    def __repr__(self):
+        return 'PackedSeq({!r})'.format(str(self))
+
+    def codes(self):
+        """
+        Return a uint8 array of the 2 bit code of each base (exceptions
+        are coded as A).
+        """
+
+        packed = numpy.frombuffer(self.packed, dtype=numpy.uint8)
+        codes = numpy.empty((len(packed), 4), dtype=numpy.uint8)
+        for i, shift in enumerate([6, 4, 2, 0]):
+            codes[:, i] = (packed >> shift) & 3
+        return codes.ravel()[:self.length]
+
+    def reverse_complement(self):
+        """
+        Return the reverse complement as a PackedSeq.
+        """
+
+        codes = 3 - self.codes()[::-1]
+        exceptions = tuple(sorted(
+            (self.length - 1 - i, COMPLEMENT.get(c, c))
+            for i, c in self.exceptions))
+        # exceptions are packed as A
+        codes[[i for i, _ in exceptions]] = 0
+        pad = numpy.zeros(-len(codes) % 4, dtype=numpy.uint8)
+        return _packed_seq(_pack_codes_of(numpy.append(codes, pad)),
+                           self.length, exceptions)
+
+    def kmers(self, k):
+        """
+        Return a uint64 array of the 2k bit codes of the k-mers of the
+        sequence (first base in the high bits) in order, skipping k-mers
+        overlapping an exception.  k must be between 1 and 32.
+        """
+
+        if not 0 < k <= 32:
+            raise ValueError('k must be between 1 and 32')
+
+        n = self.length - k + 1
+        if n <= 0:
+            return numpy.empty(0, dtype=numpy.uint64)
+
+        codes = self.codes().astype(numpy.uint64)
+        kmers = numpy.zeros(n, dtype=numpy.uint64)
+        for j in xrange(k):
+            kmers <<= numpy.uint64(2)
+            kmers |= codes[j:j + n]
+
+        if self.exceptions:
+            # count of exceptions overlapping each k-mer
+            bad = numpy.zeros(self.length + 1, dtype=numpy.int64)
+            for i, _ in self.exceptions:
+                bad[max(i - k + 1, 0)] += 1
+                bad[i + 1] -= 1
+            kmers = kmers[numpy.cumsum(bad)[:n] == 0]
+        return kmers
+
+
+def _packed_seq(packed, length, exceptions=()):
+    return tuple.__new__(PackedSeq, (packed, length, exceptions))
+
+
+def pack_seqs(seqs):
+    """
+    Return a list of a PackedSeq of each of the strings in `seqs`,
+    packing all of them with a single pass of array operations.
+    """
 
-def get_char_counts(seqs):
+    seqs = list(seqs)
+    if not seqs:
+        return []
+
+    # each sequence is padded with A to a multiple of 4 bases
+    lengths = numpy.fromiter((len(s) for s in seqs), numpy.int64, len(seqs))
+    pads = -lengths % 4
+    text = ''.join([s + 'AAA'[:pad] for s, pad in izip(seqs, pads.tolist())])
+    starts = numpy.cumsum(lengths + pads) - (lengths + pads)
+
+    codes = numpy.frombuffer(text.translate(_pack_table), dtype=numpy.uint8)
+
+    exceptions = [()] * len(seqs)
+    bad = numpy.flatnonzero(codes == 255)
+    if len(bad):
+        owners = numpy.searchsorted(starts, bad, side='right') - 1
+        found = defaultdict(list)
+        for owner, i, position in izip(owners.tolist(), bad.tolist(),
+                                       (bad - starts[owners]).tolist()):
+            found[owner].append((position, text[i].upper()))
+        for owner, excs in found.items():
+            exceptions[owner] = tuple(excs)
+        codes = codes.copy()
+        codes[bad] = 0
+
+    packed = _pack_codes_of(codes)
+
+    bounds = (starts // 4).tolist() + [len(packed)]
+    packs = (packed[start:stop] for start, stop in izip(bounds, bounds[1:]))
+    # construct the namedtuples without calling PackedSeq.__new__
+    return list(imap(tuple.__new__, repeat(PackedSeq),
+                     izip(packs, lengths.tolist(), exceptions)))
+
+
+# symbols tallied in each column of a consensus profile
+PROFILE_SYMBOLS = 'ACGT' + gap + homogap
+
+
+def _profile_tables():
+    # symbols of each character, all False for characters not in CAPUI
+    symbols = numpy.zeros((256, len(PROFILE_SYMBOLS)), dtype=bool)
+    valid = numpy.zeros(256, dtype=bool)
+    for c, bases in CAPUI.items():
+        valid[ord(c)] = True
+        for b in bases:
+            symbols[ord(c), PROFILE_SYMBOLS.index(b)] = True
+
+    # IUPAC code of each set of tied symbols as a bit mask, 0 where
+    # the set has no code
+    codes = numpy.zeros(2 ** len(PROFILE_SYMBOLS), dtype=numpy.uint8)
+    for mask in xrange(1, len(codes)):
+        tied = tuple(sorted(b for i, b in enumerate(PROFILE_SYMBOLS)
+                            if mask & (1 << i)))
+        codes[mask] = ord(IUPAC.get(tied, '\0'))
+    # a column of only gaps is a gap
+    codes[0] = ord(gap)
+    return symbols, valid, codes
+
+_profile_symbols, _profile_valid, _profile_codes = _profile_tables()
+
+
+def _profile_columns(seqs):
+    """Return an array of the characters of `seqs' (a list of strings)
+    and an array of the column of each character
     """
-    Return a list of Counter objects for each position of a sequence
-    of iterables in `seqs`.
+
+    lengths = numpy.fromiter((len(s) for s in seqs), numpy.int64, len(seqs))
+    chars = numpy.frombuffer(''.join(seqs), dtype=numpy.uint8)
+
+    invalid = ~_profile_valid[chars]
+    if invalid.any():
+        raise KeyError(chr(chars[invalid][0]))
+
+    starts = numpy.cumsum(lengths) - lengths
+    columns = numpy.arange(len(chars)) - numpy.repeat(starts, lengths)
+    return chars, columns
+
+
+def _tally(columns, values, width):
+    """Return a (max(columns) + 1 x width) array counting each value in
+    each column
     """
 
-    counter = defaultdict(Counter)
-    for seq in seqs:
-        for i, c in enumerate(seq.seq):
-            for b in CAPUI[c]:
-                counter[i][b] += 1
+    ncols = columns.max() + 1 if len(columns) else 0
+    counts = numpy.bincount(columns * width + values,
+                            minlength=ncols * width)
+    return counts.reshape(ncols, width)
 
-    # counters, sorted by position
-    return [count for position, count in sorted(counter.items())]
 
+def char_counts(seqs):
+    """
+    Return a (columns x PROFILE_SYMBOLS) array counting the symbols
+    of each position of the sequences of the records in `seqs`.
+    Ambiguity codes count once for each of their bases.
+    """
 
-def get_rle_counts(seqs, rlelist):
+    chars, columns = _profile_columns([s.seq for s in seqs])
+    rows, symbols = numpy.nonzero(_profile_symbols[chars])
+    return _tally(columns[rows], symbols, len(PROFILE_SYMBOLS))
+
+
+def rle_counts(seqs, rlelist):
     """
-    Return a list of two-tuples: (char_count, rle_count) where
-    char_count and rle_count are Counter objects tallying characters
-    and run length counts, respectively for each position of sequences
-    in in `seqs`.
+    Return a two-tuple: (char_counts, run_counts) where char_counts is
+    as returned by char_counts and run_counts is a (columns x max run
+    length + 1) array counting the run lengths of each position of the
+    sequences of the records in `seqs`.
 
      * seqs - sequence of SeqRecord objects
      * rlelist - sequence of lists of run length
                  counts correponding to seach sequence
     """
 
-    char_counter = defaultdict(Counter)
-    rle_counter = defaultdict(Counter)
-    for seq, rle_counts in izip_longest(seqs, rlelist):
-        assert len(seq.seq.replace(gap, '')) == len(rle_counts)
+    seqs = [s.seq for s in seqs]
+    rlelist = list(rlelist)
+    assert len(seqs) == len(rlelist)
+
+    chars, columns = _profile_columns(seqs)
+    rows, symbols = numpy.nonzero(_profile_symbols[chars])
+    char_counts = _tally(columns[rows], symbols, len(PROFILE_SYMBOLS))
+
+    # each non-gap character has the next run length of its sequence;
+    # gaps have a run length of 1
+    lengths = numpy.fromiter((len(r) for r in rlelist), numpy.int64,
+                             len(rlelist))
+    runs = numpy.fromiter(chain.from_iterable(rlelist), numpy.int64,
+                          lengths.sum())
+    bases = chars != ord(gap)
+    owners = numpy.repeat(numpy.arange(len(seqs)), [len(s) for s in seqs])
+    assert (numpy.bincount(owners[bases], minlength=len(seqs)) ==
+            lengths).all()
+
+    run_lengths = numpy.ones(len(chars), dtype=numpy.int64)
+    run_lengths[bases] = runs
+    width = run_lengths.max() + 1 if len(run_lengths) else 1
+    return char_counts, _tally(columns, run_lengths, width)
+
+
+def cons_rles(counts, ceiling=False):
+    """
+    Choose a consensus run length of each column of run length counts
+    `counts` (see rle_counts): the most common run length or the
+    smallest of those equally common, or the largest if `ceiling`.
+    """
+
+    if ceiling:
+        return counts.shape[1] - 1 - numpy.argmax(counts[:, ::-1], axis=1)
+    return numpy.argmax(counts, axis=1)
+
+
+def cons_chars(counts, gap_ratio=0.5):
+    """
+    Choose a consensus character of each column of symbol counts
+    `counts` (see char_counts), returned as a string: a gap if the
+    fraction of gaps is more than `gap_ratio`, otherwise the IUPAC
+    code of the most common symbols other than gaps.
+    """
+
+    counts = numpy.asarray(counts)
+    if not len(counts):
+        return ''
 
-        rle_counts = iter(rle_counts)
+    gaps = counts[:, PROFILE_SYMBOLS.index(gap)]
+    is_gap = gaps.astype(float) / counts.sum(axis=1) > gap_ratio
 
-        # for each non-gap character in seq, tally the run length; if
-        # c is a gap, save a tally of 1
-        for i, c in enumerate(seq.seq):
-            for b in CAPUI[c]:
-                char_counter[i][b] += 1
-            rle_counter[i][rle_counts.next() if c != gap else 1] += 1
+    counts = counts.copy()
+    counts[:, PROFILE_SYMBOLS.index(gap)] = 0
+    tied = (counts == counts.max(axis=1)[:, None]) & (counts > 0)
+    masks = tied.dot(1 << numpy.arange(len(PROFILE_SYMBOLS)))
+    codes = _profile_codes[masks]
 
-    # tuples of counters, sorted by position
-    return [(char_counter[i], rle_counter[i])
-            for i in xrange(len(char_counter))]
+    missing = (codes == 0) & ~is_gap
+    if missing.any():
+        mask = masks[missing][0]
+        raise KeyError(tuple(sorted(b for i, b in enumerate(PROFILE_SYMBOLS)
+                                    if mask & (1 << i))))
+
+    codes[is_gap] = ord(gap)
+    return codes.tobytes()
 
 
 def consensus(seqs, rlelist=None, degap=True):
@@ -316,12 +750,14 @@ def consensus(seqs, rlelist=None, degap=True):
     """
 
     if rlelist:
-        cons = [cons_char(c) * cons_rle(n)
-                for c, n in get_rle_counts(seqs, rlelist)]
+        chars, runs = rle_counts(seqs, rlelist)
+        cons = numpy.repeat(
+            numpy.frombuffer(cons_chars(chars), dtype=numpy.uint8),
+            cons_rles(runs)).tobytes()
     else:
-        cons = [cons_char(c) for c in get_char_counts(seqs)]
+        cons = cons_chars(char_counts(seqs))
 
-    return ''.join(cons).replace(gap, '') if degap else ''.join(cons)
+    return cons.replace(gap, '') if degap else cons
 
 
 @contextlib.contextmanager
@@ -492,6 +928,61 @@ def parse_uc(infile):
 
     return cluster_ids, cluster_sizes
 
+def _homochar_run_ends(s):
+    """
+    Returns an array of the end of the run of repeating chars starting
+    at each position of string `s`, where gaps end where they start.
+    """
+
+    chars = numpy.frombuffer(s, dtype=numpy.uint8)
+    starts = numpy.ones(len(chars), dtype=bool)
+    starts[1:] = chars[1:] != chars[:-1]
+    starts = numpy.flatnonzero(starts)
+    ends = numpy.append(starts, len(chars))[1:]
+
+    run_ends = numpy.repeat(ends, ends - starts)
+    gaps = (chars == ord(gap)) | (chars == ord(homogap))
+    run_ends[gaps] = numpy.flatnonzero(gaps)
+    return run_ends
+
+
+def _error_blocks(ref, query):
+    """
+    Return a list of (i, ref, query) of each block of aligned strings
+    `ref` and `query` (see itemize_errors)
+    """
+
+    # shift query to preserve alignment
+    query = query[_find_homochar_length(ref, gap):]
+    ref = ref.strip(gap)  # strip terminal gaps
+
+    m = min(len(query), len(ref))
+
+    # a block ends at the end of the longer of the homopolymers
+    # starting in ref and query
+    ends = numpy.maximum(_homochar_run_ends(ref)[:m],
+                         _homochar_run_ends(query)[:m]).tolist()
+
+    # position relative to ref of each column
+    chars = numpy.frombuffer(ref, dtype=numpy.uint8)
+    positions = numpy.zeros(len(chars) + 1, dtype=numpy.int64)
+    numpy.cumsum((chars != ord(gap)) & (chars != ord(homogap)),
+                 out=positions[1:])
+    positions = positions.tolist()
+
+    blocks = []
+    t = 0
+    while t < m:
+        h = ends[t]
+
+        assert (t < h)  # strange chars found or miss-alignment
+
+        blocks.append((positions[t], ref[t:h], query[t:h]))
+        t = h
+
+    return blocks
+
+
 def itemize_errors(ref, query):
     """
     Itemize differences between aligned strings `ref` and `query`
@@ -507,29 +998,43 @@ def itemize_errors(ref, query):
 
     """
 
-    # shift query to preserve alignment
-    query = query[_find_homochar_length(ref, gap):]
-    ref = ref.strip(gap)  # strip terminal gaps
+    return [{'i': i, 'ref': r, 'query': q}
+            for i, r, q in _error_blocks(ref, query)]
 
-    t = h = 0
-    m = min(len(query), len(ref))
-    results = []
 
-    while t < m:
-        h += max(_find_homochar_length(ref[t:]),
-                 _find_homochar_length(query[t:]))
+def itemize_errors_many(refs, queries):
+    """
+    Itemize differences between each pair of aligned strings of
+    `refs` and `queries` (see itemize_errors).
 
-        assert (t < h)  # strange chars found or miss-alignment
+    Returns a dict of arrays with an element for each item:
+
+      * alignment - index of the pair in refs and queries
+      * i - position relative to ref
+      * ref - base or bases in ref
+      * query - base or bases in query
+      * category - error category (see error_category)
 
-        results.append({
-            'i': len(ref[:t].replace(gap, '').replace(homogap, '')),
-            'ref': ref[t:h],
-            'query': query[t:h]
-        })
+    """
 
-        t = h
+    alignments, positions, rr, qq = [], [], [], []
+    for j, (ref, query) in enumerate(izip(refs, queries)):
+        for i, r, q in _error_blocks(ref, query):
+            alignments.append(j)
+            positions.append(i)
+            rr.append(r)
+            qq.append(q)
 
-    return results
+    def strings(values):
+        array = numpy.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+
+    return {'alignment': numpy.array(alignments, dtype=numpy.int64),
+            'i': numpy.array(positions, dtype=numpy.int64),
+            'ref': strings(rr),
+            'query': strings(qq),
+            'category': strings(map(_error_category, rr, qq))}
 
 
 def _find_homochar_length(s, char='', ignore=[gap, homogap]):
@@ -544,8 +1049,7 @@ def _find_homochar_length(s, char='', ignore=[gap, homogap]):
     return i
 
 
-def error_category(e, gap=gap, homogap=homogap, errors=ERRORS):
-    r, q = e['ref'], e['query']
+def _error_category(r, q, gap=gap, homogap=homogap, errors=ERRORS):
     if r == q:
         return 'equal'
     elif gap in r or gap in q:
@@ -559,6 +1063,10 @@ def error_category(e, gap=gap, homogap=homogap, errors=ERRORS):
         return errors[3]
 
 
+def error_category(e, gap=gap, homogap=homogap, errors=ERRORS):
+    return _error_category(e['ref'], e['query'], gap, homogap, errors)
+
+
 def error_count(errors):
     cnt = Counter()
     for e in errors:
@@ -720,12 +1228,21 @@ def format_taxonomy(names, selectors, asterisk='*'):
     Create a friendly formatted string of taxonomy names. Names will
     have an asterisk value appended *only* if the cooresponding
     element in the selectors evaluates to True.
+
+    Results are cached by the set of names and asterisks in
+    format_taxonomy.cache (a utils.LRUCache).
     """
 
     names = izip_longest(names, selectors)
-    names = ((n, asterisk if s else '')
-             for n, s in names)  # add asterisk to selected names
-    names = set(names)
+    names = frozenset((n, asterisk if s else '')
+                      for n, s in names)  # add asterisk to selected names
+
+    try:
+        return format_taxonomy.cache[names]
+    except KeyError:
+        pass
+
+    key = names
     names = sorted(names)  # sort by the name plus asterisk
     names = groupby(names, key=itemgetter(0))  # group by just the names
     # prefer asterisk names which will be at the bottom
@@ -751,7 +1268,11 @@ def format_taxonomy(names, selectors, asterisk='*'):
 
         tax.extend(assigns)
 
-    return ';'.join(sorted(tax))
+    tax = ';'.join(sorted(tax))
+    format_taxonomy.cache[key] = tax
+    return tax
+
+format_taxonomy.cache = utils.LRUCache(maxsize=2 ** 16)
 
 
 def compound_assignment(assignments, taxonomy):
@@ -767,7 +1288,11 @@ def compound_assignment(assignments, taxonomy):
     include asterisks in the output names.
 
     assignments = [(tax_id, is_starred),...]
-    taxonomy = {taxid:taxonomy}
+    taxonomy = {taxid:taxonomy} or a taxtable.Taxonomy
+
+    Results are cached by the set of assignments and the identity of
+    the taxonomy (which must not be modified afterwards) in
+    compound_assignment.cache (a utils.LRUCache).
 
     Functionality: see format_taxonomy
     """
@@ -775,10 +1300,22 @@ def compound_assignment(assignments, taxonomy):
     if not taxonomy:
         raise TypeError('taxonomy must not be empty or NoneType')
 
-    assignments = ((taxonomy[i]['tax_name'], a) for i, a in assignments)
-    assignments = zip(*assignments)
+    assignments = frozenset(assignments)
+    key = (id(taxonomy), assignments)
 
-    return format_taxonomy(*assignments, asterisk='*')
+    try:
+        # cached items hold a reference to their taxonomy so its id
+        # cannot be reused by another object while cached
+        return compound_assignment.cache[key][1]
+    except KeyError:
+        pass
+
+    names = ((taxonomy[i]['tax_name'], a) for i, a in assignments)
+    names = format_taxonomy(*zip(*names), asterisk='*')
+    compound_assignment.cache[key] = (taxonomy, names)
+    return names
+
+compound_assignment.cache = utils.LRUCache(maxsize=2 ** 16)
 
 
 def condense_ids(assignments,
@@ -790,7 +1327,7 @@ def condense_ids(assignments,
                  rank_thresholds={}):
     """
     assignments = [tax_ids...]
-    taxonomy = {taxid:taxonomy}
+    taxonomy = {taxid:taxonomy} or a taxtable.Taxonomy
 
     Functionality: Group items into taxonomic groups given max rank sizes.
     """
@@ -874,31 +1411,206 @@ def correct_copy_numbers(assignments, copy_numbers):
 SeqLite = namedtuple('SeqLite', 'id, description, seq')
 
 
+# bytes read at a time by fastalite
+FASTA_BLOCKSIZE = 1 << 20
+
+# whitespace other than newlines stripped from sequence lines
+_line_whitespace = ' \t\r\x0b\x0c'
+
+
+def _fasta_blocks(handle, blocksize=FASTA_BLOCKSIZE):
+    """
+    Return an iterator of blocks of text from file-like object `handle`,
+    or of its lines if it has no read method (eg a list of lines).
+    """
+
+    read = getattr(handle, 'read', None)
+    if read is None:
+        return iter(handle)
+    return iter(lambda: read(blocksize), '')
+
+
+def _fasta_chunks(blocks):
+    """
+    Return text of whole fasta records from an iterable of blocks of
+    text.  Each chunk but the first (which begins with any text before
+    the first record) starts with the '>' of a record and ends with the
+    newline before the next record, or at the end of the text.
+    """
+
+    pieces, last = [], '\n'
+    for block in blocks:
+        if not block:
+            continue
+
+        # end of the last whole record in the block
+        end = block.rfind('\n>') + 1
+        if not end and last == '\n' and block[0] == '>':
+            end = len(pieces) and -1
+
+        if end > 0:
+            pieces.append(block[:end])
+            yield ''.join(pieces)
+            pieces = [block[end:]]
+        elif end < 0:
+            yield ''.join(pieces)
+            pieces = [block]
+        else:
+            pieces.append(block)
+        last = block[-1]
+
+    yield ''.join(pieces)
+
+
+def _fasta_lines(seq):
+    """
+    Return the lines of sequence `seq` joined, stripping surrounding
+    whitespace from each.
+    """
+
+    joined = seq.replace('\n', '')
+    if len(joined.translate(None, _line_whitespace)) != len(joined):
+        joined = ''.join(line.strip() for line in seq.split('\n'))
+    return joined
+
+
+def _fasta_parse(chunk):
+    """
+    Return lists of the descriptions and sequences of the records in a
+    chunk from _fasta_chunks starting with '>'.
+    """
+
+    # judging by the first record, is there a single line of sequence
+    # per record?
+    end = chunk.find('\n', chunk.find('\n') + 1) + 1
+    if not end or end == len(chunk) or chunk[end] == '>':
+        lines = chunk.split('\n')
+        if not lines[-1]:
+            lines.pop()
+        heads = '\n'.join(lines[::2])
+        # every other line is a description and no others have a '>'
+        if (len(lines) % 2 == 0 and
+                heads.count('\n>') == len(lines) // 2 - 1 and
+                heads.count('>') == chunk.count('>')):
+            return ([h[1:].strip() for h in lines[::2]],
+                    [s.strip() for s in lines[1::2]])
+
+    names, seqs = [], []
+    for record in chunk[1:].split('\n>'):
+        name, _, seq = record.partition('\n')
+        names.append(name.strip())
+        seqs.append(_fasta_lines(seq))
+    return names, seqs
+
+
 def fastalite(handle, limit=None):
     """
     Return a sequence of namedtupe objects given fasta format open
-    file-like object `handle`. Sequence is a list if `readfile` is
-    True, an iterator otherwise.
+    file-like object `handle` (or an iterable of lines), reading at most
+    `limit` records.
+
+    The file is read in blocks of FASTA_BLOCKSIZE parsed a block of
+    records at a time.  Sequence lines are stripped of surrounding
+    whitespace and the id is the first word of the description.  Records
+    with empty sequences are returned unless last.
     """
-    limit = limit or -1
 
-    name, seq = '', ''
-    for line in handle:
-        if line.startswith('>'):
-            if limit != 0:
-                limit -= 1
-            else:
-                break
+    limit = limit if limit and limit > 0 else None
 
-            if name:
-                yield SeqLite(name.split()[0], name, seq)
+    chunks = _fasta_chunks(_fasta_blocks(handle))
+    first = next(chunks, '')
+    start = 0 if first.startswith('>') else first.find('\n>') + 1
+    if start or first.startswith('>'):
+        chunks = chain([first[start:]], chunks)
 
-            name, seq = line[1:].strip(), ''
-        else:
-            seq += line.strip()
+    last = None
+    for chunk in chunks:
+        names, seqs = _fasta_parse(chunk)
+        if limit is not None:
+            names, seqs = names[:limit], seqs[:limit]
+            limit -= len(names)
+
+        # the last record is held back until the next chunk since it is
+        # not returned at the end of the file without a sequence
+        if last:
+            yield last
+        name, seq = names.pop(), seqs.pop()
+        last = SeqLite(name.split(None, 1)[0], name, seq) if name else None
+
+        # records without a description are skipped
+        if '' in names:
+            keep = [i for i, name in enumerate(names) if name]
+            names, seqs = [names[i] for i in keep], [seqs[i] for i in keep]
+        ids = [name.split(None, 1)[0] for name in names]
+        # construct the namedtuples without calling SeqLite.__new__
+        for record in imap(tuple.__new__, repeat(SeqLite),
+                           izip(ids, names, seqs)):
+            yield record
+
+        if limit == 0:
+            break
+
+    if last and last.seq:
+        yield last
+
+
+FastqLite = namedtuple('FastqLite', 'id, description, seq, qual')
+
+
+def _fastq_parse(lines):
+    """
+    Return FastqLite tuples of a list of lines holding whole four line
+    records.
+    """
+
+    heads, seqs, pluses, quals = (lines[i::4] for i in range(4))
+    if not (all(h.startswith('@') for h in heads) and
+            all(p.startswith('+') for p in pluses)):
+        raise ValueError('invalid fastq record starting with {}'.format(
+            next(h for h, p in izip(heads, pluses)
+                 if not (h.startswith('@') and p.startswith('+')))))
+
+    names = [h[1:].strip() for h in heads]
+    ids = [name.split(None, 1)[0] if name else '' for name in names]
+    return imap(tuple.__new__, repeat(FastqLite),
+                izip(ids, names,
+                     (s.strip() for s in seqs),
+                     (q.strip() for q in quals)))
+
+
+def fastqlite(handle, limit=None):
+    """
+    Return a sequence of namedtuple objects given fastq format open
+    file-like object `handle` (or an iterable of lines) of four line
+    records, reading at most `limit` records.
+
+    Quality scores are returned as the text of the quality line.
+    Raises ValueError if a record is not a description line starting
+    with '@', sequence, '+' line and quality line.
+    """
 
-    if name and seq:
-        yield SeqLite(name.split()[0], name, seq)
+    limit = limit if limit and limit > 0 else None
+
+    rest = ''
+    for block in _fasta_blocks(handle):
+        lines = (rest + block).split('\n')
+        end = len(lines) - 1 - (len(lines) - 1) % 4
+        rest = '\n'.join(lines[end:])
+
+        if limit is not None:
+            end = min(end, 4 * limit)
+            limit -= end // 4
+        for record in _fastq_parse(lines[:end]):
+            yield record
+        if limit == 0:
+            return
+
+    # the last record may not end with a newline
+    lines = rest.rstrip().split('\n') if rest.strip() else []
+    if len(lines) % 4:
+        raise ValueError('incomplete fastq record {}'.format(lines[0]))
+    for record in _fastq_parse(lines[:4 * limit if limit else None]):
+        yield record
 
 
 # Taken from Connor McCoy's Deenurp
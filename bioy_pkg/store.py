@@ -0,0 +1,123 @@
+# This file is part of Bioy
+#
+#    Bioy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Bioy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Bioy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Per-specimen store of classifier results
+
+A store is a directory holding the csv output (and optionally details)
+of each specimen classified, each with its header, in files named by a
+digest of everything the results depend on (see
+classifier.specimen_digests):
+
+    - index.csv -- columns specimen and digest
+    - DIGEST.csv -- output rows of the specimen
+    - DIGEST.details.csv -- details rows of the specimen
+
+Files of digests no longer in the index are removed when the index is
+saved.
+"""
+
+import logging
+import os
+import tempfile
+
+import pandas
+
+from bioy_pkg import utils
+
+log = logging.getLogger(__name__)
+
+INDEX = 'index.csv'
+
+
+def _write(pth, text):
+    """Write `text' to `pth' replacing it atomically"""
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(pth), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.rename(tmp, pth)
+    except:
+        os.remove(tmp)
+        raise
+
+
+class ResultStore(object):
+
+    """Directory of results keyed by specimen and digest
+
+    Keyword Arguments:
+        - pth -- the store directory, created if it does not exist
+    """
+
+    def __init__(self, pth):
+        self.pth = utils.mkdir(pth)
+        self.digests = {}
+
+        index = os.path.join(pth, INDEX)
+        if os.path.exists(index):
+            index = pandas.read_csv(index, dtype=str)
+            self.digests = dict(zip(index['specimen'], index['digest']))
+
+    def _path(self, digest, details=False):
+        suffix = '.details.csv' if details else '.csv'
+        return os.path.join(self.pth, digest + suffix)
+
+    def get(self, specimen, digest, details=False):
+        """Return the (output, details) text stored for `specimen' with
+        `digest' (details None unless `details'), or None if there is no
+        such entry or it has no details when `details' is requested.
+        """
+
+        if self.digests.get(specimen) != digest:
+            return None
+
+        paths = [self._path(digest)]
+        if details:
+            paths.append(self._path(digest, details=True))
+        if not all(os.path.exists(p) for p in paths):
+            return None
+
+        texts = []
+        for p in paths:
+            with open(p) as f:
+                texts.append(f.read())
+        return texts[0], (texts[1] if details else None)
+
+    def put(self, specimen, digest, output, details=None):
+        """Store the output (and details) text of `specimen'"""
+
+        _write(self._path(digest), output)
+        if details is not None:
+            _write(self._path(digest, details=True), details)
+        self.digests[specimen] = digest
+
+    def save(self, specimens):
+        """Write the index of `specimens' and remove the files of every
+        other entry.
+        """
+
+        self.digests = {s: self.digests[s] for s in specimens
+                        if s in self.digests}
+
+        index = pandas.DataFrame(sorted(self.digests.items()),
+                                 columns=['specimen', 'digest'])
+        _write(os.path.join(self.pth, INDEX), index.to_csv(None, index=False))
+
+        keep = set(self.digests.values())
+        for name in os.listdir(self.pth):
+            digest = name.split('.')[0]
+            if name != INDEX and name.endswith('.csv') and digest not in keep:
+                os.remove(os.path.join(self.pth, name))
@@ -27,17 +27,17 @@ from operator import itemgetter
 from os import path
 import random
 
-from bioy_pkg.sequtils import SeqLite, fastalite, \
-    homodecode, from_ascii, fasta_tempfile
+from bioy_pkg import seqstore
+from bioy_pkg.sequtils import SeqLite, homodecode, from_ascii, fasta_tempfile
 from bioy_pkg.utils import chunker, Opener, Csv2Dict
 
 log = logging.getLogger(__name__)
 
 def build_parser(parser):
     parser.add_argument('raw_reads',
-                        type = lambda f: fastalite(Opener()(f)),
                         help = """input fasta file containing original
-                        clustered reads (default stdin).""")
+                        clustered reads; an uncompressed file is indexed
+                        (as raw_reads.idx) to look up reads by name""")
     parser.add_argument('readmap',
                         type = Opener('r'),
                         help = """output of `bioy denoise --readmap`
@@ -60,7 +60,7 @@ def build_parser(parser):
 
 
 def action(args):
-    seqdict = {s.id: s for s in args.raw_reads}
+    seqdict = seqstore.load(args.raw_reads)
 
     if args.rlefile:
         def rlemap(seq):
@@ -71,23 +71,23 @@ def action(args):
     for cons, group in groups:
         if args.pattern and not re.search(r'' + args.pattern, cons):
             continue
-            log.info(cons)
-            reads, _ = zip(*group)
-            seqs = [seqdict[name] for name in reads]
-            if len(seqs) > args.sample:
-                seqs = random.sample(seqs, args.sample)
-                if args.rlefile:
-                    seqs = (rlemap(s) for s in seqs)
-                    outfile = path.join(
-                        args.outdir,
-                        '{}.{}.fasta'.format(cons, args.name_suffix))
+        log.info(cons)
+        reads, _ = zip(*group)
+        if len(reads) > args.sample:
+            reads = random.sample(reads, args.sample)
+        seqs = seqdict.fetch(reads)
+        if args.rlefile:
+            seqs = [rlemap(s) for s in seqs]
+        outfile = path.join(
+            args.outdir,
+            '{}.{}.fasta'.format(cons, args.name_suffix))
 
-            if args.align:
-                with fasta_tempfile(seqs) as f:
-                    command = ['muscle', '-quiet', '-seqtype', 'dna',
-                               '-in', f, '-out', outfile]
-                    log.debug(' '.join(command))
-                    subprocess.check_call(command)
-            else:
-                with open(outfile, 'w') as f:
-                    f.write('\n'.join('>{}\n{}'.format(s.id, s.seq) for s in seqs))
+        if args.align:
+            with fasta_tempfile(seqs) as f:
+                command = ['muscle', '-quiet', '-seqtype', 'dna',
+                           '-in', f, '-out', outfile]
+                log.debug(' '.join(command))
+                subprocess.check_call(command)
+        else:
+            with open(outfile, 'w') as f:
+                f.write('\n'.join('>{}\n{}'.format(s.id, s.seq) for s in seqs))
@@ -23,6 +23,9 @@ import sys
 
 from operator import itemgetter
 
+import numpy
+
+from bioy_pkg.taxtable import Taxonomy
 from bioy_pkg.utils import Opener
 
 log = logging.getLogger(__name__)
@@ -44,33 +47,39 @@ def build_parser(parser):
             [parent_name,parent_id,parent_rank,tax_name,tax_id,rank]""")
 
 def action(args):
-    taxonomy = csv.DictReader(args.taxonomy)
-    ranks = taxonomy.fieldnames[4:]
+    taxonomy = Taxonomy.from_csv(args.taxonomy)
 
-    tax = {}
+    # code of the taxid in args.taxids each record descends from
+    parents = numpy.full(len(taxonomy), -1, dtype=int)
+    for code in taxonomy.codes(sorted(args.taxids)):
+        if code == -1:
+            continue
+        children = taxonomy.descendant_codes(code)
+        nested = parents[children][parents[children] != -1]
+        if len(nested):
+            raise ValueError('taxids {} and {} are nested'.format(
+                taxonomy.tax_ids[nested[0]], taxonomy.tax_ids[code]))
+        parents[children] = code
 
     # filter out claves
-    dropped = total = 0
-    for t in taxonomy:
-        parent_id = set(itemgetter(*ranks)(t)) & args.taxids
-        if parent_id:
-            t['parent_id'], = parent_id
-            tax[t['tax_id']] = t
-        else:
-            dropped += 1
-        total += 1
+    children = numpy.flatnonzero(parents != -1)
+    total = len(taxonomy)
+    dropped = total - len(children)
 
     log.info('dropped {} of {} records ({:.2%}) as not children'.format(
         dropped, total, float(dropped) / total))
 
     # add parent_name and parent_rank
-    for t in tax.values():
-        parent = tax[t['parent_id']]
-        t['parent_name'] = parent['tax_name']
-        t['parent_rank'] = parent['rank']
+    rows = [{'parent_name': taxonomy.names[p],
+             'parent_id': taxonomy.tax_ids[p],
+             'parent_rank': taxonomy.node_ranks[p],
+             'tax_name': taxonomy.names[c],
+             'tax_id': taxonomy.tax_ids[c],
+             'rank': taxonomy.node_ranks[c]}
+            for c, p in zip(children, parents[children])]
 
     # sort by parent_name and tax_name ??
-    rows = sorted(tax.values(), key = itemgetter('parent_name', 'tax_name'))
+    rows = sorted(rows, key = itemgetter('parent_name', 'tax_name'))
 
     # output
     fieldnames = ['parent_name', 'parent_id', 'parent_rank',
@@ -80,4 +89,3 @@ def action(args):
                          fieldnames = fieldnames)
     out.writeheader()
     out.writerows(rows)
-
@@ -25,7 +25,9 @@ Running the program
     positional arguments:
       blast_file            CSV tabular blast file of query and subject hits.
       seq_info              File mapping reference seq name to tax_id
+                            (optional with --index)
       taxonomy              Table defining the taxonomy for each tax_id
+                            (optional with --index)
 
     optional arguments:
       -h, --help            show this help message and exit
@@ -35,6 +37,9 @@ Running the program
                             tax_ids (CSV file with columns: tax_id, median)
       --rank-thresholds CSV
                             Columns [tax_id,ranks...]
+      --index FILE          Reference bundle compiled from seq_info,
+                            taxonomy, rank thresholds and copy numbers (see
+                            classifier_index)
       --specimen-map CSV    CSV file with columns (name, specimen) assigning
                             sequences to groups. The default behavior is to
                             treat all query sequences as
@@ -48,6 +53,10 @@ Running the program
       -o FILE, --out FILE   Classification results.
       -O FILE, --details-out FILE
                             Optional details of taxonomic assignments.
+      --details-format {csv,npz}
+                            format of --details-out, csv (compressed if FILE
+                            ends with .gz or .bz2) or a columnar npz file
+                            [csv]
       --details-full        do not limit out_details to only larget cluster per
                             assignment
       --group-def INTEGER   define a group threshold for a particular rank
@@ -73,6 +82,26 @@ Running the program
       --max-group-size INTEGER
                             group multiple target-rank assignments that excede
                             a threshold to a higher rank [3]
+      --stream              classify and write results one group of specimens
+                            at a time. Hits of each specimen must be
+                            contiguous in the blast file and output follows
+                            the order of specimens in the blast file
+      --chunksize ROWS      number of blast results to read at a time with
+                            --stream [100000]
+      --codes               work on integer codes in place of sequence names,
+                            specimens and tax_ids, restoring them in the
+                            output
+      --batch               blast_file is a csv manifest with columns
+                            blast_file, out and optionally specimen_map,
+                            weights, details_out and store, each row
+                            classified in
+                            turn with the reference data loaded once
+      --timings FILE        write the elapsed time, rows in and out and
+                            change and peak of resident memory of each
+                            stage as csv (json if FILE ends with .json)
+      --store DIR           directory of results of each specimen,
+                            classifying only specimens that are new or
+                            changed since they were stored
 
 Positional arguments
 ++++++++++++++++++++
@@ -123,12 +152,106 @@ Below is an *example* copy numbers csv with the required columns:
     433    Acetobacteraceae     3.60
     ====== ==================== ======
 
+index
+=====
+
+A reference bundle written by ``bioy classifier_index`` (or by a previous
+run of the classifier with the same --index) holding the seq_info,
+taxonomy, rank thresholds and copy numbers as memory mapped arrays along
+with sha1 digests of the files it was built from.  If seq_info and
+taxonomy are given the bundle is used only if it was built from the same
+input files and is otherwise rebuilt.  Without seq_info and taxonomy the
+bundle alone provides the reference data (including its copy numbers)
+and any --rank-thresholds or --copy-numbers given must match it.
+
 weights
 =======
 
 Headerless file containing two columns specifying the seqname (clustername) and
 weight (or number of sequences in the cluster).
 
+Streaming
++++++++++
+
+With --stream the blast file is read --chunksize rows at a time and
+results are written as soon as every hit of a specimen has been read, so
+memory use depends on the largest specimen rather than on the whole
+blast file.  The hits of each specimen (each query sequence by default,
+see --specimen-map) must be contiguous in the blast file, for example
+sorted by specimen and qseqid; a specimen found in more than one place
+is an error.  Results are the same as without --stream except that
+specimens are written in the order of the blast file rather than
+sorted.  With --specimen every hit belongs to a single specimen and is
+classified at once.
+
+Threads
++++++++
+
+Specimens are classified independently, so with --threads greater than
+one the specimens (of the blast file or of each --stream chunk) are split
+into partitions of about the same number of hits classified by a pool
+of worker processes.  Results are written in order of specimen and are
+identical to a run with a single thread.
+
+Codes
++++++
+
+With --codes query and subject sequence names and specimens are replaced
+by integer codes (numbered in sorted order) as soon as the blast results
+are read, and tax_ids by their position in the integer coded taxonomy.
+Joins against seq_info and the taxonomy and every grouping then work on
+numbers rather than strings, and rank ids and thresholds are looked up
+by code instead of being joined as columns.  Names and tax_ids are
+restored only when writing --out and --details-out, so results are the
+same as without --codes.
+
+Batch
++++++
+
+With --batch the blast_file argument is a csv manifest with a header
+naming the columns **blast_file** and **out** and optionally
+**specimen_map**, **weights**, **details_out** and **store**, for
+example::
+
+    blast_file,specimen_map,out,details_out
+    plate1/blast.csv,plate1/map.csv,plate1/classifications.csv,
+    plate2/blast.csv,plate2/map.csv,plate2/classifications.csv,
+
+Each row is classified as a run of the classifier with those arguments
+(empty values are unset and missing columns keep the command line
+value) and every other option taken from the command line.  The
+reference data are loaded once and shared by every row (and by the
+--threads worker processes of each row).
+
+Store
++++++
+
+With --store DIR the output and details of each specimen are kept in
+DIR along with a sha1 digest of the hits of the specimen (and their
+weights), the options the results depend on and the digests of the
+reference inputs.  On the next run with the same DIR only specimens
+that are new or whose digest has changed are classified; the results
+of the others are read from DIR, and --out and --details-out are
+written for every specimen of the blast file in order of specimen, the
+same as a run without --store.  Specimens no longer in the blast file
+are removed from DIR, so each blast file (or --batch row) needs its own
+DIR.  --store cannot be combined with --stream and writes csv details
+only.
+
+Timings
++++++++
+
+With --timings each stage (loading blast results and references,
+filtering, each join, selecting valid hits, condensing, assigning,
+summarizing, details and writing) is reported with its number of calls
+(one per --stream chunk or --threads partition), elapsed seconds, rows
+in and out and the change in resident set size in bytes, summed over
+calls, and the largest peak resident set size of the process at the end
+of a call.  The change in resident set size is left empty where the
+current resident set size is not available (it is read from /proc).
+Stages run by worker processes report their own time and memory, so
+with --threads the seconds add up to more than the wall time.
+
 Output
 ++++++
 
@@ -169,6 +292,17 @@ details-out
 
 A csv that is basically a blast results breakdown of the `out`_ output.
 
+Details are sorted by their columns and written one partition of whole
+specimens at a time (one per --stream chunk or --threads partition).  A
+file ending in .gz or .bz2 is compressed in background threads while the
+next partition is classified (with --threads threads for gzip).  With
+--details-format npz the details are written as arrays of each column
+of each partition in an npz file (see bioy_pkg.details) that can be read
+back without parsing csv::
+
+    from bioy_pkg.details import read_details
+    details = read_details('details.npz')
+
 Internal functions
 ------------------
 
@@ -180,19 +314,37 @@ assigned tax_ids of a higher threshold that *could* represent invalid tax_ids
 (tax_ids that may *not* have passed the rank threshold).
 """
 
+import copy
+import hashlib
+import json
 import os
 import sys
 import logging
 
 import pandas as pd
-import math
+import numpy
+
+from multiprocessing import Pool
 
-from bioy_pkg import sequtils, _data as datadir
+from bioy_pkg import sequtils, references, utils
+from bioy_pkg.details import DetailsWriter
+from bioy_pkg.references import References
+from bioy_pkg.store import ResultStore
 
 log = logging.getLogger(__name__)
 
 ASSIGNMENT_TAX_ID = 'assignment_tax_id'
 
+# columns of a --batch manifest, each naming an argument of a run
+MANIFEST_COLUMNS = ['blast_file', 'specimen_map', 'weights', 'out',
+                    'details_out', 'store']
+
+# arguments the results of a specimen depend on (see specimen_digests)
+CLASSIFY_OPTIONS = ['min_identity', 'max_identity', 'min_coverage',
+                    'min_cluster_size', 'starred', 'max_group_size',
+                    'threshold_assignments', 'best_n_hits', 'details_full',
+                    'hits_below_threshold', 'include_ref_rank']
+
 
 def raw_filtering(blast_results, min_coverage=None,
                   max_identity=None, min_identity=None):
@@ -245,22 +397,100 @@ def raw_filtering(blast_results, min_coverage=None,
 
 
 def round_up(x):
-    """round up any x < 0.01
+    """round up any value of Series x < 0.01 (or null)
+    """
+    return x.where(x > 0.01, 0.01)
+
+
+def group_codes(df, by):
+    """Return an array numbering the group of each row of `df' by the
+    `by' columns in order of first appearance.
+    """
+
+    codes = numpy.zeros(len(df), dtype=numpy.int64)
+    for column in by:
+        labels, uniques = pd.factorize(df[column])
+        codes, _ = pd.factorize(codes * len(uniques) + labels)
+    return codes
+
+
+def encode(values):
+    """Return integer codes of `values' numbered in sorted order (so codes
+    sort like the values), -1 for null values, and an Index of the value
+    of each code.
+    """
+
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes, pd.Index(uniques)
+
+
+def decode(codes, values):
+    """Return an object array with the value (from Index `values') of
+    each of `codes', nan for negative or null codes.
     """
-    return max(0.01, x)
+
+    codes = numpy.asarray(codes, dtype=float)
+    with numpy.errstate(invalid='ignore'):
+        found = codes >= 0
+    decoded = numpy.full(len(codes), numpy.nan, dtype=object)
+    decoded[found] = numpy.asarray(values)[codes[found].astype(int)]
+    return decoded
 
 
-def star(df, starred):
-    """Assign boolean if any items in the
-    dataframe are above the star threshold.
+def coded_index(df, values):
+    """Return the rows of `df' with an index value in Index `values'
+    indexed by the position of each in `values'.
     """
 
-    df['starred'] = df.pident.apply(lambda x: x >= starred).any()
+    df = df[df.index.isin(values)].copy()
+    df.index = pd.Index(values.get_indexer(df.index), name=df.index.name)
     return df
 
 
-def condense_ids(
-        df, tax_dict, ranks, max_group_size, threshold_assignments=False):
+def sort_codes(df, by):
+    """Return `df' sorted by columns `by' with nulls last, as by
+    df.sort_values(by) (ties keep their order), ranking the values of
+    each column as integer codes and sorting the codes at once.
+    """
+
+    keys = []
+    for column in by:
+        codes, uniques = pd.factorize(df[column], sort=True)
+        keys.append(numpy.where(codes == -1, len(uniques), codes))
+    return df.iloc[numpy.lexsort(keys[::-1])] if keys else df
+
+
+def best_n_hits(df, best_n, by=['specimen', 'qseqid']):
+    """Return a boolean array marking the hits with no more mismatches
+    than the `best_n'th best hit (or the worst hit if there are fewer)
+    of their query (grouped by `by').
+    """
+
+    groups = group_codes(df, by)
+    mismatches = df['mismatch'].values
+
+    # hits ordered by query and then mismatches
+    order = numpy.lexsort((mismatches, groups))
+    sizes = numpy.bincount(groups)
+    starts = sizes.cumsum() - sizes
+    nth = order[starts + numpy.minimum(best_n, sizes) - 1]
+
+    return mismatches <= mismatches[nth][groups]
+
+
+def star(df, starred, by=['specimen', 'assignment_hash', 'condensed_id']):
+    """Return a boolean array marking the hits of groups (by `by') with
+    any hit at or above the star threshold.
+    """
+
+    groups = group_codes(df, by)
+    above = df['pident'].values >= starred
+    return numpy.bincount(groups, weights=above)[groups] > 0
+
+
+def condense_ids(df, tax_dict, ranks, max_group_size,
+                 threshold_assignments=False, by=['specimen', 'qseqid'],
+                 codes=False):
     """
     Create mapping from tax_id to its condensed id.  Also creates the
     assignment hash on either the condensed_id or assignment_tax_id decided
@@ -273,133 +503,256 @@ def condense_ids(
     the actual assignment text for grouping is that the assignment text
     can contains extra annotations that are independent of which
     assignment group a qseqid belongs to such as a 100% id star.
-    """
-
-    condensed = sequtils.condense_ids(
-        df[ASSIGNMENT_TAX_ID].unique(),
-        tax_dict,
-        ranks=ranks,
-        max_size=max_group_size)
 
-    condensed = pd.DataFrame(
-        condensed.items(),
-        columns=[ASSIGNMENT_TAX_ID, 'condensed_id'])
-    condensed = condensed.set_index(ASSIGNMENT_TAX_ID)
+    Queries (grouped by `by') with the same set of assignment tax_ids are
+    condensed alike so each distinct set is condensed only once.  Returns
+    arrays of the condensed_id and assignment_hash of each hit.  With
+    `codes' tax_ids are codes of Taxonomy `tax_dict' (see --codes).
+    """
 
-    if threshold_assignments:
-        assignment_hash = hash(frozenset(condensed.index.unique()))
+    queries = group_codes(df, by)
+    labels, tax_ids = pd.factorize(df[ASSIGNMENT_TAX_ID])
+    if codes:
+        tax_ids = tax_dict.tax_ids[tax_ids.astype(int)]
+    tax_ids = pd.Index(tax_ids)
+    size = len(tax_ids)
+
+    # distinct tax_ids of each query, in order of query
+    pairs = numpy.unique(queries * size + labels)
+    starts = numpy.flatnonzero(numpy.diff(pairs // size)) + 1
+
+    sets = {}  # {frozenset(tax_ids): (set number, condensed, hash)}
+    query_sets = numpy.empty(queries.max() + 1, dtype=numpy.int64)
+    for query, members in enumerate(numpy.split(pairs % size, starts)):
+        members = frozenset(tax_ids[members])
+        if members not in sets:
+            condensed = sequtils.condense_ids(
+                members, tax_dict, ranks=ranks, max_size=max_group_size)
+            if threshold_assignments:
+                assignment_hash = hash(members)
+            else:
+                assignment_hash = hash(frozenset(condensed.values()))
+            sets[members] = (len(sets), condensed, assignment_hash)
+        query_sets[query] = sets[members][0]
+
+    # look up (set number, tax_id) for each hit
+    keys, condensed_ids = [], []
+    hashes = numpy.empty(len(sets), dtype=numpy.int64)
+    for number, condensed, assignment_hash in sets.values():
+        hashes[number] = assignment_hash
+        keys.extend(number * size + tax_ids.get_indexer(condensed.keys()))
+        condensed_ids.extend(condensed.values())
+
+    if codes:
+        condensed_ids = tax_dict.codes(condensed_ids).astype(float)
     else:
-        assignment_hash = hash(frozenset(condensed['condensed_id'].unique()))
+        condensed_ids = numpy.array(condensed_ids, dtype=object)
 
-    condensed['assignment_hash'] = assignment_hash
-    return df.join(condensed, on=ASSIGNMENT_TAX_ID)
+    sets = query_sets[queries]
+    found = pd.Index(keys).get_indexer(sets * size + labels)
+    return condensed_ids[found], hashes[sets]
 
 
-def assign(df, tax_dict):
-    """Create str assignment based on tax_ids str and starred boolean.
+def assign(df, tax_dict, by=['specimen', 'assignment_hash'], codes=False):
+    """Return an array with the compound assignment of each hit created
+    from the set of (condensed_id, starred) of its group (by `by').
+    Assignments recurring within and across runs are found in the
+    sequtils.compound_assignment cache.  With `codes' condensed_ids are
+    codes of Taxonomy `tax_dict' (see --codes).
     """
 
-    ids_stars = df.groupby(by=['condensed_id', 'starred']).groups.keys()
-    df['assignment'] = sequtils.compound_assignment(ids_stars, tax_dict)
-    return df
+    groups = group_codes(df, by)
+    pairs = df[['condensed_id', 'starred']].assign(group=groups)
+    pairs = pairs.drop_duplicates()
+    if codes:
+        pairs['condensed_id'] = tax_dict.tax_ids[
+            pairs['condensed_id'].values.astype(int)]
+
+    ids_stars = [[] for _ in range(groups.max() + 1)]
+    for group, condensed_id, starred in pairs[
+            ['group', 'condensed_id', 'starred']].itertuples(index=False):
+        ids_stars[group].append((condensed_id, starred))
+
+    assignments = numpy.empty(len(ids_stars), dtype=object)
+    for group, members in enumerate(ids_stars):
+        assignments[group] = sequtils.compound_assignment(members, tax_dict)
+
+    log.info('compound assignment cache: {}'.format(
+        sequtils.compound_assignment.cache))
+
+    return assignments[groups]
 
 
 def assignment_id(df):
-    """Resets and drops the current dataframe's
-    index and sets it to the assignment_hash
+    """Index `df' (indexed by specimen, with the rows of each specimen
+    together) by specimen and an assignment_id numbering the rows of each
+    specimen from 0.
 
     assignment_id is treated as a string identifier to account
     for hits in details with no assignment or assignment_id
     """
-    df = df.reset_index(drop=True)  # specimen is retained in the group key
-    df.index.name = 'assignment_id'
-    df.index = df.index.astype(str)
+
+    ids = df.groupby(level='specimen', sort=False).cumcount()
+    df.index = pd.MultiIndex.from_arrays(
+        [df.index, ids.astype(str).values],
+        names=['specimen', 'assignment_id'])
     return df
 
 
-def best_rank(s, ranks):
-    """Create aggregate columns for assignments.
+def tied_best_rank(s, ranks):
+    """Return the best rank of Series `s' of the condensed_ranks of a
+    group with more than one most common rank.
+
+    This is the original per group implementation, kept so ties are
+    broken as before: the specificity is taken of the counts rather than
+    of the rank names, so the rank is picked by the order value_counts
+    returns the tied ranks in.
+    """
+
+    value_counts = s.value_counts()
+
+    def specificity(r):
+        return ranks.index(r) if r in ranks else -1
+    majority_rank = value_counts[value_counts == value_counts.max()]
+    majority_rank.name = 'rank'
+    majority_rank = majority_rank.to_frame()
+    majority_rank['specificity'] = majority_rank['rank'].apply(specificity)
+    majority_rank = majority_rank.sort_values(by=['specificity'])
+    return majority_rank.iloc[-1].name
+
+
+def best_rank(df, ranks, by=['specimen', 'assignment_hash']):
+    """Return a Series indexed by `by' with the most common condensed_rank
+    of each group.  Groups with more than one most common rank are
+    resolved by tied_best_rank.  Groups without a condensed_rank ([no
+    blast result]) are missing.
 
     `ranks' are sorted with less specific first for example:
 
     ['root', 'kingdom', 'phylum', 'order', 'family',
      'genus', 'species_group', 'species']
-
-    so when sorting the indexes the most specific
-    rank will be in the iloc[-1] location
     """
 
-    value_counts = s.value_counts()
-    if len(value_counts) == 0:
-        # [no blast result]
-        return None
-    else:
-        def specificity(r):
-            return ranks.index(r) if r in ranks else -1
-        majority_rank = value_counts[value_counts == value_counts.max()]
-        majority_rank.name = 'rank'
-        majority_rank = majority_rank.to_frame()
-        majority_rank['specificity'] = majority_rank['rank'].apply(specificity)
-        majority_rank = majority_rank.sort_values(by=['specificity'])
-        # most precise rank is at the highest index (-1)
-        return majority_rank.iloc[-1].name
-
-
-def find_tax_id(series, valids, r, ranks):
-    """Return the most taxonomic specific tax_id available for the given
-    Series.  If a tax_id is already present in valids[r] then return None.
+    # groups of null condensed_ranks are dropped first, some versions of
+    # pandas fail to size groupings where every group has a null key
+    df = df[df['condensed_rank'].notnull()]
+    counts = df.groupby(by + ['condensed_rank'], sort=False).size()
+    counts = counts.reset_index(name='count')
+
+    # most common rank of each group is last
+    counts = counts.sort_values(by='count', kind='mergesort')
+    most = counts.drop_duplicates(subset=by, keep='last').set_index(by)
+    best = most['condensed_rank']
+
+    # groups with equally common ranks, rare enough to resolve one by one
+    counts = counts.join(most['count'].rename('most'), on=by)
+    tied = counts[counts['count'] == counts['most']]
+    tied = tied[tied.duplicated(subset=by)].set_index(by).index
+    if len(tied):
+        rows = df.set_index(by).index.isin(tied)
+        resolved = df[rows].groupby(by, sort=False)['condensed_rank'].apply(
+            tied_best_rank, ranks)
+        best.loc[resolved.index] = resolved.values
+    return best
+
+
+def find_tax_ids(df, rows, ranks, bumped, by, ids=None):
+    """Return the most taxonomic specific tax_id available for each of the
+    `bumped' hits in `rows' (positions in `df').  If a tax_id is already
+    present at that rank among the other (non-bumped) hits of the same
+    query then return None.  Rank ids are the `ranks' columns of `df'
+    unless given as an array `ids' (see select_valid_hits).
     """
 
-    index = ranks.index(r)
-    series = series[ranks[index:]]
-    series = series[~series.isnull()]
-    found = series.head(n=1)
-    key = found.index.values[0]
-    value = found.values[0]
-    return value if value not in valids[key].unique() else None
+    if ids is None:
+        ids = df[ranks].values
+    have = rows[~bumped]
+    rows = rows[bumped]
 
+    # columns available at or above the selected rank of each bumped hit
+    below = numpy.arange(len(ranks)) < rows['rank'][:, numpy.newaxis]
+    keys = (pd.notnull(ids[rows['row']]) & ~below).argmax(axis=1)
+    values = ids[rows['row'], keys]
 
-def select_valid_hits(df, ranks):
+    found = df[by].iloc[rows['row']].reset_index(drop=True)
+    found['key'] = keys
+    found[ASSIGNMENT_TAX_ID] = values
+
+    # tax_ids of the non-bumped hits at each rank a bumped hit landed on
+    valids = df[by].iloc[have['row']].reset_index(drop=True)
+    valids['row'] = have['row']
+    valids = valids.merge(found[by + ['key']].drop_duplicates(), on=by)
+    valids[ASSIGNMENT_TAX_ID] = ids[valids['row'].values, valids['key'].values]
+    valids = valids[by + ['key', ASSIGNMENT_TAX_ID]].drop_duplicates()
+
+    found = found.merge(valids, how='left', indicator=True)
+    return numpy.where(
+        found['_merge'] == 'left_only', found[ASSIGNMENT_TAX_ID], None)
+
+
+def select_valid_hits(df, ranks, by=['specimen', 'qseqid'],
+                      ids=None, thresholds=None):
     """Return valid hits of the most specific rank that passed their
     corresponding rank thresholds.  Hits that pass their rank thresholds
     but do not have a tax_id at that rank will be bumped to a less specific
     rank id and varified as a unique tax_id.
+
+    Every query grouped by `by' is evaluated at once: the rank of a query
+    is the most specific rank at which at least one of its hits passed the
+    threshold and has a tax_id.  `ranks' are ordered most specific first.
+
+    The rank ids and thresholds of each hit are the rank and rank
+    threshold columns of `df' unless given as (hits x ranks) arrays `ids'
+    (null where missing) and `thresholds'.
     """
 
-    for r in ranks:
-        thresholds = df['{}_threshold'.format(r)]
-        pidents = df['pident']
-        valid = df[thresholds < pidents]
+    columns = df.columns.tolist() + [ASSIGNMENT_TAX_ID, 'assignment_threshold']
 
-        if valid.empty:
-            # Move to higher rank
-            continue
+    if thresholds is None:
+        thresholds = df[['{}_threshold'.format(r) for r in ranks]].values
+    thresholds = thresholds.astype(float, copy=False)
+    with numpy.errstate(invalid='ignore'):
+        passed = thresholds < df['pident'].values[:, numpy.newaxis]
+    if ids is None:
+        have_ids = df[ranks].notnull().values
+    else:
+        have_ids = pd.notnull(ids)
 
-        tax_ids = valid[r]
-        na_ids = tax_ids.isnull()
+    # most specific usable rank for each hit; len(ranks) if none
+    usable = passed & have_ids
+    first = numpy.where(usable.any(axis=1), usable.argmax(axis=1), len(ranks))
+    first = df[by].assign(rank=first).groupby(by)['rank'].transform('min')
 
-        # Occasionally tax_ids will be missing at a certain rank.
-        # If so use the next less specific tax_id available
-        if na_ids.all():
-            continue
+    rows = numpy.rec.fromarrays(
+        [numpy.arange(len(df)), first.values], names=['row', 'rank'])
+    rows = rows[rows['rank'] < len(ranks)]
+    rows = rows[passed[rows['row'], rows['rank']]]
+
+    if len(rows) == 0:
+        # nothing passed
+        return pd.DataFrame(columns=columns)
+
+    if ids is None:
+        tax_ids = df[ranks].values[rows['row'], rows['rank']]
+    else:
+        tax_ids = ids[rows['row'], rows['rank']]
 
-        if na_ids.any():
-            # bump up missing taxids
-            have_ids = valid[tax_ids.notnull()]
-            found_ids = valid[na_ids].apply(
-                find_tax_id, args=(have_ids, r, ranks), axis=1)
-            tax_ids = have_ids[r].append(found_ids)
+    # Occasionally tax_ids will be missing at a certain rank.
+    # If so use the next less specific tax_id available
+    bumped = ~have_ids[rows['row'], rows['rank']]
+    if bumped.any():
+        tax_ids[bumped] = find_tax_ids(df, rows, ranks, bumped, by, ids=ids)
 
-        valid[ASSIGNMENT_TAX_ID] = tax_ids
-        valid['assignment_threshold'] = thresholds
-        # return notnull() assignment_threshold valid values
-        return valid[valid[ASSIGNMENT_TAX_ID].notnull()]
+    valid = df.iloc[rows['row']].copy()
+    valid[ASSIGNMENT_TAX_ID] = tax_ids
+    valid['assignment_threshold'] = thresholds[rows['row'], rows['rank']]
+    valid = valid[valid[ASSIGNMENT_TAX_ID].notnull()]
 
-    # nothing passed
-    df[ASSIGNMENT_TAX_ID] = None
-    df['assignment_threshold'] = None
+    # hits grouped by query in a stable order so the hits of each
+    # query are ordered the same whatever else is in `df'
+    valid = valid.sort_values(by=by, kind='mergesort')
 
-    return pd.DataFrame(columns=df.columns)
+    return valid
 
 
 def calculate_pct_references(df, pct_reference):
@@ -411,36 +764,23 @@ def calculate_pct_references(df, pct_reference):
     return df
 
 
-def pct(s):
-    """Calculate series pct something
+def pct(s, level='specimen'):
+    """Calculate the percent of each value of Series `s' in the total of
+    its group by index `level'
     """
 
-    return s / s.sum() * 100
+    return s / s.groupby(level=level, sort=False).transform('sum') * 100
 
 
-def load_rank_thresholds(
-        path=os.path.join(datadir, 'rank_thresholds.csv'), usecols=None):
-    """Load a rank-thresholds file.  If no argument is specified the default
-    rank_threshold_defaults.csv file will be loaded.
+def copy_corrections(copy_numbers, blast_results, root='1'):
+    """Return the mean copy number of each assignment given a DataFrame
+    of `copy_numbers' indexed by tax_id with column median.
     """
 
-    return pd.read_csv(
-        path,
-        comment='#',
-        usecols=['tax_id'] + usecols,
-        dtype=dict(tax_id=str)).set_index('tax_id')
-
-
-def copy_corrections(copy_numbers, blast_results, user_file=None):
-    copy_numbers = pd.read_csv(
-        copy_numbers,
-        dtype=dict(tax_id=str, median=float),
-        usecols=['tax_id', 'median']).set_index('tax_id')
-
     # get root out (taxid: 1) and set it as the default correction value
 
     # set index nana (no blast result) to the defaul value
-    default = copy_numbers.get_value('1', 'median')
+    default = copy_numbers.get_value(root, 'median')
     default_entry = pd.DataFrame(default, index=[None], columns=['median'])
     copy_numbers = copy_numbers.append(default_entry)
 
@@ -458,23 +798,51 @@ def copy_corrections(copy_numbers, blast_results, user_file=None):
     return corrections
 
 
-def join_thresholds(df, thresholds, ranks):
+def join_thresholds(df, refs, codes=False):
     """Thresholds are matched to thresholds by rank id.
 
     If a rank id is not present in the thresholds then the next specific
     rank id is used all the way up to `root'.  If the root id still does
     not match then a warning is issued with the taxname and the blast hit
     is dropped.
+
+    The threshold of each tax_id is resolved once for the whole
+    taxonomy (see references.resolve_thresholds) so hits are only looked
+    up by tax_id.  Hits are returned grouped by the rank (most specific
+    first) and then the rank id they joined on, in order of appearance.
+
+    With `codes' the tax_ids of `df' are taxonomy codes (see --codes) and
+    rather than adding rank threshold columns the thresholds are left to
+    be looked up by code (see select_valid_hits).
     """
-    with_thresholds = pd.DataFrame(columns=df.columns)  # temp DFrame
 
-    for r in ranks:
-        with_thresholds = with_thresholds.append(
-            df.join(thresholds, on=r, how='inner'))
-        no_threshold = df[~df.index.isin(with_thresholds.index)]
-        df = no_threshold
+    ranks = refs.taxonomy.ranks
+
+    if codes:
+        tax_codes = df['tax_id'].values.astype(int)
+    else:
+        tax_codes = refs.taxonomy.codes(df['tax_id'])
+    rank = numpy.where(
+        tax_codes != -1, refs.threshold_ranks[tax_codes], -1)
+    matched = numpy.where(
+        tax_codes != -1, refs.threshold_rows[tax_codes], -1)
+
+    rows = numpy.flatnonzero(matched != -1)
+
+    # order of first appearance of each (rank, rank id) pair
+    keys = rank[rows].astype(numpy.int64) * len(refs.thresholds) + matched[rows]
+    _, first, inverse = numpy.unique(
+        keys, return_index=True, return_inverse=True)
+    rows = rows[numpy.lexsort((rows, first[inverse], -rank[rows]))]
+
+    with_thresholds = df.iloc[rows].copy()
+    if not codes:
+        thresholds = refs.thresholds[matched[rows]]
+        for i, r in enumerate(ranks):
+            with_thresholds['{}_threshold'.format(r)] = thresholds[:, i]
 
     # issue warning messages for everything that did not join
+    df = df.iloc[numpy.flatnonzero(matched == -1)]
     if len(df) > 0:
         tax_names = df['tax_name'].drop_duplicates()
         msg = ('dropping blast hit `{}\', no valid '
@@ -484,14 +852,36 @@ def join_thresholds(df, thresholds, ranks):
     return with_thresholds
 
 
-def get_compression(io):
-    if io is sys.stdout:
-        compression = None
-    else:
-        compress_ops = {'.gz': 'gzip', '.bz2': 'bz2'}
-        ext = os.path.splitext(io)[-1]
-        compression = compress_ops.get(ext, None)
-    return compression
+def load_references(args):
+    """Return References from the csv inputs and/or the --index bundle"""
+
+    if args.seq_info and args.taxonomy:
+        if args.index:
+            return references.build(
+                args.index, args.seq_info, args.taxonomy,
+                args.rank_thresholds, args.copy_numbers)
+        return References.from_csv(
+            args.seq_info, args.taxonomy,
+            args.rank_thresholds, args.copy_numbers)
+    elif not args.index:
+        sys.exit('seq_info and taxonomy are required without --index')
+    elif not os.path.exists(args.index):
+        sys.exit('{} does not exist, build it with bioy classifier_index '
+                 'or provide seq_info and taxonomy'.format(args.index))
+
+    log.info('loading reference bundle {}'.format(args.index))
+    refs = References.load(args.index)
+
+    # optional inputs given with the bundle must be the ones it was built from
+    hashes = references.input_hashes(
+        None, None, args.rank_thresholds, args.copy_numbers)
+    hashes = {k: v for k, v in hashes.items() if v is not None}
+    changed = refs.changed(hashes)
+    if changed:
+        sys.exit('{} is out of date ({}), rebuild it with bioy '
+                 'classifier_index'.format(args.index, ', '.join(changed)))
+
+    return refs
 
 
 def build_parser(parser):
@@ -502,10 +892,10 @@ def build_parser(parser):
                 query and subject hits, containing
                 at least {}.""".format(sequtils.BLAST_FORMAT_DEFAULT))
     parser.add_argument(
-        'seq_info',
+        'seq_info', nargs='?',
         help='File mapping reference seq name to tax_id')
     parser.add_argument(
-        'taxonomy',
+        'taxonomy', nargs='?',
         help="""Table defining the taxonomy for each tax_id""")
 
     # optional inputs
@@ -516,6 +906,11 @@ def build_parser(parser):
     parser.add_argument(
         '--rank-thresholds', metavar='CSV',
         help="""Columns [tax_id,ranks...]""")
+    parser.add_argument(
+        '--index', metavar='FILE',
+        help="""Reference bundle compiled from seq_info, taxonomy, rank
+        thresholds and copy numbers (see classifier_index).  Rebuilt if
+        seq_info and taxonomy are given and have changed.""")
     parser.add_argument(
         '--specimen-map', metavar='CSV',
         help="""CSV file with columns (name, specimen) assigning sequences to
@@ -538,6 +933,10 @@ def build_parser(parser):
         '-O', '--details-out',
         metavar='FILE',
         help="""Optional details of taxonomic assignments.""")
+    parser.add_argument(
+        '--details-format', choices=DetailsWriter.formats, default='csv',
+        help="""format of --details-out, csv (compressed if FILE ends
+        with .gz or .bz2) or a columnar npz file [%(default)s]""")
 
     # switches and options
     parser.add_argument(
@@ -602,6 +1001,33 @@ def build_parser(parser):
         help=('Do not combine common condensed assignments'))
     parser.add_argument(
         '--limit', type=int, help='limit number of blast results')
+    parser.add_argument(
+        '--stream', action='store_true',
+        help="""classify and write results one group of specimens at a
+        time. Hits of each specimen must be contiguous in the blast file
+        and output follows the order of specimens in the blast file""")
+    parser.add_argument(
+        '--chunksize', metavar='ROWS', type=int, default=100000,
+        help="""number of blast results to read at a time
+        with --stream [%(default)s]""")
+    parser.add_argument(
+        '--codes', action='store_true',
+        help="""work on integer codes in place of sequence names,
+        specimens and tax_ids, restoring them in the output""")
+    parser.add_argument(
+        '--batch', action='store_true',
+        help="""blast_file is a csv manifest with columns blast_file, out
+        and optionally specimen_map, weights, details_out and store, each row
+        classified in turn with the reference data loaded once""")
+    parser.add_argument(
+        '--timings', metavar='FILE',
+        help="""write the elapsed time, rows in and out and change and
+        peak of resident memory of each stage as csv (json if FILE ends
+        with .json)""")
+    parser.add_argument(
+        '--store', metavar='DIR',
+        help="""directory of results of each specimen, classifying only
+        specimens that are new or changed since they were stored""")
     parser.add_argument(
         '--best-n-hits', type=int,
         help="""for each query sequence, filter out all but the best N hits,
@@ -610,12 +1036,11 @@ def build_parser(parser):
         """)
 
 
-def action(args):
-    # for debugging:
-    # pd.set_option('display.max_columns', None)
-    # pd.set_option('display.max_rows', None)
+def read_blast_results(args, **kwargs):
+    """Read the blast file passing `kwargs' (eg chunksize) to
+    pd.read_csv
+    """
 
-    # format blast data and add additional available information
     names = None if args.has_header else sequtils.BLAST_HEADER_DEFAULT
     header = 0 if args.has_header else None
     usecols = ['qseqid', 'sseqid', 'pident', 'qcovs']
@@ -626,34 +1051,254 @@ def action(args):
         dtypes['mismatch'] = int
     log.info(usecols)
     log.info(dtypes)
-    log.info('loading blast results')
-    blast_results = pd.read_csv(
+    return pd.read_csv(
         args.blast_file,
         dtype=dtypes,
         names=names,
         na_filter=True,  # False is faster
         header=header,
         usecols=usecols,
-        nrows=args.limit)
+        **kwargs)
 
-    if blast_results.empty:
-        log.info('blast results empty, exiting.')
-        return
 
-    # load specimen-map
-    if args.specimen_map:
+def load_specimen_map(args):
+    """Return the --specimen-map as a DataFrame indexed by qseqid or None"""
+
+    if not args.specimen_map:
+        return None
+
+    spec_map = pd.read_csv(
+        args.specimen_map,
+        names=['qseqid', 'specimen'],
+        usecols=['qseqid', 'specimen'],
+        dtype=str)
+    spec_map = spec_map.drop_duplicates()
+    return spec_map.set_index('qseqid')
+
+
+def load_weights(args):
+    """Return the --weights as a DataFrame indexed by qseqid or None"""
+
+    if not args.weights:
+        return None
+
+    return pd.read_csv(
+        args.weights,
+        names=['qseqid', 'weight'],
+        dtype=dict(qseqid=str, weight=float),
+        index_col='qseqid')
+
+
+def read_manifest(args):
+    """Return a copy of `args' for each row of the --batch manifest
+    (named by the blast_file argument) with the arguments named by the
+    manifest columns replaced by the values of the row.
+    """
+
+    manifest = utils.read_csv(args.blast_file, dtype=str)
+
+    missing = [c for c in ['blast_file', 'out'] if c not in manifest]
+    if missing:
+        sys.exit('--batch manifest {} is missing column(s) {}'.format(
+            args.blast_file, ', '.join(missing)))
+    unknown = [c for c in manifest if c not in MANIFEST_COLUMNS]
+    if unknown:
+        sys.exit('--batch manifest {} has unknown column(s) {}'.format(
+            args.blast_file, ', '.join(unknown)))
+
+    runs = []
+    for row in manifest.to_dict('records'):
+        run = copy.copy(args)
+        for column, value in row.items():
+            setattr(run, column, None if pd.isnull(value) else value)
+        runs.append(run)
+    return runs
+
+
+def specimen_keys(blast_results, args, spec_map=None):
+    """Return a Series (indexed by position) with the specimen of each
+    hit, null for qseqids missing from the specimen map.
+    """
+
+    if spec_map is not None:
+        keys = spec_map['specimen'].reindex(blast_results['qseqid'].values)
+    elif args.specimen:
+        keys = pd.Series(args.specimen, index=blast_results.index)
+    else:
+        keys = blast_results['qseqid']
+    return pd.Series(keys.values)
+
+
+def partition_specimens(blast_results, args, spec_map=None, partitions=1):
+    """Split blast results into at most `partitions' frames of whole
+    specimens with about the same number of hits.  Frames are in order
+    of specimen and keep the order of the hits of each specimen.  Hits of
+    qseqids missing from the specimen map are dropped.
+    """
+
+    keys = specimen_keys(blast_results, args, spec_map)
+    keep = keys.notnull().values
+    codes, _ = pd.factorize(keys[keep], sort=True)
+    rows = numpy.flatnonzero(keep)[numpy.argsort(codes, kind='mergesort')]
+
+    # cut at the end of the specimen holding each evenly spaced row
+    ends = numpy.bincount(codes).cumsum()
+    cuts = numpy.arange(1, partitions) * len(rows) // partitions
+    cuts = numpy.unique(ends[numpy.searchsorted(ends, cuts, side='right')])
+    cuts = numpy.concatenate([[0], cuts[cuts < len(rows)], [len(rows)]])
+
+    return [blast_results.iloc[rows[start:end]]
+            for start, end in zip(cuts[:-1], cuts[1:])]
+
+
+def specimen_digests(blast_results, args, refs, spec_map=None,
+                     weights_file=None):
+    """Return a dict of {specimen: digest} with the sha1 digest of the
+    hits of each specimen (in order, with their weights), the
+    CLASSIFY_OPTIONS of `args' and the digests of the reference inputs.
+    Hits of qseqids missing from the specimen map are dropped.
+    """
+
+    salt = json.dumps([{k: getattr(args, k) for k in CLASSIFY_OPTIONS},
+                       refs.hashes], sort_keys=True)
+
+    keys = specimen_keys(blast_results, args, spec_map)
+    keep = keys.notnull().values
+    codes, specimens = pd.factorize(keys[keep], sort=True)
+    rows = numpy.flatnonzero(keep)[numpy.argsort(codes, kind='mergesort')]
+
+    hits = blast_results.iloc[rows].copy()
+    hits.insert(0, 'specimen', keys.values[rows])
+    if weights_file is not None:
+        hits = hits.join(weights_file, on='qseqid')
+
+    # hits of each specimen are consecutive lines
+    lines = hits.to_csv(None, header=False, index=False).splitlines(True)
+    sizes = numpy.bincount(codes)
+    ends = sizes.cumsum()
+
+    digests = {}
+    for specimen, start, end in zip(specimens, ends - sizes, ends):
+        digest = hashlib.sha1(salt)
+        digest.update(''.join(lines[start:end]))
+        digests[specimen] = digest.hexdigest()
+    return digests
+
+
+def stream_blast_results(args, spec_map=None):
+    """Yield blast results read about --chunksize lines at a time without
+    splitting the hits of a specimen across chunks.
+
+    The hits of each specimen must be contiguous in the blast file
+    (sorted or grouped by specimen and qseqid), otherwise exit with an
+    error.  Hits of the last specimen of a chunk are held back until the
+    next chunk shows whether that specimen continues.
+    """
+
+    reader = read_blast_results(args, chunksize=args.chunksize)
+
+    def check(keys):
+        repeated = [k for k in keys if k in done]
+        if repeated or len(set(keys)) < len(keys):
+            repeated = repeated or [k for k in keys if keys.count(k) > 1]
+            sys.exit('--stream requires blast results grouped by specimen, '
+                     'found specimen {} in more than one place'.format(
+                         repeated[0]))
+        done.update(keys)
+
+    done = set()
+    held, held_key = [], None  # hits of the last specimen read so far
+    rows = 0
+    for chunk in reader:
+        if args.limit:
+            chunk = chunk.iloc[:args.limit - rows]
+            rows += len(chunk)
+            if chunk.empty:
+                break
+
+        keys = specimen_keys(chunk, args, spec_map)
+        if keys.isnull().any():
+            # hits of qseqids missing from the specimen map are dropped
+            # by classify anyway
+            chunk = chunk[keys.notnull().values]
+            keys = keys.dropna().reset_index(drop=True)
+            if chunk.empty:
+                continue
+
+        starts = (keys != keys.shift()).values
+        starts[0] = not held or keys[0] != held_key
+        last = starts.cumsum()
+        last = last == last[-1]
+
+        if last.all() and not starts[0]:
+            # the held specimen continues through the whole chunk
+            held.append(chunk)
+            continue
+
+        # specimens completed by this chunk
+        check(([held_key] if held else []) + keys[starts & ~last].tolist())
+
+        ready = held + [chunk[~last]]
+        held, held_key = [chunk[last]], keys[last].iloc[0]
+        ready = pd.concat(ready, ignore_index=True)
+        if not ready.empty:
+            yield ready
+
+    if held:
+        check([held_key])
+        yield pd.concat(held, ignore_index=True)
+
+
+def classify(blast_results, args, refs, spec_map=None, weights_file=None,
+             timings=None):
+    """Classify blast results holding every hit of the specimens they
+    include.  Returns the classification output and the details (None
+    without --details-out), each ready to be written.
+
+    The seq_info and taxonomy of only the reference sequences hit are
+    taken from References `refs'.  With --codes their tax_ids are
+    taxonomy codes (see Taxonomy.to_frame) and names are coded here.
+    Stages are recorded in utils.Timings `timings' if given (see
+    --timings).
+    """
+
+    if timings is None:
+        timings = utils.Timings()
+
+    with timings.stage('selecting references', len(blast_results)) as stage:
+        seq_info, taxonomy = refs.frames(
+            blast_results['sseqid'], codes=args.codes)
+        stage['rows_out'] = len(seq_info)
+
+    if args.codes:
+        # qseqids, sseqids and specimens are coded in sorted order and
+        # restored for output
+        names = {}
+        codes, names['qseqid'] = encode(blast_results['qseqid'])
+        blast_results['qseqid'] = codes
+        codes, names['sseqid'] = encode(blast_results['sseqid'])
+        blast_results['sseqid'] = numpy.where(codes != -1, codes, numpy.nan)
+
+        seq_info = coded_index(seq_info, names['sseqid'])
+        seq_info.index = seq_info.index.astype(float)
+        seq_info.index.name = 'sseqid'
+        if weights_file is not None:
+            weights_file = coded_index(weights_file, names['qseqid'])
+        if spec_map is not None:
+            spec_map = coded_index(spec_map, names['qseqid'])
+            spec_map['specimen'], names['specimen'] = encode(
+                spec_map['specimen'])
+        elif args.specimen:
+            names['specimen'] = pd.Index([args.specimen])
+        else:
+            names['specimen'] = names['qseqid']
+
+    if spec_map is not None:
         # if a specimen_map is defined and a qseqid is not included in the map
         # hits to that qseqid will be dropped (inner join)
-        spec_map = pd.read_csv(
-            args.specimen_map,
-            names=['qseqid', 'specimen'],
-            usecols=['qseqid', 'specimen'],
-            dtype=str)
-        spec_map = spec_map.drop_duplicates()
-        spec_map = spec_map.set_index('qseqid')
         blast_results = blast_results.join(spec_map, on='qseqid', how='inner')
     elif args.specimen:
-        blast_results['specimen'] = args.specimen
+        blast_results['specimen'] = 0 if args.codes else args.specimen
     else:
         blast_results['specimen'] = blast_results['qseqid']  # by qseqid
 
@@ -665,72 +1310,59 @@ def action(args):
     log.info('successfully loaded {} blast results for {} query '
              'sequences'.format(blast_results_len, len(qseqids)))
 
-    blast_results = raw_filtering(blast_results)
-
-    # remove no blast hits
-    # no_blast_results will be added back later but we do not
-    # want to confuse these with blast results filter by joins
-    log.info('identifying no_blast_hits')
-    blast_results = blast_results[blast_results['sseqid'].notnull()]
-
-    # load seq_info as a bridge to the sequence taxonomy.  Additional
-    # columns can be specified to be included in the details-out file
-    # such as accession number
-    seq_info = pd.read_csv(
-        args.seq_info,
-        usecols=['seqname', 'tax_id', 'accession'],
-        dtype=dict(seqname=str, tax_id=str, accession=str))
-    seq_info = seq_info.set_index('seqname')
-    # rename index to match blast results column name
-    seq_info.index.name = 'sseqid'
+    with timings.stage('filtering', len(blast_results)) as stage:
+        blast_results = raw_filtering(blast_results)
+
+        # remove no blast hits
+        # no_blast_results will be added back later but we do not
+        # want to confuse these with blast results filter by joins
+        log.info('identifying no_blast_hits')
+        blast_results = blast_results[blast_results['sseqid'].notnull()]
+        stage['rows_out'] = len(blast_results)
 
     # merge blast results with seq_info - do this early so that
     # refseqs not represented in the blast results are discarded in
     # the merge.
     blast_results_len = len(blast_results)
     log.info('joining seq_info file')
-    blast_results = blast_results.join(seq_info, on='sseqid', how='inner')
+    with timings.stage('joining seq_info', blast_results_len) as stage:
+        blast_results = blast_results.join(seq_info, on='sseqid', how='inner')
+        stage['rows_out'] = len(blast_results)
     len_diff = blast_results_len - len(blast_results)
     if len_diff:
         log.warn('{} subject sequences dropped without '
                  'records in seq_info file'.format(len_diff))
 
-    # load the full taxonomy table.  Rank specificity as ordered from
-    # left (less specific) to right (more specific)
-    taxonomy = pd.read_csv(args.taxonomy, dtype=str).set_index('tax_id')
-
-    # get the a list of rank columns ordered by specificity (see above)
-    # NOTE: we are assuming the rank columns
-    ranks = taxonomy.columns.tolist()
-    ranks = ranks[ranks.index('root'):]
+    # Rank specificity as ordered from left (less specific) to right
+    # (more specific)
+    ranks = refs.taxonomy.ranks
 
     # now combine just the rank columns to the blast results
     blast_results_len = len(blast_results)
     log.info('joining taxonomy file')
-    blast_results = blast_results.join(
-        taxonomy[['tax_name', 'rank'] + ranks], on='tax_id', how='inner')
+    # with --codes rank ids are looked up by code when selecting hits
+    columns = ['tax_name', 'rank'] + ([] if args.codes else ranks)
+    with timings.stage('joining taxonomy', blast_results_len) as stage:
+        blast_results = blast_results.join(
+            taxonomy[columns], on='tax_id', how='inner')
+
+        # inner joins group hits by key in order of first appearance
+        # among all specimens; restore the order of the blast file so the
+        # hits of each specimen are in the same order however specimens
+        # are partitioned
+        blast_results = blast_results.sort_index(kind='mergesort')
+        stage['rows_out'] = len(blast_results)
     len_diff = blast_results_len - len(blast_results)
     if len_diff:
         msg = '{} subject sequences dropped without records in taxonomy file'
         log.warn(msg.format(len_diff))
 
-    # load the default rank thresholds
-    rank_thresholds = load_rank_thresholds(usecols=ranks)
-
-    # and any additional thresholds specified by the user
-    if args.rank_thresholds:
-        rank_thresholds = rank_thresholds.append(
-            load_rank_thresholds(path=args.rank_thresholds, usecols=ranks))
-        # overwrite with user defined tax_id threshold
-        rank_thresholds = rank_thresholds.groupby(level=0, sort=False).last()
-
-    rank_thresholds_cols = ['{}_threshold'.format(c) if c in ranks else c
-                            for c in rank_thresholds.columns]
-    rank_thresholds.columns = rank_thresholds_cols
+    rank_thresholds_cols = ['{}_threshold'.format(r) for r in ranks]
 
     log.info('joining thresholds file')
-    blast_results = join_thresholds(
-        blast_results, rank_thresholds, ranks[::-1])
+    with timings.stage('joining thresholds', len(blast_results)) as stage:
+        blast_results = join_thresholds(blast_results, refs, codes=args.codes)
+        stage['rows_out'] = len(blast_results)
 
     # save the blast_results.columns in case groupby drops all columns
     blast_results_columns = blast_results.columns
@@ -739,9 +1371,18 @@ def action(args):
     log.info('selecting valid hits')
     blast_results_len = float(len(blast_results))
 
-    valid_hits = blast_results.groupby(
-        by=['specimen', 'qseqid'], group_keys=False)
-    valid_hits = valid_hits.apply(select_valid_hits, ranks[::-1])
+    with timings.stage('selecting valid hits', len(blast_results)) as stage:
+        if args.codes:
+            tax_codes = blast_results['tax_id'].values.astype(int)
+            ids = refs.taxonomy.lineages[tax_codes, ::-1]
+            ids = numpy.where(ids != -1, ids, numpy.nan)
+            thresholds = refs.thresholds[refs.threshold_rows[tax_codes], ::-1]
+            valid_hits = select_valid_hits(
+                blast_results, ranks[::-1], ids=ids, thresholds=thresholds)
+            del ids, thresholds
+        else:
+            valid_hits = select_valid_hits(blast_results, ranks[::-1])
+        stage['rows_out'] = len(valid_hits)
 
     if args.hits_below_threshold:
         """
@@ -759,6 +1400,9 @@ def action(args):
                               'assignment', 'assignment_hash',
                               'condensed_rank', ASSIGNMENT_TAX_ID]
         assignment_columns += blast_results_columns.tolist()
+        # --include-ref-rank columns are expected in the details
+        assignment_columns += [r + '_id' for r in args.include_ref_rank]
+        assignment_columns += [r + '_name' for r in args.include_ref_rank]
         blast_results = pd.DataFrame(columns=assignment_columns)
     else:
 
@@ -770,18 +1414,11 @@ def action(args):
         if args.best_n_hits:
             blast_results_len = len(blast_results)
 
-            def filter_mismatches(df, best_n):
-                """
-                Filter all hits with more mismatches than the Nth best hit
-                """
-
-                threshold = df['mismatch'].nsmallest(best_n).iloc[-1]
-                return df[df['mismatch'] <= threshold]
-
             # Filter hits for each query
-            blast_results = blast_results.groupby(
-                by=['specimen', 'qseqid'],
-                group_keys=False).apply(filter_mismatches, args.best_n_hits)
+            with timings.stage('best n hits', blast_results_len) as stage:
+                blast_results = blast_results[
+                    best_n_hits(blast_results, args.best_n_hits)]
+                stage['rows_out'] = len(blast_results)
 
             blast_results_post_len = len(blast_results)
             log.info('{} ({:.0%}) hits remain after filtering '
@@ -790,8 +1427,8 @@ def action(args):
                          blast_results_post_len / blast_results_len))
 
         # drop unneeded tax and threshold columns to free memory
-        for c in ranks + rank_thresholds_cols:
-            blast_results = blast_results.drop(c, axis=1)
+        blast_results = blast_results.drop(
+            ranks + rank_thresholds_cols, axis=1, errors='ignore')
 
         # join with taxonomy for tax_name and rank
         blast_results = blast_results.join(
@@ -804,48 +1441,50 @@ def action(args):
             columns={'tax_name_assignment': 'assignment_tax_name',
                      'rank_assignment': 'assignment_rank'})
 
-        # TODO: this is relatively slow, need to integrate
-        # pandas into sequtils.condense_ids
-        tax_dict = {i: t.to_dict() for i, t in taxonomy.fillna('').iterrows()}
+        # integer coded taxonomy indexable like a dict of taxonomy rows
+        tax_dict = refs.taxonomy
 
         # create condensed assignment hashes by qseqid
         msg = 'condensing group tax_ids to size {}'.format(args.max_group_size)
         log.info(msg)
-        blast_results = blast_results.groupby(
-            by=['specimen', 'qseqid'], sort=False, group_keys=False)
-        blast_results = blast_results.apply(
-            condense_ids,
-            tax_dict,
-            ranks,
-            args.max_group_size,
-            threshold_assignments=args.threshold_assignments)
-
-        blast_results = blast_results.join(
-            taxonomy[['rank']], on='condensed_id', rsuffix='_condensed')
-
-        blast_results = blast_results.rename(
-            columns={'rank_condensed': 'condensed_rank'})
-
-        # star condensed ids if one hit meets star threshold
-        by = ['specimen', 'assignment_hash', 'condensed_id']
-        blast_results = blast_results.groupby(
-            by=by, sort=False, group_keys=False)
-        blast_results = blast_results.apply(star, args.starred)
+        with timings.stage('condensing', len(blast_results)) as stage:
+            condensed_ids, assignment_hashes = condense_ids(
+                blast_results,
+                tax_dict,
+                ranks,
+                args.max_group_size,
+                threshold_assignments=args.threshold_assignments,
+                codes=args.codes)
+            blast_results['condensed_id'] = condensed_ids
+            blast_results['assignment_hash'] = assignment_hashes
+
+            blast_results = blast_results.join(
+                taxonomy[['rank']], on='condensed_id', rsuffix='_condensed')
+
+            blast_results = blast_results.rename(
+                columns={'rank_condensed': 'condensed_rank'})
+
+            # star condensed ids if one hit meets star threshold
+            blast_results['starred'] = star(blast_results, args.starred)
+            stage['rows_out'] = len(blast_results)
 
         # assign names to assignment_hashes
-        blast_results = blast_results.sort_values(by='assignment_hash')
         log.info('creating compound assignments')
-        blast_results = blast_results.groupby(
-            by=['specimen', 'assignment_hash'], sort=False, group_keys=False)
-        blast_results = blast_results.apply(assign, tax_dict)
+        with timings.stage('assigning', len(blast_results)) as stage:
+            blast_results = blast_results.sort_values(
+                by='assignment_hash', kind='mergesort')
+            blast_results['assignment'] = assign(
+                blast_results, tax_dict, codes=args.codes)
+            stage['rows_out'] = len(blast_results)
 
         # Foreach ref rank:
         # - merge with taxonomy, extract rank_id, rank_name
+        # - missing rank ids are 0 (-1 until decoded with --codes)
         for rank in args.include_ref_rank:
             blast_results[rank + '_id'] = blast_results.merge(
                 taxonomy, left_on='tax_id',
                 right_index=True,
-                how='left')[rank].fillna(0)
+                how='left')[rank].fillna(-1 if args.codes else 0)
             blast_results[rank + '_name'] = blast_results.merge(
                 taxonomy,
                 left_on=rank + '_id',
@@ -863,144 +1502,449 @@ def action(args):
     # concludes our blast details, on to output summary
     log.info('summarizing output')
 
-    # index by specimen and assignment_hash and add assignment column
-    index = ['specimen', 'assignment_hash']
-    output = blast_results[index + ['assignment']].drop_duplicates()
-    output = output.set_index(index)
-
-    # assignment level stats
-    assignment_stats = blast_results.groupby(by=index, sort=False)
-    output['max_percent'] = assignment_stats['pident'].max()
-    output['min_percent'] = assignment_stats['pident'].min()
-    output['min_threshold'] = assignment_stats['assignment_threshold'].min()
-    output['best_rank'] = assignment_stats['condensed_rank'].apply(
-        best_rank, ranks)
-
-    # qseqid cluster stats
-    weights = blast_results[
-        ['qseqid', 'specimen', 'assignment_hash', 'assignment_threshold']]
-    weights = weights.drop_duplicates().set_index('qseqid')
-
-    if args.weights:
-        weights_file = pd.read_csv(
-            args.weights,
-            names=['qseqid', 'weight'],
-            dtype=dict(qseqid=str, weight=float),
-            index_col='qseqid')
-        weights = weights.join(weights_file)
-        # enforce weight dtype as float and unlisted qseq's to weight of 1.0
-        weights['weight'] = weights['weight'].fillna(1.0).astype(float)
-    else:
-        weights['weight'] = 1.0
-
-    cluster_stats = weights[['specimen', 'assignment_hash', 'weight']]
-    cluster_stats = cluster_stats.reset_index().drop_duplicates()
-    cluster_stats = cluster_stats.groupby(
-        by=['specimen', 'assignment_hash'], sort=False)
-
-    output['reads'] = cluster_stats['weight'].sum()
-    output['clusters'] = cluster_stats.size()
-
-    # specimen level stats
-    specimen_stats = output.groupby(level='specimen', sort=False)
-    output['pct_reads'] = specimen_stats['reads'].apply(pct)
-
-    # copy number corrections
-    if args.copy_numbers:
-        corrections = copy_corrections(args.copy_numbers, blast_results)
-        output['corrected'] = output['reads'] / corrections
-        # reset corrected counts to int before calculating pct_corrected
-        output['corrected'] = output['corrected'].apply(math.ceil)
-        output['corrected'] = output['corrected'].fillna(1).astype(int)
-        # create pct_corrected column
-        output['pct_corrected'] = specimen_stats['corrected'].apply(pct)
-        output['pct_corrected'] = output['pct_corrected'].map(round_up)
-
-    # round reads for output
-    output['reads'] = output['reads'].apply(round).astype(int)
-    output['pct_reads'] = output['pct_reads'].map(round_up)
-
-    # sort output by:
-    # 1) specimen -- Data Frame is already grouped by specimen
-    # 2) read/corrected count
-    # 3) cluster count
-    # 4) alpha assignment
-    columns = ['corrected'] if args.copy_numbers else ['reads']
-    columns += ['clusters', 'assignment']
-    output = output.sort_values(by=columns, ascending=False)
-    output = output.reset_index(level='assignment_hash')
-
-    # Sort index (specimen) in preparation for groupby.
-    # Use stable sort (mergesort) to preserve sortings (1-4);
-    # default algorithm is not stable
-    output = output.sort_index(kind='mergesort')
-
-    # one last grouping on the sorted output plus assignment ids by specimen
-    output = output.groupby(level="specimen", sort=False).apply(assignment_id)
-
-    # output to details.csv.bz2
+    with timings.stage('summarizing', len(blast_results)) as stage:
+        # index by specimen and assignment_hash and add assignment column
+        index = ['specimen', 'assignment_hash']
+        output = blast_results[index + ['assignment']].drop_duplicates()
+        output = output.set_index(index)
+
+        # assignment level stats
+        assignment_stats = blast_results.groupby(by=index, sort=False)
+        output['max_percent'] = assignment_stats['pident'].max()
+        output['min_percent'] = assignment_stats['pident'].min()
+        output['min_threshold'] = assignment_stats[
+            'assignment_threshold'].min()
+        output['best_rank'] = best_rank(blast_results, ranks, by=index)
+
+        # qseqid cluster stats
+        weights = blast_results[
+            ['qseqid', 'specimen', 'assignment_hash', 'assignment_threshold']]
+        weights = weights.drop_duplicates().set_index('qseqid')
+
+        if weights_file is not None:
+            weights = weights.join(weights_file)
+            # enforce weight dtype as float and unlisted qseq's to
+            # weight of 1.0
+            weights['weight'] = weights['weight'].fillna(1.0).astype(float)
+        else:
+            weights['weight'] = 1.0
+
+        cluster_stats = weights[['specimen', 'assignment_hash', 'weight']]
+        cluster_stats = cluster_stats.reset_index().drop_duplicates()
+        cluster_stats = cluster_stats.groupby(
+            by=['specimen', 'assignment_hash'], sort=False)
+
+        output['reads'] = cluster_stats['weight'].sum()
+        output['clusters'] = cluster_stats.size()
+
+        # specimen level stats
+        output['pct_reads'] = pct(output['reads'])
+
+        # copy number corrections
+        if refs.copy_numbers is not None:
+            if args.codes:
+                corrections = copy_corrections(
+                    refs.copy_number_frame(codes=True),
+                    blast_results,
+                    root=float(refs.taxonomy.code('1')))
+            else:
+                corrections = copy_corrections(
+                    refs.copy_number_frame(), blast_results)
+            output['corrected'] = output['reads'] / corrections
+            # reset corrected counts to int before calculating pct_corrected
+            output['corrected'] = numpy.ceil(output['corrected'])
+            output['corrected'] = output['corrected'].fillna(1).astype(int)
+            # create pct_corrected column
+            output['pct_corrected'] = round_up(pct(output['corrected']))
+
+        # round reads (half up as round() does for positive values)
+        output['reads'] = numpy.floor(output['reads'] + 0.5).astype(int)
+        output['pct_reads'] = round_up(output['pct_reads'])
+
+        # sort output by:
+        # 1) specimen -- Data Frame is already grouped by specimen
+        # 2) read/corrected count
+        # 3) cluster count
+        # 4) alpha assignment
+        columns = ['corrected'] if refs.copy_numbers is not None else ['reads']
+        columns += ['clusters', 'assignment']
+        output = output.sort_values(by=columns, ascending=False)
+        output = output.reset_index(level='assignment_hash')
+
+        # Sort index (specimen) in preparation for groupby.
+        # Use stable sort (mergesort) to preserve sortings (1-4);
+        # default algorithm is not stable
+        output = output.sort_index(kind='mergesort')
+
+        # number assignments of each specimen in the sorted order
+        output = assignment_id(output)
+        stage['rows_out'] = len(output)
+
+    details = None
     if args.details_out:
-        # Annotate details with classification columns
-        blast_results = blast_results.merge(output.reset_index(), how='left')
-
-        if not args.details_full:
-            """
-            by using the assignment_threshold we will get multiple 'largest'
-            centroids for --max-group-size combined assignments
-            """
-            # groupby will drop NA values so we must fill them with 0
-            weights['assignment_threshold'] = weights[
-                'assignment_threshold'].fillna(0)
-            largest = weights.groupby(
-                by=['specimen', 'assignment_hash', 'assignment_threshold'],
-                sort=False)
-            largest = largest.apply(lambda x: x['weight'].nlargest(1))
-            largest = largest.reset_index()
-            # assignment_threshold will conflict with blast_results NA values
-            largest = largest.drop('assignment_threshold', axis=1)
-            blast_results = blast_results.merge(largest)
-
-        details_columns = ['specimen', 'assignment_id', 'tax_name', 'rank',
-                           'assignment_tax_name', 'assignment_rank', 'pident',
-                           'tax_id', ASSIGNMENT_TAX_ID, 'condensed_id',
-                           'accession', 'qseqid', 'sseqid', 'starred',
-                           'assignment_threshold']
-        ref_rank_columns = [rank + '_id' for rank in args.include_ref_rank]
-        ref_rank_columns += [rank + '_name' for rank in args.include_ref_rank]
-        details_columns += ref_rank_columns
-
-        if args.hits_below_threshold:
-            """
-            append assignment_thresholds and append to --details-out
-            """
-            deets_cols = hits_below_threshold.columns
-            deets_cols &= set(details_columns)
-            hits_below_threshold = hits_below_threshold[list(deets_cols)]
-            threshold_cols = ['specimen', 'qseqid', 'assignment_threshold']
-            assignment_thresholds = blast_results[threshold_cols]
-            assignment_thresholds = assignment_thresholds.drop_duplicates()
-            hits_below_threshold = hits_below_threshold.merge(
-                assignment_thresholds, how='left')
-            blast_results = pd.concat(
-                [blast_results, hits_below_threshold], ignore_index=True)
-
-        # sort details for consistency and ease of viewing
-        blast_results = blast_results.sort_values(by=details_columns)
-
-        blast_results.to_csv(
-            args.details_out,
-            compression=get_compression(args.details_out),
-            columns=details_columns,
-            header=True,
-            index=False,
-            float_format='%.2f')
+        with timings.stage('details', len(blast_results)) as stage:
+            # Annotate details with classification columns
+            blast_results = blast_results.merge(
+                output.reset_index(), how='left')
+
+            if not args.details_full:
+                """
+                by using the assignment_threshold we will get multiple
+                'largest' centroids for --max-group-size combined assignments
+                """
+                # groupby will drop NA values so we must fill them with 0
+                weights['assignment_threshold'] = weights[
+                    'assignment_threshold'].fillna(0)
+                largest = weights.groupby(
+                    by=['specimen', 'assignment_hash',
+                        'assignment_threshold'],
+                    sort=False)
+                largest = largest.apply(lambda x: x['weight'].nlargest(1))
+                largest = largest.reset_index()
+                # assignment_threshold will conflict with blast_results NA
+                # values
+                largest = largest.drop('assignment_threshold', axis=1)
+                blast_results = blast_results.merge(largest)
+
+            details_columns = ['specimen', 'assignment_id', 'tax_name',
+                               'rank', 'assignment_tax_name',
+                               'assignment_rank', 'pident', 'tax_id',
+                               ASSIGNMENT_TAX_ID, 'condensed_id',
+                               'accession', 'qseqid', 'sseqid', 'starred',
+                               'assignment_threshold']
+            ref_ranks = args.include_ref_rank
+            ref_rank_columns = [rank + '_id' for rank in ref_ranks]
+            ref_rank_columns += [rank + '_name' for rank in ref_ranks]
+            details_columns += ref_rank_columns
+
+            if args.hits_below_threshold:
+                """
+                append assignment_thresholds and append to --details-out
+                """
+                deets_cols = hits_below_threshold.columns
+                deets_cols &= set(details_columns)
+                hits_below_threshold = hits_below_threshold[list(deets_cols)]
+                threshold_cols = ['specimen', 'qseqid', 'assignment_threshold']
+                assignment_thresholds = blast_results[threshold_cols]
+                assignment_thresholds = assignment_thresholds.drop_duplicates()
+                hits_below_threshold = hits_below_threshold.merge(
+                    assignment_thresholds, how='left')
+                blast_results = pd.concat(
+                    [blast_results, hits_below_threshold], ignore_index=True)
+
+            if args.codes:
+                for column, values in names.items():
+                    blast_results[column] = decode(
+                        blast_results[column], values)
+                tax_ids = refs.taxonomy.tax_ids
+                for column in ['tax_id', ASSIGNMENT_TAX_ID, 'condensed_id']:
+                    blast_results[column] = decode(
+                        blast_results[column], tax_ids)
+                for column in ref_rank_columns[:len(ref_ranks)]:
+                    codes = blast_results[column]
+                    blast_results[column] = numpy.where(
+                        codes == -1, 0, decode(codes, tax_ids))
+
+            # sort details for consistency and ease of viewing
+            blast_results = sort_codes(blast_results, details_columns)
+            details = blast_results[details_columns]
+            stage['rows_out'] = len(details)
 
     # was required to merge with details above but not needed now
     output = output.drop('assignment_hash', axis=1)
 
-    # output results
-    output.to_csv(
-        args.out,
-        index=True,
-        float_format='%.2f',
-        compression=get_compression(args.out))
+    if args.codes:
+        specimens = output.index.levels[0]
+        output.index = output.index.set_levels(
+            decode(specimens, names['specimen']), level='specimen')
+
+    return output, details
+
+
+# arguments and reference data shared with worker processes (see
+# Classifier); inherited when forked since args may hold open files
+_context = None
+
+
+def _init_worker(context):
+    global _context
+    _context = context
+
+
+def _classify(blast_results):
+    timings = utils.Timings()
+    output, details = classify(blast_results, *_context, timings=timings)
+    return output, details, timings
+
+
+class Classifier(object):
+
+    """Classify blast files against reference data loaded once (on first
+    use) and shared by every blast file and, for each blast file, by a
+    pool of --threads worker processes.
+
+    Keyword Arguments:
+        - args -- arguments giving the reference data and --threads
+        - timings -- utils.Timings recording the stages of every run
+    """
+
+    def __init__(self, args, timings):
+        self.args = args
+        self.timings = timings
+        self.refs = None
+        self.pool = None
+
+    def load(self):
+        """Return the References, loading them if needed"""
+
+        if self.refs is None:
+            with self.timings.stage('loading references'):
+                # seq_info as a bridge to the sequence taxonomy, the
+                # full taxonomy table, rank thresholds and copy numbers
+                self.refs = load_references(self.args)
+        return self.refs
+
+    def classify(self, blast_results, args, spec_map=None, weights_file=None):
+        """Return an iterable of (output, details, timings) for partitions
+        of whole specimens of `blast_results' in order of specimen, with
+        timings None for partitions timed in self.timings.
+        """
+
+        refs = self.load()
+
+        # Specimens are classified independently so results for
+        # partitions of whole specimens (in order of specimen) are
+        # written one after the other exactly as if classified at once
+        parts = []
+        if args.threads > 1:
+            parts = partition_specimens(
+                blast_results, args, spec_map, args.threads * 4)
+
+        if len(parts) > 1:
+            if self.pool is None:
+                # workers inherit the context when forked
+                context = (args, refs, spec_map, weights_file)
+                self.pool = Pool(processes=args.threads,
+                                 initializer=_init_worker,
+                                 initargs=(context,))
+            return self.pool.imap(_classify, parts)
+
+        output, details = classify(
+            blast_results, args, refs, spec_map, weights_file,
+            timings=self.timings)
+        return [(output, details, None)]
+
+    def run(self, args):
+        """Classify the blast file of `args' writing --out and
+        --details-out
+        """
+
+        if args.store:
+            return self.run_store(args)
+
+        timings = self.timings
+
+        spec_map = load_specimen_map(args)
+        weights_file = load_weights(args)
+
+        # format blast data and add additional available information
+        log.info('loading blast results')
+        if args.stream:
+            chunks = stream_blast_results(args, spec_map)
+        else:
+            # read lazily so reading is timed as a stage
+            chunks = (read_blast_results(args, nrows=args.limit) for _ in [0])
+
+        out = details_out = None
+        try:
+            while True:
+                with timings.stage('loading blast results') as stage:
+                    blast_results = next(chunks, None)
+                    if blast_results is None:
+                        stage['calls'] = 0
+                    else:
+                        stage['rows_out'] = len(blast_results)
+                if blast_results is None:
+                    break
+
+                if blast_results.empty:
+                    log.info('blast results empty, exiting.')
+                    return
+
+                results = self.classify(
+                    blast_results, args, spec_map, weights_file)
+
+                for output, details, worker_timings in results:
+                    if worker_timings is not None:
+                        timings.update(worker_timings)
+
+                    # results are appended specimen by specimen
+                    header = out is None
+                    if header:
+                        out = utils.opener(args.out, 'w')
+                        if args.details_out:
+                            details_out = DetailsWriter(
+                                args.details_out,
+                                args.details_format,
+                                threads=args.threads)
+
+                    rows = len(output)
+                    if details is not None:
+                        rows += len(details)
+                    with timings.stage('writing', rows):
+                        output.to_csv(
+                            out,
+                            index=True,
+                            header=header,
+                            float_format='%.2f')
+
+                        if details is not None:
+                            details_out.write(details)
+        finally:
+            # workers hold the arguments of this run
+            self.close()
+            for f in [out, details_out]:
+                if f is not None and f is not sys.stdout:
+                    f.close()
+
+    def run_store(self, args):
+        """Classify the specimens of the blast file of `args' that are
+        new or changed since they were saved in the --store, and write
+        --out and --details-out for every specimen from the store
+        """
+
+        timings = self.timings
+        store = ResultStore(args.store)
+
+        spec_map = load_specimen_map(args)
+        weights_file = load_weights(args)
+
+        log.info('loading blast results')
+        with timings.stage('loading blast results') as stage:
+            blast_results = read_blast_results(args, nrows=args.limit)
+            stage['rows_out'] = len(blast_results)
+
+        if blast_results.empty:
+            log.info('blast results empty, exiting.')
+            return
+
+        refs = self.load()
+        with timings.stage('hashing specimens', len(blast_results)):
+            digests = specimen_digests(
+                blast_results, args, refs, spec_map, weights_file)
+
+        want_details = bool(args.details_out)
+        stored = {s: store.get(s, d, details=want_details)
+                  for s, d in digests.items()}
+        changed = sorted(s for s, texts in stored.items() if texts is None)
+        log.info('classifying {} of {} specimens (new or changed)'.format(
+            len(changed), len(digests)))
+
+        if changed:
+            keys = specimen_keys(blast_results, args, spec_map)
+            blast_results = blast_results[keys.isin(changed).values]
+            results = self.classify(
+                blast_results, args, spec_map, weights_file)
+            try:
+                for output, details, worker_timings in results:
+                    if worker_timings is not None:
+                        timings.update(worker_timings)
+                    with timings.stage('storing', len(output)):
+                        stored.update(self.save_results(
+                            store, digests, output, details))
+            finally:
+                self.close()
+
+            # specimens with no hits left after filtering
+            for specimen in changed:
+                if stored[specimen] is None:
+                    stored[specimen] = ('', '' if want_details else None)
+                    store.put(specimen, digests[specimen], *stored[specimen])
+
+        out = details_out = None
+        try:
+            with timings.stage('writing', len(digests)):
+                out = utils.opener(args.out, 'w')
+                if want_details:
+                    details_out = DetailsWriter(
+                        args.details_out, threads=args.threads)
+
+                # the first text written of each output keeps its header
+                headers = [True, True]
+                for specimen in sorted(stored):
+                    for i, (f, text) in enumerate(
+                            zip([out, details_out], stored[specimen])):
+                        if not text:
+                            continue
+                        if not headers[i]:
+                            text = text.split('\n', 1)[1]
+                        headers[i] = False
+                        if f is out:
+                            f.write(text)
+                        else:
+                            f.write_text(text)
+        finally:
+            for f in [out, details_out]:
+                if f is not None and f is not sys.stdout:
+                    f.close()
+
+        store.save(digests.keys())
+
+    def save_results(self, store, digests, output, details=None):
+        """Save the output and details of each specimen in `output' in
+        `store' and return a dict of {specimen: (output, details)} of
+        the text stored.
+        """
+
+        texts = {}
+        for specimen, rows in output.groupby(level='specimen', sort=False):
+            texts[specimen] = [
+                rows.to_csv(None, index=True, float_format='%.2f'), None]
+        if details is not None:
+            for specimen, rows in details.groupby('specimen', sort=False):
+                texts.setdefault(specimen, ['', None])[1] = rows.to_csv(
+                    None, index=False, float_format='%.2f')
+            for text in texts.values():
+                text[1] = text[1] or ''
+
+        for specimen, (out, deets) in texts.items():
+            store.put(specimen, digests[specimen], out, deets)
+        return {s: tuple(t) for s, t in texts.items()}
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def action(args):
+    # for debugging:
+    # pd.set_option('display.max_columns', None)
+    # pd.set_option('display.max_rows', None)
+
+    # check every manifest row (each may give its own store) before
+    # classifying anything
+    runs = read_manifest(args) if args.batch else [args]
+    for i, run in enumerate(runs, 1):
+        where = ' (--batch manifest row {})'.format(i) if args.batch else ''
+        if run.store and run.stream:
+            sys.exit('--store cannot be used with --stream' + where)
+        if run.store and run.details_format != 'csv':
+            sys.exit('--store writes --details-format csv only' + where)
+
+    timings = utils.Timings()
+    classifier = Classifier(args, timings)
+    try:
+        if args.batch:
+            for i, run in enumerate(runs, 1):
+                log.info('classifying {} ({} of {})'.format(
+                    run.blast_file, i, len(runs)))
+                classifier.run(run)
+        else:
+            classifier.run(args)
+    finally:
+        classifier.close()
+
+    if args.timings:
+        timings.write(args.timings)
@@ -0,0 +1,61 @@
+# This file is part of Bioy
+#
+#    Bioy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Bioy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Bioy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compile classifier reference data into a single memory mapped bundle
+
+The bundle is used with ``bioy classifier --index`` and is only rebuilt
+if the input files have changed since it was written (or with --force).
+"""
+
+import logging
+
+from bioy_pkg import references
+
+log = logging.getLogger(__name__)
+
+
+def build_parser(parser):
+    parser.add_argument(
+        'seq_info',
+        help='File mapping reference seq name to tax_id')
+    parser.add_argument(
+        'taxonomy',
+        help="""Table defining the taxonomy for each tax_id""")
+    parser.add_argument(
+        'out', metavar='FILE',
+        help="""reference bundle""")
+    parser.add_argument(
+        '--copy-numbers', metavar='CSV',
+        help="""Estimated 16s rRNA gene copy number for each tax_ids
+        (CSV file with columns: tax_id, median)""")
+    parser.add_argument(
+        '--rank-thresholds', metavar='CSV',
+        help="""Columns [tax_id,ranks...]""")
+    parser.add_argument(
+        '--force', action='store_true',
+        help="""rebuild the bundle even if it is up to date""")
+
+
+def action(args):
+    refs = references.build(
+        args.out,
+        args.seq_info,
+        args.taxonomy,
+        rank_thresholds=args.rank_thresholds,
+        copy_numbers=args.copy_numbers,
+        force=args.force)
+
+    log.info('{} reference sequences, {} tax_ids, {} ranks'.format(
+        len(refs.seqnames), len(refs.taxonomy), len(refs.taxonomy.ranks)))
@@ -0,0 +1,334 @@
+# This file is part of Bioy
+#
+#    Bioy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Bioy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Bioy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Serve bioy classifier requests against reference data loaded once
+
+The reference data (seq_info, taxonomy, rank thresholds and copy
+numbers, or an --index bundle) are loaded when the service starts and
+shared by a pool of --threads worker processes.  Requests are made over
+HTTP on a unix domain socket (--socket) or on a local port (--port).
+
+Requests
+++++++++
+
+``POST /classify`` with blast results in the body (as the blast_file of
+``bioy classifier``) returns a json object with the classification
+output csv as **out**, the details csv as **details** (null unless
+requested) and the elapsed **seconds**.  Options of ``bioy classifier``
+are given as query parameters named by their destination, for example
+``specimen``, ``min_identity``, ``max_group_size``, ``has_header`` or
+``include_ref_rank`` (repeated), and ``details=1`` requests details::
+
+    curl --unix-socket classifier.sock --data-binary @blast.csv \\
+        'http://localhost/classify?specimen=039_3&details=1'
+
+Specimen maps and weights are not accepted; every query sequence is a
+specimen unless ``specimen`` is given.  ``GET /`` returns the status of
+the service and the digests of the reference inputs.  Requests with
+invalid options or blast results return status 400 and requests failing
+otherwise (for example if the worker pool is no longer running) status
+500, each with a json object giving the **error**.
+"""
+
+import argparse
+import BaseHTTPServer
+import copy
+import json
+import logging
+import os
+import socket
+import SocketServer
+import stat
+import sys
+import time
+import traceback
+import urlparse
+
+from cStringIO import StringIO
+from multiprocessing import Pool
+
+from bioy_pkg import utils
+from bioy_pkg.subcommands import classifier
+
+log = logging.getLogger(__name__)
+
+# classifier options a request may set (by destination)
+REQUEST_OPTIONS = classifier.CLASSIFY_OPTIONS + ['specimen', 'has_header',
+                                                 'limit']
+
+TRUE = ['1', 'true', 'yes']
+
+
+class RequestError(Exception):
+
+    """Invalid blast results or options of a request"""
+
+
+class RequestParser(argparse.ArgumentParser):
+
+    """Classifier argument parser raising ValueError on errors"""
+
+    def error(self, message):
+        raise ValueError(message)
+
+
+def request_parser():
+    parser = RequestParser(add_help=False)
+    classifier.build_parser(parser)
+    return parser
+
+
+def request_options(parser, query):
+    """Return a dict of classifier arguments from the query string of a
+    request (REQUEST_OPTIONS and details).
+    """
+
+    actions = {a.dest: a for a in parser._actions}
+
+    argv, details = [], False
+    for key, value in urlparse.parse_qsl(query, keep_blank_values=True):
+        if key == 'details':
+            details = value.lower() in TRUE
+        elif key not in REQUEST_OPTIONS:
+            raise ValueError('unknown option {}'.format(key))
+        elif actions[key].nargs == 0:
+            if value.lower() in TRUE:
+                argv.append(actions[key].option_strings[-1])
+        else:
+            argv.extend([actions[key].option_strings[-1], value])
+
+    args = parser.parse_args(argv + ['-'])
+    options = {k: getattr(args, k) for k in REQUEST_OPTIONS}
+    options['details_out'] = details
+    return options
+
+
+# arguments and reference data shared with worker processes
+_context = None
+
+
+def _init_worker(context):
+    global _context
+    _context = context
+
+
+def _classify(blast, options):
+    """Return the (output, details) csv text of classifying `blast'"""
+
+    args, refs = _context
+    args = copy.copy(args)
+    vars(args).update(options)
+    args.blast_file = StringIO(blast)
+
+    # the classifier exits on invalid input, and a worker exiting would
+    # leave the request waiting forever
+    try:
+        blast_results = classifier.read_blast_results(args, nrows=args.limit)
+    except (Exception, SystemExit) as e:
+        raise RequestError('{}: {}'.format(type(e).__name__, e))
+    if blast_results.empty:
+        return '', ('' if args.details_out else None)
+
+    try:
+        output, details = classifier.classify(blast_results, args, refs)
+    except SystemExit as e:
+        raise RequestError('{}: {}'.format(type(e).__name__, e))
+    except Exception:
+        # the traceback of the worker is not returned with the exception
+        log.error('classifying failed in a worker:\n{}'.format(
+            traceback.format_exc()))
+        raise
+
+    output = output.to_csv(None, index=True, float_format='%.2f')
+    if details is not None:
+        details = details.to_csv(None, index=False, float_format='%.2f')
+    return output, details
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def address_string(self):
+        # unix domain socket clients have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        log.info('%s %s', self.address_string(), format % args)
+
+    def respond(self, status, result):
+        body = json.dumps(result)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse.urlparse(self.path).path != '/':
+            return self.respond(404, dict(error='not found'))
+
+        server = self.server
+        self.respond(200, dict(status='ok',
+                               threads=server.threads,
+                               references=server.refs.hashes))
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        if url.path != '/classify':
+            return self.respond(404, dict(error='not found'))
+
+        start = time.time()
+        length = self.headers.get('Content-Length', '0')
+        if not length.isdigit():
+            self.close_connection = 1
+            return self.respond(400, dict(
+                error='invalid Content-Length {}'.format(length)))
+
+        blast = self.rfile.read(int(length))
+        try:
+            options = request_options(self.server.parser, url.query)
+        except ValueError as e:
+            return self.respond(400, dict(error=str(e)))
+
+        try:
+            output, details = self.server.pool.apply(
+                _classify, (blast, options))
+        except RequestError as e:
+            return self.respond(400, dict(error=str(e)))
+        except Exception as e:
+            # eg the worker pool is no longer running
+            log.exception('classifying failed')
+            return self.respond(500, dict(
+                error='{}: {}'.format(type(e).__name__, e)))
+
+        self.respond(200, dict(out=output,
+                               details=details,
+                               seconds=time.time() - start))
+
+
+class ClassifierServer(SocketServer.ThreadingMixIn,
+                       BaseHTTPServer.HTTPServer):
+
+    """HTTP server handling each request in a thread and classifying in
+    a pool of worker processes holding the reference data
+
+    Keyword Arguments:
+        - address -- a path (unix domain socket) or (host, port)
+        - args -- arguments of the classifier (references and --codes)
+        - threads -- number of worker processes
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, args, threads=1):
+        if isinstance(address, basestring):
+            self.address_family = socket.AF_UNIX
+            # replace only a stale socket left by an earlier server
+            if os.path.exists(address):
+                if not stat.S_ISSOCK(os.stat(address).st_mode):
+                    sys.exit('{} exists and is not a socket'.format(address))
+                os.remove(address)
+
+        timings = utils.Timings()
+        self.refs = classifier.Classifier(args, timings).load()
+        log.info('loaded references in {:.1f} seconds'.format(
+            timings.stages['loading references']['seconds']))
+
+        self.parser = request_parser()
+        self.threads = threads
+        # workers inherit the reference data when forked
+        self.pool = Pool(processes=threads,
+                         initializer=_init_worker,
+                         initargs=((args, self.refs),))
+
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+
+    def server_bind(self):
+        if self.address_family == socket.AF_UNIX:
+            # HTTPServer.server_bind expects a (host, port) address
+            SocketServer.TCPServer.server_bind(self)
+            self.server_name, self.server_port = 'localhost', 0
+        else:
+            BaseHTTPServer.HTTPServer.server_bind(self)
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        if self.address_family == socket.AF_UNIX:
+            os.remove(self.server_address)
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+def build_parser(parser):
+    parser.add_argument(
+        'seq_info', nargs='?',
+        help='File mapping reference seq name to tax_id')
+    parser.add_argument(
+        'taxonomy', nargs='?',
+        help="""Table defining the taxonomy for each tax_id""")
+    parser.add_argument(
+        '--copy-numbers', metavar='CSV',
+        help="""Estimated 16s rRNA gene copy number for each tax_ids
+        (CSV file with columns: tax_id, median)""")
+    parser.add_argument(
+        '--rank-thresholds', metavar='CSV',
+        help="""Columns [tax_id,ranks...]""")
+    parser.add_argument(
+        '--index', metavar='FILE',
+        help="""Reference bundle compiled from seq_info, taxonomy, rank
+        thresholds and copy numbers (see classifier_index)""")
+    parser.add_argument(
+        '--codes', action='store_true',
+        help="""work on integer codes in place of sequence names,
+        specimens and tax_ids (see classifier)""")
+
+    listen = parser.add_mutually_exclusive_group()
+    listen.add_argument(
+        '--socket', metavar='PATH',
+        help="""unix domain socket to listen on""")
+    listen.add_argument(
+        '--port', type=int, default=8000,
+        help="""port to listen on at --host if there is no
+        --socket [%(default)s]""")
+    parser.add_argument(
+        '--host', default='127.0.0.1',
+        help="""address to listen on with --port [%(default)s]""")
+
+
+def classifier_args(args):
+    """Return classifier arguments with the defaults of bioy classifier
+    and the reference inputs of `args'
+    """
+
+    defaults = request_parser().parse_args(['-'])
+    for name in ['seq_info', 'taxonomy', 'copy_numbers', 'rank_thresholds',
+                 'index', 'codes']:
+        setattr(defaults, name, getattr(args, name))
+    defaults.blast_file = None
+    return defaults
+
+
+def action(args):
+    address = args.socket or (args.host, args.port)
+    server = ClassifierServer(address, classifier_args(args), args.threads)
+
+    log.info('listening on {} with {} workers'.format(
+        args.socket or '{}:{}'.format(*server.server_address), args.threads))
+    utils.exit_on_sigint(status=0, message='Stopped.')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
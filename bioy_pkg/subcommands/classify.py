@@ -458,3 +458,4 @@ def action(args):
                         target_rank = args.target_rank,
                         **h))
 
+    log.info('format_taxonomy cache: {}'.format(sequtils.format_taxonomy.cache))
@@ -22,7 +22,8 @@ import sys
 import json
 
 from os.path import basename, splitext
-from bioy_pkg.sequtils import consensus, fastalite
+from bioy_pkg.seqbatch import SeqBatch
+from bioy_pkg.sequtils import consensus
 from bioy_pkg.utils import Opener
 
 log = logging.getLogger(__name__)
@@ -59,7 +60,7 @@ def action(args):
         seqname = 'consensus' if args.infile is sys.stdin \
                   else splitext(basename(args.infile.name))[0]
 
-    seqs = list(fastalite(args.infile, 'fasta'))
+    seqs = SeqBatch.from_fasta(args.infile)
 
     if args.rlefile:
         rledict = json.load(args.rlefile)
@@ -17,16 +17,16 @@
 Fast deduplicate sequences by coalescing identical substrings
 """
 
-import hashlib
 import logging
 import sys
 import csv
 
 from collections import Counter
-from itertools import groupby
-from operator import itemgetter
+from itertools import izip
 
-from bioy_pkg.sequtils import fastalite
+from bioy_pkg import seqreader
+from bioy_pkg.seqbatch import SeqBatch
+from bioy_pkg.sequtils import pack_seqs
 from bioy_pkg.utils import Opener
 
 log = logging.getLogger(__name__)
@@ -62,8 +62,14 @@ def build_parser(parser):
                         default = sys.stdout,
                         help = 'deduplicated sequences in fasta format')
 
+def packed(seqs):
+    """
+    Return (seq, packed) pairs of a list of seqs, PackedSeqs are
+    smaller and faster to manage than the sequences
+    """
+    return zip(seqs, pack_seqs(s.seq for s in seqs))
+
 def action(args):
-    seqs = fastalite(args.sequences)
 
     # sort seqs by group information
     if args.split_info:
@@ -72,21 +78,19 @@ def action(args):
         info = {r['seqname']: r for r in info_reader}
 
         # group tag sequences if info_file exists
-        def group_tag(seq):
-            i = info[seq.id]
-            group = i[primary] or i[secondary] if secondary else i[primary]
-            return dict(group = group, seq = seq)
-
-        seqs = (group_tag(s) for s in seqs)
+        def group_tag(seq_id):
+            i = info[seq_id]
+            return i[primary] or i[secondary] if secondary else i[primary]
 
-        # group the sequences by tags
-        seqs = sorted(seqs, key = itemgetter('group'))
-        seqs = groupby(seqs, key = itemgetter('group'))
+        batch = SeqBatch.from_records(seqreader.read_records(
+            args.sequences, threads=args.threads))
 
-        # just need the seqs
-        seqs = ((pair['seq'] for pair in group) for _,group in seqs)
+        # group the sequences by tags, packing each group at a time
+        groups = batch.groupby([group_tag(i) for i in batch.id_list()])
+        seqs = (izip(group, pack_seqs(group.seq_list())) for _, group in groups)
     else:
-        seqs = (seqs,)
+        seqs = (seqreader.read_records(
+            args.sequences, threads=args.threads, func=packed),)
 
     # set up output files
     if args.out_info and args.split_info:
@@ -104,15 +108,11 @@ def action(args):
         weights = Counter()
         deduped = {}
 
-        for orig in group:
-            # checksums are faster to manage
-            clean = orig.seq.replace('\n', '').upper()
-            checksum = hashlib.sha1(clean).hexdigest()
-
-            if checksum in deduped:
-                kept = deduped[checksum]
+        for orig, packed_seq in group:
+            if packed_seq in deduped:
+                kept = deduped[packed_seq]
             else:
-                kept = deduped[checksum] = orig
+                kept = deduped[packed_seq] = orig
                 args.out.write('>{}\n{}\n'.format(kept.description, kept.seq))
 
                 if args.out_info and args.split_info:
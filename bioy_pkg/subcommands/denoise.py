@@ -28,11 +28,12 @@ import csv
 import os
 
 from operator import itemgetter
-from itertools import groupby, islice, chain
+from itertools import islice, chain
 from random import shuffle
 from collections import defaultdict, Counter
 from multiprocessing import Pool
 
+from bioy_pkg.seqbatch import SeqBatch
 from bioy_pkg.sequtils import consensus, run_muscle, parse_uc, fastalite, from_ascii, homodecode
 from bioy_pkg.utils import chunker, Opener, Csv2Dict
 
@@ -127,7 +128,7 @@ def align_and_consensus(chunk):
         # no need to align...
         seq = cluster[0]
         rle = rlelist[0] if rlelist else None
-        cons = homodecode(seq, rle) if rle else seq.seq
+        cons = homodecode(seq.seq, rle) if rle else seq.seq
     else:
         log.debug('aligning cluster {} len {}'.format(i, len(cluster)))
         cons = consensus(run_muscle(cluster), rlelist)
@@ -145,14 +146,13 @@ def action(args):
         else:
             clusters = {seq: tag for seq,tag in csv.reader(args.clusters)}
 
-        by_clusters = lambda s: clusters.get(s.id, s.id)
+        by_clusters = lambda i: clusters.get(i, i)
     else:
         by_clusters = lambda _: 'all one cluster'
 
     seqs = fastalite(args.fastafile)
-    seqs = islice(seqs, args.limit)
-    seqs = sorted(seqs, key = by_clusters)
-    grouped_seqs = groupby(seqs, key = by_clusters)
+    seqs = SeqBatch.from_records(islice(seqs, args.limit))
+    grouped_seqs = seqs.groupby([by_clusters(i) for i in seqs.id_list()])
 
     chunks = ichunker((group for _, group in grouped_seqs),
                       args.rlefile, args.min_clust_size, args.max_clust_size)
@@ -20,16 +20,21 @@ Tally and classify errors given ./ion rlaligns reference and query sequences
 import logging
 import sys
 
+import numpy
+
 from collections import Counter, defaultdict
 from csv import DictWriter, writer, DictReader
-from itertools import imap
+from itertools import islice, izip
 
 from bioy_pkg import sequtils
-from bioy_pkg.sequtils import itemize_errors, error_count, show_errors
+from bioy_pkg.sequtils import itemize_errors_many, show_errors, ERRORS
 from bioy_pkg.utils import Opener, parse_extras
 
 log = logging.getLogger(__name__)
 
+# alignments itemized at a time
+CHUNKSIZE = 1000
+
 def build_parser(parser):
     parser.add_argument('aligns',
             nargs = '?',
@@ -69,10 +74,6 @@ def action(args):
 
     aligns = DictReader(args.aligns)
 
-    itemizer = lambda a: dict({'errors':itemize_errors(a['t_seq'], a['q_seq'])}, **a)
-
-    aligns = imap(itemizer, aligns)
-
     tallies = DictWriter(args.out,
             fieldnames = fieldnames,
             extrasaction = 'ignore')
@@ -80,37 +81,62 @@ def action(args):
 
     homopolymers = defaultdict(Counter)
     gtceil = 'geq{}'.format(args.homopolymer_max)
-
-    # output error counts:
-    for a in aligns:
-        # instantiate d with zero counts for each error type
-        row = {k:0 for k in fieldnames[2:]}
-        row['q_name'], row['t_name'] = a['q_name'], a['t_name']
-        row.update(a)
-        row.update(error_count(a['errors']))
-
-        # create total count to output
-        total = row['snp'] + row['indel'] + row['homoindel'] + row['compound']
-        row.update({'total':total})
-
-        row.update(args.extra_fields)
-
-        if args.output_alignment:
-            row.update({'alignment':show_errors(a['errors'])})
-
-        tallies.writerow(row)
-
-        log.debug(a['q_name'])
-        log.debug('\n' + sequtils.format_alignment(a['t_seq'], a['q_seq']))
-        log.debug(a['q_seq'].replace('-','').replace('=',''))
-        log.debug(show_errors(a['errors']))
-
-        if args.step:
-            raw_input()
+    debug = log.isEnabledFor(logging.DEBUG)
+
+    # itemize the errors of a chunk of alignments at a time; one at a
+    # time with --step so each pause follows the alignment it shows
+    chunksize = 1 if args.step else CHUNKSIZE
+    for chunk in iter(lambda: list(islice(aligns, chunksize)), []):
+        items = itemize_errors_many([a['t_seq'] for a in chunk],
+                                    [a['q_seq'] for a in chunk])
+        alignment = items['alignment']
+
+        # error counts and aligned length of each alignment
+        counts = {e: numpy.bincount(alignment[items['category'] == e],
+                                    minlength = len(chunk))
+                  for e in ERRORS}
+        lengths = numpy.fromiter((len(r.strip('-=')) for r in items['ref']),
+                numpy.int64, len(alignment))
+        counts['length'] = numpy.bincount(alignment, weights = lengths,
+                minlength = len(chunk)).astype(numpy.int64)
+        bounds = numpy.searchsorted(alignment, numpy.arange(len(chunk) + 1))
+
+        # output error counts:
+        for j, a in enumerate(chunk):
+            # instantiate d with zero counts for each error type
+            row = {k:0 for k in fieldnames[2:]}
+            row['q_name'], row['t_name'] = a['q_name'], a['t_name']
+            row.update(a)
+            row.update({k:int(v[j]) for k, v in counts.items()})
+
+            # create total count to output
+            total = row['snp'] + row['indel'] + row['homoindel'] + row['compound']
+            row.update({'total':total})
+
+            row.update(args.extra_fields)
+
+            if args.output_alignment or debug:
+                errors = [{'i':i, 'ref':r, 'query':q} for i, r, q in izip(
+                        *[items[k][bounds[j]:bounds[j + 1]].tolist()
+                          for k in ['i', 'ref', 'query']])]
+
+            if args.output_alignment:
+                row.update({'alignment':show_errors(errors)})
+
+            tallies.writerow(row)
+
+            if debug:
+                log.debug(a['q_name'])
+                log.debug('\n' + sequtils.format_alignment(a['t_seq'], a['q_seq']))
+                log.debug(a['q_seq'].replace('-','').replace('=',''))
+                log.debug(show_errors(errors))
+
+            if args.step:
+                raw_input()
 
         # create homopolymer matrix
-        for e in a['errors']:
-            r, q = e['ref'].strip('=-'), e['query'].strip('=-')
+        for r, q in izip(items['ref'], items['query']):
+            r, q = r.strip('=-'), q.strip('=-')
             # count indels or homoindels; exclude compound errors and snps
             base = ''.join(set(r + q))
             if len(base) == 1:
@@ -22,12 +22,12 @@ http://computing.bio.cam.ac.uk/local/doc/fasta_guide.pdf
 import logging
 import sys
 
-from itertools import chain, groupby, imap
+from itertools import chain, groupby
 from operator import itemgetter
 from subprocess import Popen, PIPE, CalledProcessError
 from csv import DictWriter
 
-from bioy_pkg.sequtils import parse_ssearch36, homodecodealignment, from_ascii
+from bioy_pkg.sequtils import parse_ssearch36, decode_alignments
 from bioy_pkg.utils import Opener, Csv2Dict
 
 log = logging.getLogger(__name__)
@@ -107,12 +107,7 @@ def action(args):
     # decode if appropriate
     if args.decode:
         decoding = {k:v for d in args.decode for k,v in d.items()}
-        def decode(aligns):
-            aligns['t_seq'], aligns['q_seq'] = homodecodealignment(
-                    aligns['t_seq'], from_ascii(decoding[aligns['t_name']]),
-                    aligns['q_seq'], from_ascii(decoding[aligns['q_name']]))
-            return aligns
-        aligns = imap(decode, aligns)
+        aligns = decode_alignments(aligns, decoding)
 
     # write results
     if args.fieldnames:
@@ -21,9 +21,8 @@ import logging
 import sys
 from csv import DictWriter
 from itertools import islice
-import sys
 
-from Bio import SeqIO
+from bioy_pkg import seqreader
 from bioy_pkg.utils import Opener, parse_extras
 
 log = logging.getLogger(__name__)
@@ -53,10 +52,25 @@ def build_parser(parser):
 
 BASES = set(['A', 'C', 'G', 'T'])
 
+def read_stats(seqs):
+    """
+    Return [name, length, mean, ambig] of each of a list of FastqLite
+    records with sanger (phred+33) quality scores
+    """
+
+    from numpy import frombuffer, uint8
+
+    rows = []
+    for s in seqs:
+        qual = frombuffer(s.qual, dtype=uint8) - 33
+        ambig = len([1 for b in s.seq if b not in BASES])
+        rows.append([s.id.replace(':', '_'), len(s.seq), qual.mean(), ambig])
+    return rows
+
 def action(args):
 
     try:
-        from numpy import mean
+        import numpy
     except ImportError, e:
         print(e)
         sys.exit(1)
@@ -72,9 +86,8 @@ def action(args):
     if args.show_header:
         stats.writeheader()
 
-    for s in islice(SeqIO.parse(args.fastq, 'fastq'), args.limit):
-        qual = s.letter_annotations["phred_quality"]
-        ambig = len([1 for b in s.seq if b not in BASES])
-        row = [s.name.replace(':', '_'), len(s), mean(qual), ambig]
+    rows = seqreader.read_records(
+        args.fastq, fmt='fastq', threads=args.threads, func=read_stats)
+    for row in islice(rows, args.limit):
         row += extras.values()
         stats.writerow(dict(zip(fieldnames, row)))
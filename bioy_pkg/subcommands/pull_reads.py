@@ -20,17 +20,15 @@ Parse barcode, primer, and read from a fastq file
 import logging
 import sys
 
-from itertools import ifilter
-
-from bioy_pkg.sequtils import fastalite
-from bioy_pkg.utils import opener, Opener, Csv2Dict
+from bioy_pkg import seqstore
+from bioy_pkg.utils import Opener, Csv2Dict
 
 log = logging.getLogger(__name__)
 
 def build_parser(parser):
     parser.add_argument('fasta',
-            type = lambda f: fastalite(opener(f)),
-            help = 'input file containing raw reads')
+            help = """input file containing raw reads; an uncompressed
+            file is indexed (as fasta.idx) to look up reads by name""")
     parser.add_argument('--sample-id',
             help = 'sample id to pull reads for')
     parser.add_argument('--map-file',
@@ -42,7 +40,7 @@ def build_parser(parser):
             help = 'fasta output file')
 
 def action(args):
-    sample_filter = lambda s: args.map_file[s.description] == args.sample_id
-    seqs = ifilter(sample_filter, args.fasta)
+    reads = [k for k, v in args.map_file.iteritems() if v == args.sample_id]
+    seqs = seqstore.select(args.fasta, reads)
     args.out.writelines('>{}\n{}\n'.format(s.description, s.seq) for s in seqs)
 
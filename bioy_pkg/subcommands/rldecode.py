@@ -19,10 +19,8 @@ import logging
 import sys
 import csv
 
-from multiprocessing import Pool
-
-from bioy_pkg.sequtils import homodecode, from_ascii, fastalite
-from bioy_pkg import utils
+from bioy_pkg.sequtils import homodecode_many, from_ascii_many
+from bioy_pkg import seqreader, utils
 from bioy_pkg.utils import Opener
 
 log = logging.getLogger(__name__)
@@ -30,7 +28,7 @@ log = logging.getLogger(__name__)
 
 def build_parser(parser):
     parser.add_argument('seqs',
-                        type=lambda f: fastalite(Opener()(f), readfile=False),
+                        type=Opener(),
                         help='Input fasta file')
     parser.add_argument('rle',
                         type=Opener(),
@@ -41,24 +39,19 @@ def build_parser(parser):
                         help='Name of output file')
 
 
-def seq_and_homodecode(seq_rle):
-    seq, rle = seq_rle
-
-    assert len(seq.seq) == len(rle)
-
-    return seq, homodecode(seq.seq, rle)
-
-
 def action(args):
     # Ignore SIGPIPE, for head support
     utils.exit_on_sigpipe()
     utils.exit_on_sigint()
 
     rledict = {seqname: rle for seqname, rle in csv.reader(args.rle)}
-    seqs = ((s, from_ascii(rledict[s.id])) for s in args.seqs)
 
-    pool = Pool(processes=args.threads)
-    seqs = pool.imap(seq_and_homodecode, seqs, chunksize=140)
+    for seqs in seqreader.read_batches(args.seqs, threads=args.threads):
+        rles = [rledict[s.id] for s in seqs]
+        for seq, rle in zip(seqs, rles):
+            assert len(seq.seq) == len(rle)
 
-    for seq, decoded in seqs:
-        args.outfile.write('>{}\n{}\n'.format(seq.description, decoded))
+        counts, offsets = from_ascii_many(rles)
+        decoded = homodecode_many([s.seq for s in seqs], counts, offsets)
+        args.outfile.writelines('>{}\n{}\n'.format(seq.description, d)
+                                for seq, d in zip(seqs, decoded))
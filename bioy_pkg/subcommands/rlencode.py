@@ -18,12 +18,11 @@
 import logging
 import sys
 
-from itertools import imap, chain
 from csv import DictWriter
-from multiprocessing import Pool
+from functools import partial
 
-from bioy_pkg.sequtils import homoencode, to_ascii, fastalite
-from bioy_pkg import utils
+from bioy_pkg.sequtils import homoencode_many, to_ascii_many
+from bioy_pkg import seqreader, utils
 from bioy_pkg.utils import Opener
 
 log = logging.getLogger(__name__)
@@ -46,8 +45,18 @@ def build_parser(parser):
                       append .csv.bz2 to --outfile basename.""")
 
 
-def seq_and_homoencode(seq):
-    return seq, homoencode(seq.seq)
+def seq_and_homoencode(seqs, encode_counts=True):
+    """
+    Return (seq, rle_seq, ascii encoded counts) of a list of seqs,
+    counts are None unless `encode_counts`
+    """
+
+    rle_seqs, counts, offsets = homoencode_many(s.seq for s in seqs)
+    if encode_counts:
+        counts = to_ascii_many(counts, offsets)
+    else:
+        counts = [None] * len(seqs)
+    return zip(seqs, rle_seqs, counts)
 
 
 def action(args):
@@ -55,16 +64,14 @@ def action(args):
     utils.exit_on_sigpipe()
     utils.exit_on_sigint()
 
-    pool = Pool(processes=args.threads)
-
-    seqs = imap(fastalite, args.infiles)
-    seqs = chain.from_iterable(seqs)
-    seqs = pool.imap(seq_and_homoencode, seqs, chunksize=40)
-
-    for seq, (seqstr, count) in seqs:
-        assert len(seqstr) == len(count)
+    for infile in args.infiles:
+        seqs = seqreader.read_records(
+            infile, threads=args.threads,
+            func=partial(seq_and_homoencode,
+                         encode_counts=bool(args.rlefile)))
 
-        args.outfile.write('>{}\n{}\n'.format(seq.description, seqstr))
+        for seq, seqstr, count in seqs:
+            args.outfile.write('>{}\n{}\n'.format(seq.description, seqstr))
 
-        if args.rlefile:
-            args.rlefile.writerow(dict(name=seq.id, rle=to_ascii(count)))
+            if args.rlefile:
+                args.rlefile.writerow(dict(name=seq.id, rle=count))
@@ -26,8 +26,7 @@ from difflib import SequenceMatcher
 import argparse
 import bz2
 
-from Bio import SeqIO
-
+from bioy_pkg import seqreader
 from bioy_pkg.sequtils import homoencode, to_ascii
 
 log = logging.getLogger(__name__)
@@ -46,7 +45,7 @@ def get_barcodes(fname):
 
 def find_barcode(seq, bc_rexp, bc_seqs, exact = False, bc_len = 10, search_window = 12):
     """
-    Given a SeqRecord, regular expression matching all barcodes, and
+    Given a SeqRecord (or FastqLite), regular expression matching all barcodes, and
     corresponding barcode sequences, return ("barcode","ratio","bc_start","bc_stop")
     """
 
@@ -129,14 +128,14 @@ def action(args):
     bc_dict = dict(barcodes)
     bc_rexp = re.compile('|'.join(bc_seqs))
 
-    opener = bz2.BZ2File if args.fastq.endswith('.bz2') else open
     count = Counter()
-    with opener(args.fastq) as f, bz2.BZ2File(args.mapfile, 'w') as mapout:
+    with bz2.BZ2File(args.mapfile, 'w') as mapout:
         writer = csv.writer(mapout)
         writer.writerow(['name','label','barcode','ratio','bc_start','bc_stop','rle'])
 
-        for seq in SeqIO.parse(f, 'fastq'):
-            if not args.min_length <= len(seq) <= args.max_length:
+        seqs = seqreader.read_records(args.fastq, fmt='fastq', threads=args.threads)
+        for seq in seqs:
+            if not args.min_length <= len(seq.seq) <= args.max_length:
                 count['fail_len'] += 1
                 continue
 
@@ -19,11 +19,11 @@ Parse reads from a fasta file by read to specimen csv map file
 
 import logging
 
+from collections import defaultdict
 from csv import DictReader
-from itertools import groupby
 from os import path
 
-from bioy_pkg.sequtils import fastalite
+from bioy_pkg import seqstore
 from bioy_pkg.utils import Opener, opener
 
 log = logging.getLogger(__name__)
@@ -31,8 +31,8 @@ log = logging.getLogger(__name__)
 def build_parser(parser):
     parser.add_argument('fasta',
             metavar = 'FILE',
-            type = Opener(),
-            help = 'input fasta')
+            help = """input fasta; an uncompressed file is indexed
+            (as FILE.idx) to look up reads by name""")
     parser.add_argument('specimen_map',
             metavar = 'CSV',
             type = Opener(),
@@ -43,18 +43,26 @@ def build_parser(parser):
             default = '.')
 
 def action(args):
-    fasta = fastalite(args.fasta)
+    seqs = seqstore.load(args.fasta)
+    if seqs.duplicates:
+        log.warning('{} reads dropped for a repeated read name, '
+                    'keeping the last of each'.format(seqs.duplicates))
 
     spec_map = DictReader(args.specimen_map, fieldnames = ['readname', 'specimen'])
-    spec_map = {s['readname']:s['specimen'] for s in spec_map}
+    groups = defaultdict(list)
+    for s in spec_map:
+        groups[s['specimen']].append(s['readname'])
 
-    def by_specimen(f):
-        return spec_map[f.id]
+    missing, written = 0, set()
+    for spec, reads in sorted(groups.items()):
+        rows = seqs.rows(reads)
+        missing += (rows == -1).sum()
+        written.update(rows[rows != -1])
 
-    groups = sorted(fasta, key = by_specimen)
-    groups = groupby(groups, key = by_specimen)
+        fasta = list(seqs.select(reads))
+        if not fasta:
+            continue
 
-    for spec, fasta in groups:
         fasta = ('>{}\n{}'.format(f.description, f.seq) for f in fasta)
         fasta = '\n'.join(fasta)
 
@@ -63,3 +71,10 @@ def action(args):
         with opener(filename, 'w') as out:
             out.write(fasta)
 
+    if missing:
+        log.warning('{} reads in the specimen map are not in {}'.format(
+            missing, args.fasta))
+    unmapped = len(seqs) - len(written)
+    if unmapped:
+        log.warning('{} reads not in the specimen map dropped'.format(
+            unmapped))
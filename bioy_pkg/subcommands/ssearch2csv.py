@@ -25,7 +25,7 @@ import csv
 from itertools import islice, chain, groupby, imap
 from operator import itemgetter
 
-from bioy_pkg.sequtils import homodecodealignment, parse_ssearch36, from_ascii, CAPUI
+from bioy_pkg.sequtils import decode_alignments, parse_ssearch36, CAPUI
 from bioy_pkg.utils import Opener, Csv2Dict, parse_extras
 
 log = logging.getLogger(__name__)
@@ -115,12 +115,7 @@ def action(args):
 
     if args.rlefile:
         decoding = {k:v for d in args.rlefile for k,v in d.items()}
-        def decode(aligns):
-            aligns['t_seq'], aligns['q_seq'] = homodecodealignment(
-                    aligns['t_seq'], from_ascii(decoding[aligns['t_name']]),
-                    aligns['q_seq'], from_ascii(decoding[aligns['q_name']]))
-            return aligns
-        aligns = imap(decode, aligns)
+        aligns = decode_alignments(aligns, decoding)
 
     if args.print_one:
         pprint.pprint(aligns.next())
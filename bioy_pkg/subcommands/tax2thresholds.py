@@ -25,6 +25,7 @@ from os import path
 
 import pandas as pd
 
+from bioy_pkg.taxtable import Taxonomy
 from bioy_pkg.utils import Opener
 
 log = logging.getLogger(__name__)
@@ -63,13 +64,12 @@ def action(args):
     # pd.set_option('display.max_columns', None)
     # pd.set_option('display.max_rows', None)
 
-    # load default_tresholds
-    taxonomy = read_csv(
+    # load taxonomy
+    taxonomy = Taxonomy.from_csv(
         args.taxonomy,
         comment='#',
-        dtype=str,
         na_filter=True,  # False is faster
-        ).set_index('tax_id')
+        )
 
     # load default_tresholds
     default_thresholds = read_csv(
@@ -80,8 +80,7 @@ def action(args):
         usecols=['tax_id', 'low', 'target_rank']
         )
 
-    tax_cols = taxonomy.columns.tolist()
-    tax_cols = tax_cols[tax_cols.index('root'):]
+    tax_cols = taxonomy.ranks
 
     # out output data structure
     full_tree = pd.DataFrame(index=taxonomy.index)
@@ -90,27 +89,14 @@ def action(args):
     for index, rank in enumerate(tax_cols):
         defaults = default_thresholds[
             default_thresholds['target_rank'] == rank]
-        defaults = defaults.set_index('tax_id')
-
-        # iterate taxonomy most to least specificity and join with defaults
-        target_thresholds = []
-        for specificity in reversed(tax_cols):
-            thresholds = taxonomy[[specificity]].join(
-                defaults[['low']], on=specificity, how='inner')
-            # append just the low column
-            target_thresholds.append(thresholds['low'])
-
-        # concat and take just the first(), most specific threshold
-        target_thresholds = pd.concat(target_thresholds)
-        target_thresholds = target_thresholds.groupby(
-            target_thresholds.index, sort=False).first()
+        defaults = defaults.set_index('tax_id')['low']
+        defaults = defaults[~defaults.index.duplicated()]
 
-        full_tree[rank] = target_thresholds
+        # take the most specific threshold in each lineage
+        full_tree[rank] = taxonomy.inherit(defaults)
 
         # fill in tax holes
         index = max(index-1, 0)
-        blanks = full_tree[full_tree[rank].isnull()]
-        full_tree[rank] = full_tree[rank].fillna(
-            blanks[tax_cols[index]])
+        full_tree[rank] = full_tree[rank].fillna(full_tree[tax_cols[index]])
 
     full_tree.to_csv(args.out)
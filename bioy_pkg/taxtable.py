@@ -0,0 +1,405 @@
+# This file is part of Bioy
+#
+#    Bioy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Bioy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Bioy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Integer coded taxonomy built from a taxtable
+
+A taxtable is a csv with columns **tax_id**, **parent_id**, **rank** and
+**tax_name** followed by rank columns ordered from least specific
+(**root**) to most specific, each giving the tax_id of the ancestor of a
+row at that rank.
+"""
+
+import logging
+
+from collections import OrderedDict
+
+import numpy
+import pandas
+
+from bioy_pkg import utils
+
+log = logging.getLogger(__name__)
+
+
+def _nearest_ancestors(lineages, depths, codes):
+    """Return an array of the nearest ancestor in the lineage above each
+    node of `codes' (at rank column `depths' of rows of `lineages'), the
+    node itself where there is none.
+    """
+
+    above = numpy.where(
+        numpy.arange(lineages.shape[1]) < depths[:, numpy.newaxis],
+        lineages, -1)
+    has_parent = (above != -1).any(axis=1)
+    last = above.shape[1] - 1 - (above[:, ::-1] != -1).argmax(axis=1)
+    return numpy.where(
+        has_parent, above[numpy.arange(len(codes)), last], codes)
+
+
+def _objects(values):
+    """Return `values' (eg a fixed width string array memory mapped from
+    a reference bundle) as an object array of strings.
+    """
+
+    return numpy.asarray(values).astype(object)
+
+
+class Taxonomy(object):
+
+    """Taxonomy with tax_ids mapped to dense integer codes
+
+    A code is the position of a tax_id in `tax_ids'.  Nodes are
+    described by arrays indexed by code:
+
+        - parents -- code of the parent of each node (root is its own parent)
+        - lineages -- (nodes x ranks) matrix giving the code of the
+          ancestor of each node at each rank, -1 if there is none
+        - depths -- index of the rank column holding the node itself
+
+    `tax_ids', `names' and `node_ranks' may be fixed width string arrays
+    (see from_arrays) converted to objects only for the nodes used.
+
+    Indexing by tax_id returns a read only row such that
+    ``taxonomy[tax_id][column]`` matches a row from csv.DictReader of the
+    taxtable (missing rank ids are returned as ''), so a Taxonomy can be
+    used wherever a tax_dict is expected, eg sequtils.condense_ids and
+    sequtils.compound_assignment.
+
+    Keyword Arguments:
+        - taxonomy -- DataFrame of a taxtable indexed by tax_id
+    """
+
+    def __init__(self, taxonomy):
+        columns = taxonomy.columns.tolist()
+        ranks = columns[columns.index('root'):]
+        index = pandas.Index(taxonomy.index.astype(str), name='tax_id')
+        names = taxonomy['tax_name'].fillna('').values
+        node_ranks = taxonomy['rank'].fillna('').values
+
+        lineages = numpy.column_stack(
+            [index.get_indexer(taxonomy[r].values) for r in ranks])
+
+        # ancestors without a row of their own are added as extra nodes
+        # (without a name) so their tax_ids are kept
+        ids = taxonomy[ranks].values
+        dangling = (lineages == -1) & pandas.notnull(ids)
+        if dangling.any():
+            # first occurrence of each from the least specific rank
+            cols, rows = numpy.nonzero(dangling.T)
+            _, first = numpy.unique(
+                ids[rows, cols].astype(str), return_index=True)
+            first = numpy.sort(first)
+            rows, cols = rows[first], cols[first]
+            extra = ids[rows, cols].astype(str)
+            log.warning('{} ancestor tax_ids have no row in the taxonomy, '
+                        'eg {}'.format(len(extra), ', '.join(extra[:5])))
+
+            index = index.append(pandas.Index(extra, name='tax_id'))
+            names = numpy.append(names, [''] * len(extra)).astype(object)
+            node_ranks = numpy.append(
+                node_ranks, [ranks[c] for c in cols]).astype(object)
+
+            # the lineage of an extra node is the lineage of the first
+            # row naming it, up to the extra node's rank
+            lineages = numpy.column_stack(
+                [index.get_indexer(taxonomy[r].values) for r in ranks])
+            above = numpy.arange(len(ranks)) <= cols[:, numpy.newaxis]
+            lineages = numpy.vstack(
+                [lineages, numpy.where(above, lineages[rows], -1)])
+
+        if 'parent_id' in taxonomy:
+            parents = index.get_indexer(taxonomy['parent_id'].values)
+            if dangling.any():
+                extra_codes = numpy.arange(len(parents), len(index))
+                parents = numpy.append(parents, _nearest_ancestors(
+                    lineages[extra_codes], cols, extra_codes))
+        else:
+            parents = None
+
+        self._setup(ranks,
+                    index.values,
+                    names,
+                    node_ranks,
+                    lineages,
+                    parents,
+                    index=index)
+
+    def _setup(self, ranks, tax_ids, names, node_ranks, lineages, parents,
+               index=None, order=None):
+        self.ranks = list(ranks)
+        self.rank_index = {r: i for i, r in enumerate(self.ranks)}
+
+        self._index = index
+        self.order = order
+        self.tax_ids = tax_ids
+        self.names = names
+        self.node_ranks = node_ranks
+        self.lineages = lineages.astype(numpy.int32, copy=False)
+
+        nodes = numpy.arange(len(self))
+        itself = self.lineages == nodes[:, numpy.newaxis]
+        self.depths = numpy.where(itself.any(axis=1), itself.argmax(axis=1), -1)
+
+        if parents is None:
+            parents = _nearest_ancestors(self.lineages, self.depths, nodes)
+
+        self.parents = parents
+
+    @classmethod
+    def from_arrays(cls, ranks, tax_ids, names, node_ranks, lineages,
+                    parents=None, order=None):
+        """Create a Taxonomy from arrays indexed by code (see above),
+        for example arrays memory mapped from a reference bundle.  With
+        `order' (the codes of `tax_ids' in sorted order) tax_ids are
+        looked up by binary search rather than by building an index.
+        """
+
+        taxonomy = cls.__new__(cls)
+        taxonomy._setup(ranks,
+                        tax_ids,
+                        names,
+                        node_ranks,
+                        lineages,
+                        parents,
+                        order=order)
+        return taxonomy
+
+    @property
+    def index(self):
+        """pandas.Index of tax_ids by code (built on first use)"""
+
+        if self._index is None:
+            self._index = pandas.Index(_objects(self.tax_ids), name='tax_id')
+        return self._index
+
+    @classmethod
+    def from_csv(cls, taxonomy, **kwargs):
+        """Load a taxtable from a file name (compression defined by the
+        suffix) or an open file-like object.
+        """
+
+        kwargs.setdefault('dtype', str)
+        if isinstance(taxonomy, basestring):
+            taxonomy = utils.read_csv(taxonomy, **kwargs)
+        else:
+            taxonomy = pandas.read_csv(taxonomy, **kwargs)
+        return cls(taxonomy.set_index('tax_id'))
+
+    def to_frame(self, codes=False, rows=None):
+        """Return the taxtable as a DataFrame indexed by tax_id with columns
+        parent_id, rank, tax_name and the rank columns.  Missing values are
+        nan as when reading the taxtable with pandas.read_csv.
+
+        With `codes' the index, parent_id and rank columns hold codes (as
+        floats so missing values are nan) rather than tax_ids.  With
+        `rows' only the nodes with those codes are included.
+        """
+
+        if rows is None:
+            rows = numpy.arange(len(self))
+        rows = numpy.asarray(rows, dtype=int)
+
+        if codes:
+            def ids(c):
+                return c.astype(float)
+            index = pandas.Float64Index(ids(rows), name='tax_id')
+        else:
+            def ids(c):
+                return _objects(self.tax_ids[c])
+            index = pandas.Index(ids(rows), name='tax_id')
+
+        parents = self.parents[rows]
+        frame = pandas.DataFrame(
+            OrderedDict([('parent_id', numpy.where(parents != -1,
+                                                   ids(parents),
+                                                   numpy.nan)),
+                         ('rank', _objects(self.node_ranks[rows])),
+                         ('tax_name', _objects(self.names[rows]))]),
+            index=index)
+        frame = frame.replace('', numpy.nan)
+
+        lineages = self.lineages[rows]
+        lineages = numpy.where(lineages != -1, ids(lineages), numpy.nan)
+        for i, r in enumerate(self.ranks):
+            frame[r] = lineages[:, i]
+
+        return frame
+
+    def __len__(self):
+        return len(self.tax_ids)
+
+    def __contains__(self, tax_id):
+        return self.codes([tax_id])[0] != -1
+
+    def __getitem__(self, tax_id):
+        return TaxonomyRow(self, self.code(tax_id))
+
+    def code(self, tax_id):
+        """Return the code of a single tax_id, raising KeyError if it is not
+        in the taxonomy.
+        """
+
+        if self.order is None:
+            return self.index.get_loc(tax_id)
+
+        code = self.codes([tax_id])[0]
+        if code == -1:
+            raise KeyError(tax_id)
+        return code
+
+    def codes(self, tax_ids):
+        """Return an array of codes for a sequence of tax_ids, -1 for
+        tax_ids not in the taxonomy (including null values).
+        """
+
+        tax_ids = numpy.asarray(tax_ids, dtype=object)
+        if self.order is None:
+            return self.index.get_indexer(tax_ids)
+
+        codes = numpy.full(len(tax_ids), -1, dtype=int)
+        if len(self) == 0:
+            return codes
+
+        # binary search of the tax_ids in sorted order; keys longer
+        # than the fixed width of tax_ids cannot match
+        keys = tax_ids.astype(str)
+        width = self.tax_ids.dtype.itemsize
+        valid = numpy.flatnonzero(
+            pandas.notnull(tax_ids) &
+            (numpy.vectorize(len, otypes=[int])(keys) <= width))
+        keys = keys[valid]
+        found = numpy.searchsorted(self.tax_ids, keys, sorter=self.order)
+        found = self.order[numpy.minimum(found, len(self) - 1)]
+        matched = self.tax_ids[found] == keys
+        codes[valid[matched]] = found[matched]
+        return codes
+
+    def value(self, code, column):
+        """Return the value of `column' for node `code' as a string"""
+
+        if column in self.rank_index:
+            ancestor = self.lineages[code, self.rank_index[column]]
+            return self.tax_ids[ancestor] if ancestor != -1 else ''
+        elif column == 'tax_id':
+            return self.tax_ids[code]
+        elif column == 'parent_id':
+            parent = self.parents[code]
+            return self.tax_ids[parent] if parent != -1 else ''
+        elif column == 'tax_name':
+            return self.names[code]
+        elif column == 'rank':
+            return self.node_ranks[code]
+        else:
+            raise KeyError(column)
+
+    def rank(self, tax_id):
+        """Return the rank of `tax_id'"""
+
+        return self.node_ranks[self.code(tax_id)]
+
+    def at_rank(self, tax_ids, rank):
+        """Return an array with the ancestor of each of `tax_ids' at `rank',
+        None where there is none.
+        """
+
+        codes = self.codes(tax_ids)
+        ancestors = self.lineages[codes, self.rank_index[rank]]
+        ancestors[codes == -1] = -1
+        return numpy.where(
+            ancestors != -1, _objects(self.tax_ids[ancestors]), None)
+
+    def lineage(self, tax_id):
+        """Return an OrderedDict of {rank: tax_id} from root to `tax_id'"""
+
+        lineage = self.lineages[self.code(tax_id)]
+        return OrderedDict((self.ranks[i], self.tax_ids[c])
+                           for i, c in enumerate(lineage) if c != -1)
+
+    def parent(self, tax_id):
+        """Return the parent of `tax_id', None if its parent is not in
+        the taxonomy.  Raises KeyError if `tax_id' is not in the taxonomy.
+        """
+
+        parent = self.parents[self.code(tax_id)]
+        return self.tax_ids[parent] if parent != -1 else None
+
+    def lca(self, tax_ids):
+        """Return the lowest common ancestor of a sequence of tax_ids"""
+
+        codes = [self.code(t) for t in tax_ids]
+        if not codes:
+            raise ValueError('tax_ids must not be empty')
+
+        lineages = self.lineages[codes]
+        common = (lineages == lineages[0]).all(axis=0) & (lineages[0] != -1)
+        return self.tax_ids[lineages[0, numpy.flatnonzero(common)[-1]]]
+
+    def descendant_codes(self, code):
+        """Return an array of codes of `code' and all of its descendants"""
+
+        depth = self.depths[code]
+        if depth == -1:
+            raise ValueError(
+                '{} is not found in its own lineage'.format(self.tax_ids[code]))
+        return numpy.flatnonzero(self.lineages[:, depth] == code)
+
+    def descendants(self, tax_id, include_self=True):
+        """Return an array of tax_ids in the subtree rooted at `tax_id'"""
+
+        code = self.code(tax_id)
+        codes = self.descendant_codes(code)
+        if not include_self:
+            codes = codes[codes != code]
+        return _objects(self.tax_ids[codes])
+
+    def inherit(self, values):
+        """Given a Series of floats indexed by tax_id return a Series
+        indexed by every tax_id in the taxonomy with the value of its most
+        specific ancestor (or itself) present in `values'.
+        """
+
+        codes = self.codes(values.index)
+        found = codes != -1
+
+        # an extra trailing nan is indexed by missing (-1) lineage codes
+        by_code = numpy.full(len(self) + 1, numpy.nan)
+        by_code[codes[found]] = values.values[found]
+        inherited = by_code[self.lineages]
+
+        present = ~numpy.isnan(inherited)
+        last = inherited.shape[1] - 1 - present[:, ::-1].argmax(axis=1)
+        inherited = inherited[numpy.arange(len(self)), last]
+
+        return pandas.Series(inherited, index=self.index)
+
+
+class TaxonomyRow(object):
+
+    """Read only view of a single row of a Taxonomy"""
+
+    __slots__ = ('taxonomy', 'code')
+
+    def __init__(self, taxonomy, code):
+        self.taxonomy = taxonomy
+        self.code = code
+
+    def __getitem__(self, column):
+        return self.taxonomy.value(self.code, column)
+
+    def get(self, column, default=None):
+        try:
+            return self[column]
+        except KeyError:
+            return default
@@ -16,14 +16,17 @@
 import os
 import bz2
 import gzip
+import json
 import logging
 import pandas
 import re
+import resource
 import shutil
 import sys
 import signal
 import contextlib
 import tempfile
+import time
 
 from itertools import takewhile, izip_longest, groupby
 from csv import DictReader
@@ -232,6 +235,137 @@ def groupbyl(li, key=None, as_dict=False):
         return groups
 
 
+class LRUCache(object):
+    """
+    Mapping holding at most `maxsize' items, discarding the least
+    recently used item when full.  Lookups are counted in `hits' and
+    `misses' (a missing key raises KeyError).
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self.items = OrderedDict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __getitem__(self, key):
+        try:
+            value = self.items.pop(key)
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self.items[key] = value  # most recently used is last
+        return value
+
+    def __setitem__(self, key, value):
+        self.items.pop(key, None)
+        if len(self.items) >= self.maxsize:
+            self.items.popitem(last=False)
+        self.items[key] = value
+
+    def clear(self):
+        self.items.clear()
+        self.hits = self.misses = 0
+
+    def __str__(self):
+        return '{} hits, {} misses, {}/{} items'.format(
+            self.hits, self.misses, len(self), self.maxsize)
+
+
+def rss():
+    """Return the current resident set size of this process in bytes or
+    None where /proc is not available.
+    """
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return None
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes"""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Timings(object):
+    """
+    Elapsed wall time, rows in and out and change in resident set size
+    of named stages, summed over every run of a stage in order of the
+    first run, and the largest peak resident set size at the end of a
+    run.  The change in resident set size is None where the current
+    resident set size is not available (see rss).  Timings from other
+    processes (eg pool workers) are added with `update'.
+    """
+
+    columns = ['stage', 'calls', 'seconds', 'rows_in', 'rows_out',
+               'rss_delta', 'peak_rss']
+
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        """Time the body of a with statement as stage `name'.  Yields a
+        dict in which rows_out may be set, and calls set to 0 if the
+        body did no work to count as a call (its time is still added).
+        """
+
+        entry = dict(rows_in=rows_in, rows_out=None, calls=1)
+        start, start_rss = time.time(), rss()
+        yield entry
+        end_rss = rss()
+        entry.update(seconds=time.time() - start,
+                     rss_delta=(None if start_rss is None
+                                else end_rss - start_rss),
+                     peak_rss=peak_rss())
+        self.add(name, entry)
+
+    def add(self, name, entry):
+        totals = self.stages.setdefault(
+            name, dict.fromkeys(self.columns[1:]))
+        for k, v in entry.items():
+            if v is None:
+                continue
+            elif k == 'peak_rss':
+                totals[k] = max(totals[k], v)
+            else:
+                totals[k] = (totals[k] or 0) + v
+
+    def update(self, other):
+        for name, entry in other.stages.items():
+            self.add(name, entry)
+
+    def rows(self):
+        return [OrderedDict([('stage', name)] +
+                            [(k, entry[k]) for k in self.columns[1:]])
+                for name, entry in self.stages.items()]
+
+    def write(self, pth):
+        """Write a csv report to `pth', json if it ends with .json"""
+
+        with opener(pth, 'w') as f:
+            if pth.endswith('.json'):
+                json.dump(self.rows(), f, indent=2)
+            else:
+                # object columns keep counts as integers and missing
+                # values empty
+                report = pandas.DataFrame(
+                    self.rows(), columns=self.columns, dtype=object)
+                report['seconds'] = report['seconds'].map('{:.3f}'.format)
+                report.to_csv(f, index=False)
+
+
 def _exit_on_signal(sig, status=None, message=None):
     def exit(sig, frame):
         if message:
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""Benchmark sequence parsing and encoding in bioy_pkg.sequtils
+
+Writes synthetic sequences to a temporary directory and reports the
+throughput of each benchmark in records/s and MB/s, for example::
+
+    python dev/benchmark_sequtils.py fastalite --records 200000 --length 1500
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bioy_pkg import sequtils  # noqa
+
+
+def fastalite_lines(handle, limit=None):
+    """The line by line parser replaced by sequtils.fastalite"""
+
+    limit = limit or -1
+
+    name, seq = '', ''
+    for line in handle:
+        if line.startswith('>'):
+            if limit != 0:
+                limit -= 1
+            else:
+                break
+
+            if name:
+                yield sequtils.SeqLite(name.split()[0], name, seq)
+
+            name, seq = line[1:].strip(), ''
+        else:
+            seq += line.strip()
+
+    if name and seq:
+        yield sequtils.SeqLite(name.split()[0], name, seq)
+
+
+def write_fasta(pth, records, length, width=60):
+    rand = random.Random(0)
+    with open(pth, 'w') as f:
+        for i in xrange(records):
+            seq = ''.join(rand.choice('ACGT') for _ in xrange(length))
+            f.write('>read{} sample=s{}\n'.format(i, i % 96))
+            f.write('\n'.join(sequtils.wrap(seq, width)) if width else seq)
+            f.write('\n')
+
+
+def report(name, records, nbytes, seconds):
+    print('{:<20} {:>10.0f} records/s {:>8.1f} MB/s {:>8.2f} s'.format(
+        name, records / seconds, nbytes / seconds / 1e6, seconds))
+
+
+def timed(func, repeat):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def bench_fastalite(args, tmpdir):
+    pth = os.path.join(tmpdir, 'seqs.fasta')
+    write_fasta(pth, args.records, args.length, args.width)
+    nbytes = os.path.getsize(pth)
+
+    def read():
+        with open(pth) as f:
+            for block in iter(lambda: f.read(sequtils.FASTA_BLOCKSIZE), ''):
+                pass
+        return args.records
+
+    def parse(parser):
+        def count():
+            with open(pth) as f:
+                return sum(1 for _ in parser(f))
+        return count
+
+    for name, func in [('read', read),
+                       ('fastalite (lines)', parse(fastalite_lines)),
+                       ('fastalite', parse(sequtils.fastalite))]:
+        records, seconds = timed(func, args.repeat)
+        report(name, records, nbytes, seconds)
+
+
+BENCHMARKS = {'fastalite': bench_fastalite}
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help='one or more of {} [all]'.format(
+                            ', '.join(sorted(BENCHMARKS))))
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--length', type=int, default=500)
+    parser.add_argument('--width', type=int, default=60,
+                        help='fasta line width (0 for one line) [%(default)s]')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='report the best of REPEAT runs [%(default)s]')
+    args = parser.parse_args(argv)
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmark(s) {}'.format(', '.join(unknown)))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name in args.benchmarks or sorted(BENCHMARKS):
+            print('# {}'.format(name))
+            BENCHMARKS[name](args, tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
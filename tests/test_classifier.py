@@ -6,11 +6,16 @@ import logging
 import os
 import csv
 from bz2 import BZ2File
+from gzip import GzipFile
 
 import filecmp
 import sys
 
+import pandas as pd
+
 from bioy_pkg import main
+from bioy_pkg.details import read_details
+from bioy_pkg.subcommands import classifier
 
 from __init__ import TestBase, TestCaseSuppressOutput, datadir as datadir
 
@@ -547,3 +552,617 @@ class TestClassifier(TestBase, TestCaseSuppressOutput):
         # Normally we would expect 4 details rows spanning 3 tax_names, lending to the classification "Streptococcus infantarius/mutans*/troglodytae"
         # With --best-n-hits, we expect 3 details rows lending to the classification
         self.assertTrue(len(names) == 2)
+
+    def test16(self):
+        """
+        Test --index built by classifier_index (compare to test06)
+        """
+
+        thisdatadir = self.thisdatadir
+
+        weights = os.path.join(thisdatadir, 'weights.csv.bz2')
+        specimen_map = os.path.join(thisdatadir, 'map.csv.bz2')
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        index = os.path.join(outdir, 'references.bundle')
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+        details_out = os.path.join(outdir, 'details.csv.bz2')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test06', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test06', 'details.csv.bz2')
+
+        main(['classifier_index',
+              '--copy-numbers', self.copy_numbers,
+              seq_info, taxonomy, index])
+
+        args = [
+            '--max-identity', '100',
+            '--min-identity', '99',
+            '--specimen-map', specimen_map,
+            '--weights', weights,
+            '--index', index,
+            '--out', classify_out,
+            '--details-out', details_out,
+            blast]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+        self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+        # optional inputs that differ from the bundle are an error
+        rank_thresholds = os.path.join(thisdatadir, 'rank_thresholds.csv.bz2')
+        self.assertRaises(
+            SystemExit, self.main,
+            ['--rank-thresholds', rank_thresholds] + args)
+
+    def test17(self):
+        """
+        Test --index written and reused by the classifier (compare to test01)
+        """
+
+        thisdatadir = self.thisdatadir
+
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        index = os.path.join(outdir, 'references.bundle')
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+        details_out = os.path.join(outdir, 'details.csv.bz2')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test01', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test01', 'details.csv.bz2')
+
+        args = [
+            '--index', index,
+            '--out', classify_out,
+            '--details-out', details_out,
+            blast,
+            seq_info,
+            taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        for i in range(2):
+            self.main(args)
+            self.assertTrue(os.path.exists(index))
+            self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+            self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+    def test18(self):
+        """
+        Test --stream (compare to test06)
+        """
+
+        thisdatadir = self.thisdatadir
+
+        weights = os.path.join(thisdatadir, 'weights.csv.bz2')
+        specimen_map = os.path.join(thisdatadir, 'map.csv.bz2')
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+        details_out = os.path.join(outdir, 'details.csv.bz2')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test06', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test06', 'details.csv.bz2')
+
+        args = [
+            '--stream', '--chunksize', 50,
+            '--max-identity', '100',
+            '--min-identity', '99',
+            '--specimen-map', specimen_map,
+            '--weights', weights,
+            '--copy-numbers', self.copy_numbers,
+            '--out', classify_out,
+            '--details-out', details_out,
+            blast,
+            seq_info,
+            taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+        self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+    def test19(self):
+        """
+        Test --stream with hits of a specimen in more than one place
+        """
+
+        thisdatadir = self.thisdatadir
+
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        lines = BZ2File(os.path.join(thisdatadir, 'blast.csv.bz2')).readlines()
+        blast = os.path.join(outdir, 'blast.csv')
+        with open(blast, 'w') as f:
+            f.writelines(lines[::2] + lines[1::2])
+
+        classify_out = os.path.join(outdir, 'classifications.csv')
+
+        args = ['--stream', '--chunksize', 50,
+                '--out', classify_out,
+                blast, seq_info, taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.assertRaises(SystemExit, self.main, args)
+
+    def test20(self):
+        """
+        Test --threads classifying partitions of specimens in
+        parallel (compare to test01)
+        """
+
+        thisdatadir = self.thisdatadir
+
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+        details_out = os.path.join(outdir, 'details.csv.bz2')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test01', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test01', 'details.csv.bz2')
+
+        args = [
+            '--threads', 3,
+            '--out', classify_out,
+            '--details-out', details_out,
+            blast,
+            seq_info,
+            taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+        self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+    def test21(self):
+        """
+        Test --codes (compare to test06)
+        """
+
+        thisdatadir = self.thisdatadir
+
+        weights = os.path.join(thisdatadir, 'weights.csv.bz2')
+        specimen_map = os.path.join(thisdatadir, 'map.csv.bz2')
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+        details_out = os.path.join(outdir, 'details.csv.bz2')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test06', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test06', 'details.csv.bz2')
+
+        args = [
+            '--codes',
+            '--max-identity', '100',
+            '--min-identity', '99',
+            '--specimen-map', specimen_map,
+            '--weights', weights,
+            '--copy-numbers', self.copy_numbers,
+            '--out', classify_out,
+            '--details-out', details_out,
+            blast,
+            seq_info,
+            taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+        self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+    def test22(self):
+        """
+        Test --timings report (compare to test01)
+        """
+
+        thisdatadir = self.thisdatadir
+
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        timings = os.path.join(outdir, 'timings.csv')
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+        details_out = os.path.join(outdir, 'details.csv.bz2')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test01', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test01', 'details.csv.bz2')
+
+        args = [
+            '--timings', timings,
+            '--out', classify_out,
+            '--details-out', details_out,
+            blast,
+            seq_info,
+            taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+        self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+        with open(timings) as f:
+            stages = [row['stage'] for row in csv.DictReader(f)]
+        for stage in ['loading blast results', 'loading references',
+                      'selecting valid hits', 'details', 'writing']:
+            self.assertIn(stage, stages)
+
+    def test23(self):
+        """
+        Test --batch manifest (compare to test01, test02 and test03)
+        """
+
+        thisdatadir = self.thisdatadir
+
+        weights = os.path.join(thisdatadir, 'weights.csv.bz2')
+        specimen_map = os.path.join(thisdatadir, 'map.csv.bz2')
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        tests = [('test01', '', ''),
+                 ('test02', '', weights),
+                 ('test03', specimen_map, '')]
+
+        manifest = os.path.join(outdir, 'manifest.csv')
+        with open(manifest, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['blast_file', 'specimen_map', 'weights', 'out',
+                             'details_out'])
+            for test, spec_map, weight in tests:
+                writer.writerow([
+                    blast, spec_map, weight,
+                    os.path.join(outdir, test + '.classifications.csv.bz2'),
+                    os.path.join(outdir, test + '.details.csv.bz2')])
+
+        args = ['--batch', manifest, seq_info, taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        for test, _, _ in tests:
+            for out in ['classifications.csv.bz2', 'details.csv.bz2']:
+                self.assertTrue(filecmp.cmp(
+                    os.path.join(thisdatadir, test, out),
+                    os.path.join(outdir, test + '.' + out)))
+
+    def test24(self):
+        """
+        Test --details-out compressed with gzip in threads (compare to
+        test01)
+        """
+
+        thisdatadir = self.thisdatadir
+
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+        details_out = os.path.join(outdir, 'details.csv.gz')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test01', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test01', 'details.csv.bz2')
+
+        args = [
+            '--threads', 3,
+            '--out', classify_out,
+            '--details-out', details_out,
+            blast,
+            seq_info,
+            taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+        self.assertEqual(GzipFile(details_out).read(),
+                         BZ2File(details_ref).read())
+
+    def test25(self):
+        """
+        Test --details-format npz (compare to test01)
+        """
+
+        thisdatadir = self.thisdatadir
+
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+        details_out = os.path.join(outdir, 'details.npz')
+
+        details_ref = os.path.join(
+            thisdatadir, 'test01', 'details.csv.bz2')
+
+        args = [
+            '--threads', 3,
+            '--details-format', 'npz',
+            '--out', classify_out,
+            '--details-out', details_out,
+            blast,
+            seq_info,
+            taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        self.main(args)
+
+        details = read_details(details_out)
+        reference = list(csv.DictReader(BZ2File(details_ref)))
+
+        self.assertEqual(len(details), len(reference))
+        self.assertEqual(details.columns.tolist(),
+                         csv.DictReader(BZ2File(details_ref)).fieldnames)
+        for column in ['specimen', 'qseqid', 'sseqid', 'tax_name']:
+            self.assertEqual(details[column].fillna('').tolist(),
+                             [row[column] for row in reference])
+        self.assertEqual(
+            ['%.2f' % p for p in details['pident'].dropna()],
+            [row['pident'] for row in reference if row['pident']])
+
+    def test26(self):
+        """
+        Test --store classifying only new specimens (compare to test01)
+        """
+
+        thisdatadir = self.thisdatadir
+
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        lines = BZ2File(os.path.join(thisdatadir, 'blast.csv.bz2')).readlines()
+        first = lines[0].split(',')[0]
+        blast = os.path.join(outdir, 'blast.csv')
+        with open(blast, 'w') as f:
+            f.writelines(l for l in lines if l.split(',')[0] != first)
+
+        store = os.path.join(outdir, 'store')
+        timings = os.path.join(outdir, 'timings.csv')
+        classify_out = os.path.join(outdir, 'classifications.csv.bz2')
+        details_out = os.path.join(outdir, 'details.csv.bz2')
+
+        classify_ref = os.path.join(
+            thisdatadir, 'test01', 'classifications.csv.bz2')
+        details_ref = os.path.join(
+            thisdatadir, 'test01', 'details.csv.bz2')
+
+        args = [
+            '--store', store,
+            '--timings', timings,
+            '--out', classify_out,
+            '--details-out', details_out,
+            blast,
+            seq_info,
+            taxonomy]
+
+        log.info(self.log_info.format(' '.join(map(str, args))))
+
+        # all but the first specimen
+        self.main(args)
+
+        # the first specimen is added
+        with open(blast, 'w') as f:
+            f.writelines(lines)
+        self.main(args)
+
+        self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+        self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+        with open(timings) as f:
+            stages = {row['stage']: row for row in csv.DictReader(f)}
+        self.assertEqual(
+            float(stages['filtering']['rows_in']),
+            len([l for l in lines if l.split(',')[0] == first]))
+
+        # nothing is classified
+        self.main(args)
+
+        self.assertTrue(filecmp.cmp(classify_ref, classify_out))
+        self.assertTrue(filecmp.cmp(details_ref, details_out))
+
+        with open(timings) as f:
+            stages = [row['stage'] for row in csv.DictReader(f)]
+        self.assertNotIn('filtering', stages)
+
+    def test27(self):
+        """
+        Test --include-ref-rank with --threads (compare to a single
+        threaded run)
+        """
+
+        thisdatadir = self.thisdatadir
+
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        outputs = []
+        for threads in [1, 2]:
+            classify_out = os.path.join(
+                outdir, 'classifications{}.csv'.format(threads))
+            details_out = os.path.join(
+                outdir, 'details{}.csv'.format(threads))
+            outputs.append((classify_out, details_out))
+
+            args = [
+                '--threads', threads,
+                '--include-ref-rank', 'species',
+                '--include-ref-rank', 'genus',
+                '--out', classify_out,
+                '--details-out', details_out,
+                blast,
+                seq_info,
+                taxonomy]
+
+            log.info(self.log_info.format(' '.join(map(str, args))))
+
+            self.main(args)
+
+        for serial, threaded in zip(*outputs):
+            self.assertTrue(filecmp.cmp(serial, threaded))
+
+    def test28(self):
+        """
+        Test --include-ref-rank with --stream where a chunk has no valid
+        hits (compare to a run without --stream)
+        """
+
+        thisdatadir = self.thisdatadir
+
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        # each query is a specimen, in sorted order
+        lines = BZ2File(os.path.join(thisdatadir, 'blast.csv.bz2')).readlines()
+        blast = os.path.join(outdir, 'blast.csv')
+        with open(blast, 'w') as f:
+            f.writelines(sorted(lines, key=lambda l: l.split(',')[0]))
+
+        outputs = []
+        for stream in [[], ['--stream', '--chunksize', 1]]:
+            classify_out = os.path.join(
+                outdir, 'classifications{}.csv'.format(len(outputs)))
+            details_out = os.path.join(
+                outdir, 'details{}.csv'.format(len(outputs)))
+            outputs.append((classify_out, details_out))
+
+            # one query has no hits of at least 99% identity
+            args = stream + [
+                '--min-identity', '99',
+                '--include-ref-rank', 'species',
+                '--include-ref-rank', 'genus',
+                '--out', classify_out,
+                '--details-out', details_out,
+                blast,
+                seq_info,
+                taxonomy]
+
+            log.info(self.log_info.format(' '.join(map(str, args))))
+
+            self.main(args)
+
+        for whole, streamed in zip(*outputs):
+            self.assertTrue(filecmp.cmp(whole, streamed))
+
+    def test29(self):
+        """
+        Test --batch checks the store of every manifest row before
+        classifying
+        """
+
+        thisdatadir = self.thisdatadir
+
+        taxonomy = os.path.join(thisdatadir, 'taxonomy.csv.bz2')
+        seq_info = os.path.join(thisdatadir, 'seq_info.csv.bz2')
+        blast = os.path.join(thisdatadir, 'blast.csv.bz2')
+
+        outdir = self.mkoutdir()
+
+        first = os.path.join(outdir, 'first.classifications.csv')
+        manifest = os.path.join(outdir, 'manifest.csv')
+        with open(manifest, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['blast_file', 'out', 'store'])
+            writer.writerow([blast, first, ''])
+            writer.writerow([blast,
+                             os.path.join(outdir, 'second.csv'),
+                             os.path.join(outdir, 'store')])
+
+        for options in [['--stream'], ['--details-format', 'npz']]:
+            args = options + ['--batch', manifest, seq_info, taxonomy]
+
+            log.info(self.log_info.format(' '.join(map(str, args))))
+
+            self.assertRaises(SystemExit, self.main, args)
+            self.assertFalse(os.path.exists(first))
+
+    def test30(self):
+        """
+        Test best_rank breaks ties between equally common ranks as the
+        original per group implementation (not by specificity)
+        """
+
+        ranks = ['root', 'phylum', 'class', 'order', 'family', 'genus',
+                 'species']
+        groups = [(['class', 'family', 'family', 'class'], 'class'),
+                  (['order', 'family'], 'order'),
+                  (['species', 'order', 'order', 'species', 'genus'], 'order'),
+                  (['root', 'phylum'], 'root'),
+                  (['genus', 'genus', 'species'], 'genus'),
+                  ([None], None)]
+
+        rows = [('s', h, rank)
+                for h, (group, _) in enumerate(groups) for rank in group]
+        df = pd.DataFrame(
+            rows, columns=['specimen', 'assignment_hash', 'condensed_rank'])
+
+        best = classifier.best_rank(df, ranks)
+        self.assertEqual(
+            [best.get(('s', h)) for h in range(len(groups))],
+            [expected for _, expected in groups])
@@ -0,0 +1,158 @@
+"""
+Test classifier_serve
+"""
+
+import argparse
+import httplib
+import json
+import logging
+import os
+import threading
+
+from bz2 import BZ2File
+
+from bioy_pkg.subcommands import classifier, classifier_serve
+
+from __init__ import TestBase, datadir as datadir
+
+log = logging.getLogger(__name__)
+
+
+class TestClassifierServe(TestBase):
+
+    thisdatadir = os.path.join(datadir, 'classifier', 'TestClassifier')
+
+    def setUp(self):
+        parser = argparse.ArgumentParser()
+        classifier_serve.build_parser(parser)
+        self.server_args = parser.parse_args([
+            os.path.join(self.thisdatadir, 'seq_info.csv.bz2'),
+            os.path.join(self.thisdatadir, 'taxonomy.csv.bz2')])
+
+        self.server = classifier_serve.ClassifierServer(
+            ('127.0.0.1', 0),
+            classifier_serve.classifier_args(self.server_args),
+            threads=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def request(self, method, url, body=None):
+        conn = httplib.HTTPConnection(*self.server.server_address)
+        try:
+            conn.request(method, url, body)
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            conn.close()
+
+    def test01(self):
+        """
+        classify (compare to classifier test01)
+        """
+
+        blast = BZ2File(os.path.join(self.thisdatadir, 'blast.csv.bz2')).read()
+        status, result = self.request('POST', '/classify?details=1', blast)
+
+        self.assertEqual(status, 200)
+        for name, out in [('classifications.csv.bz2', result['out']),
+                          ('details.csv.bz2', result['details'])]:
+            ref = BZ2File(os.path.join(self.thisdatadir, 'test01', name))
+            self.assertEqual(out, ref.read())
+
+    def test02(self):
+        """
+        status and bad requests
+        """
+
+        status, result = self.request('GET', '/')
+        self.assertEqual((status, result['status']), (200, 'ok'))
+
+        status, result = self.request('POST', '/classify?out=x', '')
+        self.assertEqual(status, 400)
+
+        status, result = self.request(
+            'POST', '/classify?min_identity=high', '')
+        self.assertEqual(status, 400)
+
+    def test03(self):
+        """
+        bad Content-Length returns 400 and a pool that is not running 500
+        """
+
+        conn = httplib.HTTPConnection(*self.server.server_address)
+        try:
+            conn.putrequest('POST', '/classify')
+            conn.putheader('Content-Length', 'many')
+            conn.endheaders()
+            response = conn.getresponse()
+            status, result = response.status, json.loads(response.read())
+        finally:
+            conn.close()
+        self.assertEqual(status, 400)
+        self.assertIn('Content-Length', result['error'])
+
+        self.server.pool.terminate()
+        self.server.pool.join()
+        status, result = self.request('POST', '/classify', '')
+        self.assertEqual(status, 500)
+        self.assertIn('error', result)
+
+    def test04(self):
+        """
+        --socket refuses to replace a file that is not a socket
+        """
+
+        outdir = self.mkoutdir()
+        address = os.path.join(outdir, 'classifier.sock')
+        with open(address, 'w') as f:
+            f.write('keep')
+
+        args = classifier_serve.classifier_args(self.server_args)
+        self.assertRaises(SystemExit, classifier_serve.ClassifierServer,
+                          address, args)
+        with open(address) as f:
+            self.assertEqual(f.read(), 'keep')
+
+    def test05(self):
+        """
+        invalid blast results return 400 and errors classifying them 500
+        """
+
+        status, result = self.request(
+            'POST', '/classify?has_header=1', 'not,a\nblast,file\n')
+        self.assertEqual(status, 400)
+        self.assertIn('error', result)
+
+        def fail(*args, **kwargs):
+            raise AssertionError('internal')
+
+        # workers are forked with the failing classify
+        classify = classifier.classify
+        classifier.classify = fail
+        try:
+            server = classifier_serve.ClassifierServer(
+                ('127.0.0.1', 0),
+                classifier_serve.classifier_args(self.server_args))
+        finally:
+            classifier.classify = classify
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            blast = BZ2File(
+                os.path.join(self.thisdatadir, 'blast.csv.bz2')).read()
+            conn = httplib.HTTPConnection(*server.server_address)
+            conn.request('POST', '/classify', blast)
+            response = conn.getresponse()
+            status, result = response.status, json.loads(response.read())
+            conn.close()
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        self.assertEqual(status, 500)
+        self.assertIn('AssertionError', result['error'])
@@ -0,0 +1,134 @@
+"""
+Test references module.
+"""
+
+import logging
+
+from os import path
+
+import numpy
+
+from bioy_pkg import references
+from bioy_pkg.references import References
+
+from __init__ import TestBase, datadir as datadir
+
+log = logging.getLogger(__name__)
+
+thisdatadir = path.join(datadir, 'classifier', 'TestClassifier')
+
+
+class TestReferences(TestBase):
+
+    seq_info = path.join(thisdatadir, 'seq_info.csv.bz2')
+    taxonomy = path.join(thisdatadir, 'taxonomy.csv.bz2')
+    copy_numbers = path.join(datadir, 'rrnDB_16S_copy_num.csv.bz2')
+
+    refs = References.from_csv(seq_info, taxonomy, copy_numbers=copy_numbers)
+
+    def test01(self):
+        """
+        test resolved thresholds match a scan of the lineage
+        """
+
+        refs = self.refs
+        taxonomy = refs.taxonomy
+        thresholds = references.load_rank_thresholds(usecols=taxonomy.ranks)
+
+        for code in range(len(taxonomy)):
+            rank = refs.threshold_ranks[code]
+            lineage = taxonomy.lineage(taxonomy.tax_ids[code])
+            found = [(taxonomy.rank_index[r], t)
+                     for r, t in lineage.items() if t in thresholds.index]
+            if found:
+                self.assertEquals(rank, found[-1][0])
+                self.assertEquals(
+                    refs.thresholds[refs.threshold_rows[code]].tolist(),
+                    thresholds.loc[found[-1][1], taxonomy.ranks].tolist())
+            else:
+                self.assertEquals(rank, -1)
+
+    def test02(self):
+        """
+        test a saved bundle loads the same reference data
+        """
+
+        outdir = self.mkoutdir()
+        bundle = path.join(outdir, 'references.bundle')
+
+        refs = self.refs
+        refs.save(bundle)
+        loaded = References.load(bundle)
+
+        self.assertEquals(loaded.hashes, refs.hashes)
+        self.assertEquals(loaded.taxonomy.ranks, refs.taxonomy.ranks)
+        self.assertTrue(
+            loaded.taxonomy.to_frame().equals(refs.taxonomy.to_frame()))
+        self.assertTrue(loaded.seq_info.equals(refs.seq_info))
+        for name in ['thresholds', 'threshold_ranks', 'threshold_rows']:
+            self.assertTrue(numpy.array_equal(
+                getattr(loaded, name), getattr(refs, name)))
+        self.assertTrue(
+            loaded.copy_number_frame().equals(refs.copy_number_frame()))
+
+    def test03(self):
+        """
+        test build reuses a current bundle and rebuilds a stale one
+        """
+
+        outdir = self.mkoutdir()
+        bundle = path.join(outdir, 'references.bundle')
+
+        refs = references.build(bundle, self.seq_info, self.taxonomy)
+        self.assertEquals(refs.changed(references.input_hashes(
+            self.seq_info, self.taxonomy)), [])
+        self.assertIsInstance(refs.thresholds, numpy.ndarray)
+        self.assertNotIsInstance(refs.thresholds, numpy.memmap)
+
+        refs = references.build(bundle, self.seq_info, self.taxonomy)
+        self.assertIsInstance(refs.thresholds, numpy.memmap)
+        self.assertIsNone(refs.copy_numbers)
+
+        refs = references.build(bundle, self.seq_info, self.taxonomy,
+                                copy_numbers=self.copy_numbers)
+        self.assertNotIsInstance(refs.thresholds, numpy.memmap)
+        self.assertIsNotNone(refs.copy_numbers)
+
+    def test04(self):
+        """
+        test loading a file that is not a bundle
+        """
+
+        self.assertRaises(ValueError, References.load, self.taxonomy)
+
+    def test05(self):
+        """
+        test lookups and selected frames of a bundle match the csv inputs
+        """
+
+        outdir = self.mkoutdir()
+        bundle = path.join(outdir, 'references.bundle')
+
+        refs = self.refs
+        refs.save(bundle)
+        loaded = References.load(bundle)
+
+        tax_ids = list(refs.taxonomy.tax_ids[::50]) + [
+            'missing', '1' * 100, None, float('nan')]
+        self.assertEquals(loaded.taxonomy.codes(tax_ids).tolist(),
+                          refs.taxonomy.codes(tax_ids).tolist())
+        self.assertEquals(loaded.taxonomy.code('1'), refs.taxonomy.code('1'))
+        self.assertRaises(KeyError, loaded.taxonomy.code, 'missing')
+
+        sseqids = list(refs.seqnames[::7]) + ['missing', None]
+        for codes in [False, True]:
+            seq_info, taxonomy = loaded.frames(sseqids, codes=codes)
+            expected_seq_info, expected_taxonomy = refs.frames(
+                sseqids, codes=codes)
+            self.assertEquals(len(seq_info), len(refs.seqnames[::7]))
+            self.assertTrue(seq_info.equals(expected_seq_info))
+            self.assertTrue(taxonomy.equals(expected_taxonomy))
+            full = refs.taxonomy.to_frame(codes=codes)
+            self.assertTrue(taxonomy.equals(full.loc[taxonomy.index]))
+            self.assertTrue(set(seq_info['tax_id'].dropna()) <=
+                            set(taxonomy.index))
@@ -0,0 +1,73 @@
+"""
+Test seqbatch module.
+"""
+
+import logging
+
+from itertools import groupby
+
+from bioy_pkg import sequtils
+from bioy_pkg.seqbatch import SeqBatch
+
+from __init__ import TestBase
+
+log = logging.getLogger(__name__)
+
+
+class TestSeqBatch(TestBase):
+
+    def setUp(self):
+        with open(self.data('ten.fasta')) as f:
+            self.seqs = list(sequtils.fastalite(f))
+        self.batch = SeqBatch.from_records(self.seqs, chunksize=3)
+
+    def test01(self):
+        """
+        records are returned as SeqLite
+        """
+
+        batch = self.batch
+        self.assertEqual(len(batch), 10)
+        self.assertEqual(list(batch), self.seqs)
+        self.assertEqual(batch[4], self.seqs[4])
+        self.assertEqual(batch[-1], self.seqs[-1])
+        self.assertEqual(batch.id_list(), [s.id for s in self.seqs])
+        self.assertEqual(batch.seq_list(), [s.seq for s in self.seqs])
+        self.assertEqual(batch.lengths.tolist(),
+                         [len(s.seq) for s in self.seqs])
+
+        with open(self.data('ten.fasta')) as f:
+            self.assertEqual(list(SeqBatch.from_fasta(f)), self.seqs)
+
+        empty = SeqBatch.from_records([])
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(list(empty), [])
+
+    def test02(self):
+        """
+        slices and sorts are views of the same arenas
+        """
+
+        batch = self.batch
+        view = batch[2:8:2]
+        self.assertEqual(list(view), self.seqs[2:8:2])
+        self.assertIs(view.arenas, batch.arenas)
+        self.assertEqual(list(view[1:]), self.seqs[4:8:2])
+
+        keys = [len(s.seq) % 3 for s in self.seqs]
+        ordered = batch.sort(keys)
+        self.assertEqual(list(ordered),
+                         sorted(self.seqs, key=lambda s: len(s.seq) % 3))
+        self.assertEqual(list(batch[batch.lengths > 1000]),
+                         [s for s in self.seqs if len(s.seq) > 1000])
+
+    def test03(self):
+        """
+        groupby matches sorted then itertools.groupby
+        """
+
+        key = lambda s: s.id[0]
+        expected = [(k, list(g))
+                    for k, g in groupby(sorted(self.seqs, key=key), key)]
+        groups = self.batch.groupby([key(s) for s in self.seqs])
+        self.assertEqual([(k, list(g)) for k, g in groups], expected)
@@ -0,0 +1,107 @@
+"""
+Test seqreader module.
+"""
+
+import logging
+
+from os import path
+
+from bioy_pkg import seqreader, sequtils
+
+from __init__ import TestBase
+
+log = logging.getLogger(__name__)
+
+
+def seq_ids(seqs):
+    return [s.id for s in seqs]
+
+
+class TestByteRanges(TestBase):
+
+    def test01(self):
+        """
+        fasta ranges start at records and cover the file
+        """
+
+        pth = self.data('ten.fasta')
+        ranges = seqreader.byte_ranges(pth, size=100)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], path.getsize(pth))
+
+        with open(pth) as f:
+            for start, stop in ranges:
+                f.seek(start)
+                self.assertEqual(f.read(1), '>')
+        self.assertEqual([b for a, b in ranges[:-1]],
+                         [a for a, b in ranges[1:]])
+
+    def test02(self):
+        """
+        fastq ranges start at records (quality lines may start with '@')
+        """
+
+        pth = self.data('16S_random.fastq')
+        with open(pth) as f:
+            starts = set()
+            offset = 0
+            for i, line in enumerate(f):
+                if i % 4 == 0:
+                    starts.add(offset)
+                offset += len(line)
+
+        for size in [1, 50, 1000]:
+            ranges = seqreader.byte_ranges(pth, 'fastq', size=size)
+            self.assertTrue(set(a for a, b in ranges) <= starts)
+            self.assertEqual(ranges[-1][1], path.getsize(pth))
+
+
+class TestReadBatches(TestBase):
+
+    def test01(self):
+        """
+        records are the same as a single process
+        """
+
+        for fname, fmt, parse in [('ten.fasta', 'fasta', sequtils.fastalite),
+                                  ('16S_random.fastq', 'fastq',
+                                   sequtils.fastqlite)]:
+            pth = self.data(fname)
+            with open(pth) as f:
+                expected = list(parse(f))
+
+            for threads in [1, 3]:
+                batches = seqreader.read_batches(
+                    pth, fmt, threads=threads, size=200)
+                records = [r for batch in batches for r in batch]
+                self.assertEqual(records, expected)
+
+    def test02(self):
+        """
+        unordered batches and a function applied in the workers
+        """
+
+        pth = self.data('ten.fasta')
+        with open(pth) as f:
+            expected = seq_ids(sequtils.fastalite(f))
+
+        batches = seqreader.read_batches(
+            pth, threads=3, ordered=False, func=seq_ids, size=100)
+        ids = [i for batch in batches for i in batch]
+        self.assertEqual(sorted(ids), sorted(expected))
+
+        with open(pth) as f:
+            ids = list(seqreader.read_records(f, threads=2, func=seq_ids))
+        self.assertEqual(ids, expected)
+
+    def test03(self):
+        """
+        compressed files are parsed in the calling process
+        """
+
+        pth = self.data('dedup/seqs.fasta.bz2')
+        with sequtils.utils.opener(pth) as f:
+            expected = seq_ids(sequtils.fastalite(f))
+
+        ids = list(seqreader.read_records(pth, threads=2, func=seq_ids))
+        self.assertEqual(ids, expected)
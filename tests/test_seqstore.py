@@ -0,0 +1,146 @@
+"""
+Test seqstore module.
+"""
+
+import logging
+import os
+import shutil
+
+from os import path
+
+from bioy_pkg import seqstore, sequtils
+
+from __init__ import TestBase
+
+log = logging.getLogger(__name__)
+
+
+class TestSeqStore(TestBase):
+
+    def setUp(self):
+        outdir = self.mkoutdir()
+        self.fasta = path.join(outdir, 'ten.fasta')
+        shutil.copy(self.data('ten.fasta'), self.fasta)
+        with open(self.fasta) as f:
+            self.seqs = list(sequtils.fastalite(f))
+
+    def test01(self):
+        """
+        records are looked up by id and selected in order of the file
+        """
+
+        store = seqstore.SeqStore(self.fasta)
+        self.assertTrue(path.exists(self.fasta + seqstore.INDEX_SUFFIX))
+        self.assertEqual(len(store), 10)
+
+        ids = [s.id for s in self.seqs]
+        self.assertEqual(store.fetch(ids[::-1]), self.seqs[::-1])
+        self.assertEqual(store[ids[3]], self.seqs[3])
+        self.assertTrue(ids[0] in store)
+        self.assertFalse('missing' in store)
+        self.assertIsNone(store.get('missing'))
+        with self.assertRaises(KeyError):
+            store.fetch([ids[0], 'missing'])
+
+        selected = store.select([ids[5], 'missing', ids[1], ids[5]])
+        self.assertEqual(list(selected), [self.seqs[1], self.seqs[5]])
+        store.close()
+
+    def test02(self):
+        """
+        the index is rebuilt when the fasta file changes
+        """
+
+        with seqstore.SeqStore(self.fasta) as store:
+            self.assertEqual(len(store), 10)
+
+        with open(self.fasta, 'a') as f:
+            f.write('>extra one\nACGT\n>H59735 again\nGG\n>b\n>last\n')
+        mtime = path.getmtime(self.fasta + seqstore.INDEX_SUFFIX)
+        os.utime(self.fasta, (mtime + 1, mtime + 1))
+
+        with seqstore.SeqStore(self.fasta) as store:
+            self.assertEqual(len(store), 12)
+            self.assertEqual(store.duplicates, 1)
+            self.assertEqual(store['extra'].seq, 'ACGT')
+            self.assertEqual(store['H59735'].description, 'H59735 again')
+            self.assertEqual(store['b'].seq, '')
+            self.assertFalse('last' in store)
+
+    def test03(self):
+        """
+        compressed files are read into memory
+        """
+
+        pth = self.data('dedup/seqs.fasta.bz2')
+        store = seqstore.load(pth)
+        self.assertIsInstance(store, seqstore.RecordDict)
+        self.assertEqual(store.duplicates, 0)
+
+        with sequtils.utils.opener(pth) as f:
+            seqs = list(sequtils.fastalite(f))
+        ids = [s.id for s in seqs[:3]]
+        self.assertEqual(list(store.select(ids[::-1])), seqs[:3])
+        self.assertEqual(list(seqstore.select(pth, ids)), seqs[:3])
+        self.assertEqual(list(seqstore.select(self.fasta, ['T70875'])),
+                         [self.seqs[1]])
+
+    def test04(self):
+        """
+        the index is rebuilt when the size of the fasta file changes
+        with the same modification time
+        """
+
+        with seqstore.SeqStore(self.fasta) as store:
+            self.assertEqual(len(store), 10)
+
+        stat = os.stat(self.fasta)
+        with open(self.fasta, 'a') as f:
+            f.write('>extra one\nACGT\n')
+        os.utime(self.fasta, (stat.st_atime, stat.st_mtime))
+
+        with seqstore.SeqStore(self.fasta) as store:
+            self.assertEqual(len(store), 11)
+            self.assertEqual(store['extra'].seq, 'ACGT')
+
+    def test05(self):
+        """
+        an index that can not be written next to the fasta file is
+        written to the user cache, or records are read into memory
+        """
+
+        outdir = path.dirname(self.fasta)
+        cache = path.join(outdir, 'cache')
+        environ = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = cache
+        try:
+            # a directory in place of FASTA.idx can not be replaced
+            os.mkdir(self.fasta + seqstore.INDEX_SUFFIX)
+            with seqstore.SeqStore(self.fasta) as store:
+                self.assertEqual(len(store), 10)
+            self.assertTrue(path.isfile(seqstore.cache_index(self.fasta)))
+
+            # the cached index is reused
+            mtime = path.getmtime(seqstore.cache_index(self.fasta))
+            with seqstore.SeqStore(self.fasta) as store:
+                self.assertEqual(store.fetch([self.seqs[2].id]),
+                                 [self.seqs[2]])
+            self.assertEqual(
+                path.getmtime(seqstore.cache_index(self.fasta)), mtime)
+
+            # nor in the cache
+            os.remove(seqstore.cache_index(self.fasta))
+            os.rmdir(path.dirname(seqstore.cache_index(self.fasta)))
+            with open(path.dirname(seqstore.cache_index(self.fasta)), 'w'):
+                pass
+            store = seqstore.load(self.fasta)
+            self.assertIsInstance(store, seqstore.RecordDict)
+            self.assertEqual(store[self.seqs[2].id], self.seqs[2])
+            self.assertEqual(
+                list(seqstore.select(self.fasta, [self.seqs[1].id])),
+                [self.seqs[1]])
+        finally:
+            if environ is None:
+                del os.environ['XDG_CACHE_HOME']
+            else:
+                os.environ['XDG_CACHE_HOME'] = environ
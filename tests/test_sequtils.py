@@ -11,6 +11,7 @@ import unittest
 
 from bz2 import BZ2File
 from collections import Counter
+from cStringIO import StringIO
 from os import path
 
 from bioy_pkg import sequtils
@@ -142,11 +143,139 @@ class TestRle(TestBase):
         self.assertEquals(rle, 'GCTCACATA')
         self.assertEquals(counts, [1, 1, 2, 1, 3, 1, 1, 1, 1])
 
+    def test03(self):
+        # longer than the recursion limit
+        seq = 'ACCGTTT' * 1000
+        e, c = sequtils.homoencode(seq)
+        self.assertEquals(seq, sequtils.homodecode(e, c))
+
+
+class TestRleMany(TestBase):
+
+    seqs = ['GCTTCAAACATA', '', 'aaa', 'T', 'TTGGA']
+
+    def test01(self):
+        rle_seqs, counts, offsets = sequtils.homoencode_many(self.seqs)
+        for i, seq in enumerate(self.seqs):
+            rle, c = sequtils.homoencode(seq) if seq else ('', [])
+            self.assertEquals(rle_seqs[i], rle)
+            self.assertEquals(list(counts[offsets[i]:offsets[i + 1]]), c)
+
+    def test02(self):
+        rle_seqs, counts, offsets = sequtils.homoencode_many(self.seqs)
+        decoded = sequtils.homodecode_many(rle_seqs, counts, offsets)
+        self.assertEquals(decoded, [s.upper() for s in self.seqs])
+
+    def test03(self):
+        # gaps and sequences longer than their counts as in homodecode
+        seqs = ['A-C=G', 'ACGTA', '-']
+        counts = [2, 3, 4, 1, 2, 5]
+        offsets = [0, 3, 5, 6]
+        self.assertEquals(
+            sequtils.homodecode_many(seqs, counts, offsets),
+            [sequtils.homodecode(s, counts[i:j])
+             for s, i, j in zip(seqs, offsets, offsets[1:])])
+
+    def test04(self):
+        rle_seqs, counts, offsets = sequtils.homoencode_many(self.seqs)
+        chars = sequtils.to_ascii_many(counts, offsets)
+        self.assertEquals(
+            chars, [sequtils.to_ascii(sequtils.homoencode(s)[1]) if s else ''
+                    for s in self.seqs])
+        c, o = sequtils.from_ascii_many(chars)
+        self.assertEquals(list(c), list(counts))
+        self.assertEquals(list(o), list(offsets))
+
+    def test05(self):
+        self.assertRaises(ValueError, sequtils.to_ascii_many, [1, 79], [0, 2])
+
+
+class TestPackedSeq(TestBase):
+
+    def test01(self):
+        """
+        sequences round trip, upper cased, with exceptions
+        """
+
+        seqs = ['', 'A', 'acgt', 'ACGTN', 'AC-GT', 'RYACGTAC', 'TTTTTTTTT']
+        packed = sequtils.pack_seqs(seqs)
+        self.assertEqual([str(p) for p in packed], [s.upper() for s in seqs])
+        self.assertEqual(packed, [sequtils.PackedSeq(s) for s in seqs])
+        self.assertEqual(packed[2].length, 4)
+        self.assertEqual(len(packed[2].packed), 1)
+        self.assertEqual(packed[3].exceptions, ((4, 'N'),))
+
+    def test02(self):
+        """
+        equality and hashing by value
+        """
+
+        a, b, c, d = sequtils.pack_seqs(['ACGT', 'acgt', 'ACGTA', 'ACGN'])
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertNotEqual(a, c)
+        self.assertNotEqual(sequtils.PackedSeq('A'), sequtils.PackedSeq('AA'))
+        self.assertNotEqual(d, sequtils.PackedSeq('ACGA'))
+        self.assertEqual(len({a, b, c, d}), 3)
+        self.assertEqual(cPickle.loads(cPickle.dumps(d, 2)), d)
+
+    def test03(self):
+        """
+        reverse complement and k-mers
+        """
+
+        p = sequtils.PackedSeq('AACGTR-C')
+        self.assertEqual(str(p.reverse_complement()), 'G-YACGTT')
+        self.assertEqual(p.reverse_complement().reverse_complement(), p)
+
+        # AAC, ACG, CGT (k-mers with R or - are skipped)
+        self.assertEqual(p.kmers(3).tolist(), [1, 6, 27])
+        self.assertEqual(sequtils.PackedSeq('AC').kmers(3).tolist(), [])
+
 
 class TestDecodeAlignment(TestBase):
 
     def test01(self):
-        pass
+        s1, s2 = sequtils.homodecodealignment(
+            'AC-T', [2, 1, 3], 'A-GT', [1, 2, 1])
+        self.assertEquals(s1, 'AAC--TTT')
+        self.assertEquals(s2, 'A=-GGT==')
+
+    def test02(self):
+        # the rest of the longer sequence is decoded as is
+        s1, s2 = sequtils.homodecodealignment('AC', [2, 1], 'A', [1])
+        self.assertEquals(s1, 'AAC')
+        self.assertEquals(s2, 'A=')
+
+    def test03(self):
+        # longer than the recursion limit
+        s1, s2 = sequtils.homodecodealignment(
+            'A' * 2000, [2] * 2000, 'C' * 2000, [1] * 2000)
+        self.assertEquals(s1, 'A' * 4000)
+        self.assertEquals(s2, 'C=' * 2000)
+
+    def test04(self):
+        alignments = [('AC-T', [2, 1, 3], 'A-GT', [1, 2, 1]),
+                      ('', [], '', []),
+                      ('AC', [2, 1], 'A', [1]),
+                      ('-G', [1], 'TG', [4, 2])]
+        seqs1, counts1, seqs2, counts2 = zip(*alignments)
+        offsets1 = [0, 3, 3, 5, 6]
+        offsets2 = [0, 3, 3, 4, 6]
+        decoded = sequtils.homodecodealignment_many(
+            seqs1, sum(counts1, []), offsets1,
+            seqs2, sum(counts2, []), offsets2)
+        self.assertEquals(
+            zip(*decoded),
+            [sequtils.homodecodealignment(*a) for a in alignments])
+
+    def test05(self):
+        aligns = [dict(t_name='a', t_seq='AC-T', q_name='b', q_seq='A-GT')]
+        decoding = dict(a=sequtils.to_ascii([2, 1, 3]),
+                        b=sequtils.to_ascii([1, 2, 1]))
+        aligns = list(sequtils.decode_alignments(aligns, decoding))
+        self.assertEquals(aligns[0]['t_seq'], 'AAC--TTT')
+        self.assertEquals(aligns[0]['q_seq'], 'A=-GGT==')
 
 
 class TestErrorCounting(TestBase):
@@ -275,6 +404,73 @@ class TestErrorCounting(TestBase):
         }
 
 
+class TestItemizeErrorsMany(TestBase):
+
+    def test01(self):
+        refs = ['GATTA-CATA-', 'GCTTAACATAG', '']
+        queries = ['GCTTAACATAG', 'GATT-ACATA-', 'ACGT']
+        items = sequtils.itemize_errors_many(refs, queries)
+
+        self.assertEquals(set(items), {'alignment', 'i', 'ref', 'query',
+                                       'category'})
+        self.assertEquals(
+            zip(*[items[k].tolist() for k in ['alignment', 'i', 'ref',
+                                              'query']]),
+            [(j, e['i'], e['ref'], e['query'])
+             for j, (r, q) in enumerate(zip(refs, queries))
+             for e in sequtils.itemize_errors(r, q)])
+        self.assertEquals(
+            items['category'][items['alignment'] == 0].tolist(),
+            ['equal', 'snp', 'equal', 'indel', 'equal', 'equal', 'equal',
+             'equal'])
+
+    def test02(self):
+        # positions are relative to ref without gaps
+        ref = 'AC-T' * 2000
+        errors = sequtils.itemize_errors(ref, ref.replace('-', 'G'))
+        self.assertEquals(len(errors), 8000)
+        self.assertEquals(errors[-1], dict(i=5999, ref='T', query='T'))
+
+
+class TestConsensus(TestBase):
+
+    def seqs(self, *seqs):
+        return [sequtils.SeqLite(str(i), str(i), s) for i, s in enumerate(seqs)]
+
+    def test01(self):
+        counts = sequtils.char_counts(self.seqs('AC-', 'AM-', 'AC'))
+        self.assertEqual(counts.shape, (3, len(sequtils.PROFILE_SYMBOLS)))
+        self.assertEqual(counts[1].tolist(), [1, 3, 0, 0, 0, 0])
+        self.assertEqual(counts[2].tolist(), [0, 0, 0, 0, 2, 0])
+
+    def test02(self):
+        # ties are the IUPAC code of the tied bases
+        cons = sequtils.consensus(self.seqs('ACT', 'AGT', 'A-T'))
+        self.assertEqual(cons, 'AST')
+
+    def test03(self):
+        # gaps win only when more than half of a column
+        seqs = self.seqs('A-', 'A-', 'AC', 'AG')
+        self.assertEqual(sequtils.consensus(seqs, degap=False), 'AS')
+        seqs = self.seqs('A-', 'A-', 'AC')
+        self.assertEqual(sequtils.consensus(seqs, degap=False), 'A-')
+        self.assertEqual(sequtils.consensus(seqs), 'A')
+
+    def test04(self):
+        seqs = self.seqs('AC', 'A-', 'AC')
+        rlelist = [[2, 1], [1], [3, 2]]
+        chars, runs = sequtils.rle_counts(seqs, rlelist)
+        self.assertEqual(runs[0].tolist(), [0, 1, 1, 1])
+        self.assertEqual(runs[1].tolist(), [0, 2, 1, 0])
+        # the smallest of equally common run lengths
+        self.assertEqual(sequtils.consensus(seqs, rlelist), 'AC')
+        self.assertEqual(sequtils.cons_rles(runs, ceiling=True).tolist(),
+                         [3, 1])
+
+    def test05(self):
+        self.assertRaises(KeyError, sequtils.consensus, self.seqs('AX'))
+
+
 class TestAsciiEncoding(TestBase):
 
     def test01(self):
@@ -308,6 +504,73 @@ class TestFastaLite(TestBase):
             for seq in seqs:
                 pass
 
+    def test03(self):
+        """
+        wrapped sequences, text before the first record and a limit
+        """
+
+        fasta = ('# comment\n'
+                 '>a one\nACGT\n  acgt \n\n'
+                 '>b\n'
+                 '>c two\r\nGG\r\nTT\r\n'
+                 '>d\n')
+        seqs = list(sequtils.fastalite(StringIO(fasta)))
+        self.assertEqual(seqs, [('a', 'a one', 'ACGTacgt'),
+                                ('b', 'b', ''),
+                                ('c', 'c two', 'GGTT')])
+
+        seqs = sequtils.fastalite(StringIO(fasta), limit=1)
+        self.assertEqual([s.id for s in seqs], ['a'])
+
+    def test04(self):
+        """
+        records split across blocks
+        """
+
+        with open(self.data('five.fasta')) as f:
+            raw = f.read()
+            f.seek(0)
+            seqs = list(sequtils.fastalite(f))
+
+        for size in [1, 2, 7, 100]:
+            blocks = [raw[i:i + size] for i in xrange(0, len(raw), size)]
+            self.assertEqual(list(sequtils.fastalite(blocks)), seqs)
+
+
+class TestFastqLite(TestBase):
+
+    def test01(self):
+        """
+        records split across blocks, with and without a final newline
+        """
+
+        with open(self.data('16S_random.fastq')) as f:
+            raw = f.read()
+            f.seek(0)
+            seqs = list(sequtils.fastqlite(f))
+
+        self.assertEqual(len(seqs), raw.count('\n') / 4)
+        self.assertEqual(seqs[0].id, 'M00745:88:000000000-D060K:1:1101:10198:15450')
+        self.assertEqual(len(seqs[0].seq), len(seqs[0].qual))
+
+        for size in [1, 7, 100, 1 << 20]:
+            blocks = [raw[i:i + size] for i in xrange(0, len(raw), size)]
+            self.assertEqual(list(sequtils.fastqlite(blocks)), seqs)
+        self.assertEqual(list(sequtils.fastqlite([raw.rstrip()])), seqs)
+
+        limited = sequtils.fastqlite(StringIO(raw), limit=3)
+        self.assertEqual(list(limited), seqs[:3])
+
+    def test02(self):
+        """
+        malformed records
+        """
+
+        with self.assertRaises(ValueError):
+            list(sequtils.fastqlite(StringIO('@a\nACGT\n-\nIIII\n')))
+        with self.assertRaises(ValueError):
+            list(sequtils.fastqlite(StringIO('@a\nACGT\n+\nIIII\n@b\nAC\n')))
+
 
 class TestParseClusters(TestBase):
 
@@ -376,6 +639,32 @@ class TestCompoundAssignment(TestBase):
         for a in self.assignments:
             self.assertRaises(TypeError, sequtils.compound_assignment, a, {})
 
+    def test04(self):
+        """
+        test cached compound assignments
+        """
+
+        taxonomy = self.taxonomy
+        cache = sequtils.compound_assignment.cache
+        cache.clear()
+
+        assignments = self.assignments[:10]
+        first = [sequtils.compound_assignment(a, taxonomy)
+                 for a in assignments]
+        self.assertEquals(cache.hits, 0)
+
+        second = [sequtils.compound_assignment(list(a)[::-1], taxonomy)
+                  for a in assignments]
+        self.assertEquals(first, second)
+        self.assertEquals(cache.hits, len(assignments))
+
+        # a different taxonomy is not found in the cache
+        renamed = {k: dict(v, tax_name=v['tax_name'] + ' x')
+                   for k, v in taxonomy.items()}
+        third = [sequtils.compound_assignment(a, renamed)
+                 for a in assignments]
+        self.assertNotEquals(first, third)
+
 
 class TestCondenseAssignment(TestBase):
 
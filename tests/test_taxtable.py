@@ -0,0 +1,163 @@
+"""
+Test taxtable module.
+"""
+
+import cPickle
+import csv
+import logging
+
+from bz2 import BZ2File
+from os import path
+
+from bioy_pkg import sequtils, utils
+from bioy_pkg.taxtable import Taxonomy
+
+from __init__ import TestBase, datadir as datadir
+
+log = logging.getLogger(__name__)
+
+sequtilsdir = path.join(datadir, 'sequtils')
+
+
+class TestTaxonomy(TestBase):
+
+    taxonomy = Taxonomy.from_csv(path.join(datadir, 'taxonomy.csv.bz2'))
+
+    tax_dict = BZ2File(path.join(datadir, 'taxonomy.csv.bz2'))
+    tax_dict = {t['tax_id']: t for t in csv.DictReader(tax_dict)}
+
+    def test01(self):
+        """
+        test rows match csv.DictReader rows
+        """
+
+        for tax_id in ['1', '2', '1239', '1301', '1309']:
+            row = self.taxonomy[tax_id]
+            for k, v in self.tax_dict[tax_id].items():
+                self.assertEquals(row[k], v)
+
+    def test02(self):
+        """
+        test missing tax_id
+        """
+
+        self.assertRaises(KeyError, self.taxonomy.__getitem__, 'fake')
+        self.assertRaises(KeyError, self.taxonomy['1'].__getitem__, 'fake')
+
+    def test03(self):
+        """
+        test rank lookups
+        """
+
+        taxonomy = self.taxonomy
+        self.assertEquals(taxonomy.rank('1309'), 'species')
+        self.assertEquals(taxonomy.parent('1309'), '1301')
+        self.assertRaises(KeyError, taxonomy.parent, 'fake')
+        self.assertEquals(
+            taxonomy.at_rank(['1309', '1', 'fake'], 'genus').tolist(),
+            ['1301', None, None])
+        self.assertEquals(taxonomy.lineage('1301').values(),
+                          ['1', '131567', '2', '1239', '91061',
+                           '186826', '1300', '1301'])
+
+    def test04(self):
+        """
+        test parents derived from lineages without a parent_id column
+        """
+
+        taxonomy = self.taxonomy
+        frame = utils.read_csv(
+            path.join(datadir, 'taxonomy.csv.bz2'), dtype=str)
+        derived = Taxonomy(frame.drop('parent_id', axis=1).set_index('tax_id'))
+        self.assertEquals(derived.parents.tolist(), taxonomy.parents.tolist())
+
+    def test05(self):
+        """
+        test lowest common ancestor
+        """
+
+        lca = self.taxonomy.lca
+        self.assertEquals(lca(['1309']), '1309')
+        self.assertEquals(lca(['1309', '1308']), '1301')
+        self.assertEquals(lca(['1309', '1280']), '91061')
+        self.assertEquals(lca(['1309', '1301', '1239']), '1239')
+        self.assertRaises(ValueError, lca, [])
+
+    def test06(self):
+        """
+        test descendants match a scan of the rank columns
+        """
+
+        taxonomy = self.taxonomy
+        for tax_id, rank in [('1301', 'genus'), ('1239', 'phylum')]:
+            children = set(
+                t for t, row in self.tax_dict.items() if row[rank] == tax_id)
+            self.assertEquals(set(taxonomy.descendants(tax_id)), children)
+            children.remove(tax_id)
+            self.assertEquals(
+                set(taxonomy.descendants(tax_id, include_self=False)),
+                children)
+
+    def test07(self):
+        """
+        test condense_ids using a Taxonomy
+        """
+
+        thisdatadir = path.join(sequtilsdir, 'TestCondenseAssignment')
+
+        assignments = BZ2File(path.join(thisdatadir, 'assignments.pkl.bz2'))
+        assignments = cPickle.load(assignments)
+
+        condensed_ref = BZ2File(
+            path.join(thisdatadir, 'test01', 'assignments.pkl.bz2'))
+        condensed_ref = cPickle.load(condensed_ref)
+
+        condensed = [sequtils.condense_ids(a, self.taxonomy, max_size=3)
+                     for a in assignments]
+
+        self.assertEquals(condensed, condensed_ref)
+
+    def test08(self):
+        """
+        test compound_assignment using a Taxonomy
+        """
+
+        thisdatadir = path.join(sequtilsdir, 'TestCompoundAssignment')
+
+        assignments = BZ2File(path.join(thisdatadir, 'assignments.pkl.bz2'))
+        assignments = cPickle.load(assignments)
+
+        for a in assignments:
+            self.assertEquals(
+                sequtils.compound_assignment(a, self.taxonomy),
+                sequtils.compound_assignment(a, self.tax_dict))
+
+    def test09(self):
+        """
+        test ancestors and parents without a row in the taxtable
+        """
+
+        frame = utils.read_csv(path.join(
+            datadir, 'classifier', 'TestClassifier', 'taxonomy.csv.bz2'),
+            dtype=str).set_index('tax_id')
+        self.assertNotIn('1301', frame.index)
+
+        # genus 1301 of 1309 has no row of its own
+        taxonomy = Taxonomy(frame)
+        self.assertEquals(taxonomy['1309']['genus'], '1301')
+        self.assertEquals(taxonomy['1309']['parent_id'], '1301')
+        self.assertEquals(taxonomy.parent('1309'), '1301')
+        self.assertEquals(taxonomy.at_rank(['1309'], 'genus').tolist(),
+                          ['1301'])
+        self.assertEquals(taxonomy.lca(['1309', '1111760']), '1301')
+        self.assertEquals(taxonomy.to_frame().loc['1309', 'genus'], '1301')
+        self.assertEquals(taxonomy['1301']['tax_name'], '')
+        self.assertEquals(taxonomy.lineage('1301').values(),
+                          ['1', '131567', '2', '1239', '91061',
+                           '186826', '1300', '1301'])
+
+        # a parent_id not in the taxtable at all
+        frame.loc['1309', 'parent_id'] = 'fake'
+        taxonomy = Taxonomy(frame)
+        self.assertEquals(taxonomy['1309']['parent_id'], '')
+        self.assertIsNone(taxonomy.parent('1309'))
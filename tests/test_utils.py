@@ -2,6 +2,8 @@
 Test utils module.
 """
 
+import csv
+
 from os import path
 import unittest
 import logging
@@ -15,3 +17,89 @@ class TestUtils(TestBase):
 
     def test01(self):
         pass
+
+    def test02(self):
+        """
+        test LRUCache discards the least recently used item and counts
+        hits and misses
+        """
+
+        cache = utils.LRUCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEquals(cache['a'], 1)
+        cache['c'] = 3
+
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertRaises(KeyError, cache.__getitem__, 'b')
+        self.assertEquals(len(cache), 2)
+        self.assertEquals((cache.hits, cache.misses), (1, 1))
+
+    def test03(self):
+        """
+        test Timings sums stages over calls and other Timings
+        """
+
+        timings = utils.Timings()
+        for rows in [10, 20]:
+            with timings.stage('a', rows) as stage:
+                stage['rows_out'] = rows / 2
+
+        other = utils.Timings()
+        with other.stage('b'):
+            pass
+        timings.update(other)
+
+        rows = timings.rows()
+        self.assertEquals([r['stage'] for r in rows], ['a', 'b'])
+        self.assertEquals(rows[0]['calls'], 2)
+        self.assertEquals((rows[0]['rows_in'], rows[0]['rows_out']), (30, 15))
+        self.assertEquals((rows[1]['rows_in'], rows[1]['rows_out']),
+                          (None, None))
+        self.assertTrue(rows[0]['seconds'] >= 0)
+
+    def test04(self):
+        """
+        test Timings reports the peak rss and no rss change without /proc
+        """
+
+        timings = utils.Timings()
+        with timings.stage('a'):
+            pass
+        row = timings.rows()[0]
+        self.assertTrue(row['peak_rss'] > 0)
+
+        rss = utils.rss
+        utils.rss = lambda: None
+        try:
+            timings = utils.Timings()
+            with timings.stage('a'):
+                pass
+        finally:
+            utils.rss = rss
+        row = timings.rows()[0]
+        self.assertIsNone(row['rss_delta'])
+        self.assertTrue(row['peak_rss'] > 0)
+
+    def test05(self):
+        """
+        test Timings skips calls set to 0 and writes counts as integers
+        """
+
+        timings = utils.Timings()
+        for rows in [10, 20, None]:
+            with timings.stage('a') as stage:
+                if rows is None:
+                    stage['calls'] = 0
+                else:
+                    stage['rows_out'] = rows
+
+        outdir = self.mkoutdir()
+        pth = path.join(outdir, 'timings.csv')
+        timings.write(pth)
+        with open(pth) as f:
+            row = list(csv.DictReader(f))[0]
+        self.assertEqual((row['calls'], row['rows_in'], row['rows_out']),
+                         ('2', '', '30'))
+        self.assertRegexpMatches(row['seconds'], r'^\d+\.\d{3}$')